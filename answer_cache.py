@@ -0,0 +1,132 @@
+# answer_cache.py
+# Bounded TTL cache for /ask answers, keyed by report_id plus a normalized question, with optional
+# near-duplicate matching by token-set (Jaccard) similarity. Entries for a report are dropped when it is regenerated.
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]+")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = _PUNCTUATION_PATTERN.sub(" ", text)
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 24 * 3600, similarity_threshold: float = 0.0):
+        # similarity_threshold <= 0 disables near-duplicate matching (exact normalized matches only).
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict() # (report_id, normalized_question) -> (answer, expires_at, token_set)
+        self._keys_by_report = {}     # report_id -> set of normalized questions
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, report_id: str, question: str) -> Optional[str]:
+        normalized = normalize_question(question)
+        key = (report_id, normalized)
+        entry = self._live_entry(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[0]
+
+        if self.similarity_threshold > 0:
+            query_tokens = _question_tokens(normalized)
+            best_key, best_score = None, 0.0
+            for candidate in list(self._keys_by_report.get(report_id, ())):
+                candidate_key = (report_id, candidate)
+                candidate_entry = self._live_entry(candidate_key)
+                if candidate_entry is None:
+                    continue
+                score = _jaccard(query_tokens, candidate_entry[2])
+                if score > best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self.similar_hits += 1
+                return self._entries[best_key][0]
+
+        self.misses += 1
+        return None
+
+    def set(self, report_id: str, question: str, answer: str):
+        normalized = normalize_question(question)
+        key = (report_id, normalized)
+        self._entries[key] = (answer, time.time() + self.ttl_seconds if self.ttl_seconds else None, _question_tokens(normalized))
+        self._entries.move_to_end(key)
+        self._keys_by_report.setdefault(report_id, set()).add(normalized)
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._forget_key(evicted_key)
+            self.evictions += 1
+
+    def invalidate(self, report_id: str) -> int:
+        keys = self._keys_by_report.pop(report_id, set())
+        for normalized in keys:
+            self._entries.pop((report_id, normalized), None)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._keys_by_report.clear()
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity_threshold": self.similarity_threshold,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._entries[key]
+            self._forget_key(key)
+            return None
+        return entry
+
+    def _forget_key(self, key):
+        report_id, normalized = key
+        keys = self._keys_by_report.get(report_id)
+        if keys is not None:
+            keys.discard(normalized)
+            if not keys:
+                del self._keys_by_report[report_id]
+
+def _question_tokens(normalized: str) -> frozenset:
+    # No stopword filter: question words (when/why/who...) are what tell otherwise similar questions apart.
+    return frozenset(normalized.split())
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def create_answer_cache_from_env() -> AnswerCache:
+    return AnswerCache(
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 2000)),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 3600)),
+        similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", 0)),
+    )
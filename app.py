@@ -1,31 +1,377 @@
 # app.py
-from fastapi import FastAPI, Request, HTTPException # Removed Body as it was for PDFExportRequest
-from fastapi.responses import HTMLResponse # Removed FileResponse/Response for PDF
+from fastapi import FastAPI, Request, HTTPException, Depends, Header # Removed Body as it was for PDFExportRequest
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import binascii
+import json
+import math
+import time
+import uuid
 import uvicorn
 import os
+import secrets
+import zlib
+from collections import OrderedDict
+from typing import Optional
 # Removed tempfile, io, and PDF library imports
 
-from schemas import ResearchRequest, ReportResponse, QuestionRequest, AnswerResponse # Removed PDFExportRequest
-from services import conduct_deep_research, answer_follow_up_question, generate_report_id
+from schemas import ResearchRequest, ReportResponse, ResearchJobStatus, QuestionRequest, AnswerResponse, WarmCacheRequest, BatchResearchRequest, RefreshReportRequest, RefreshReportResponse, AreaResolution, ReportOutline, ReportSection, ReportSectionPage # Removed PDFExportRequest
+from services import conduct_deep_research, stream_deep_research, answer_follow_up_question, generate_report_id, init_http_client, close_http_client, upstream_scheduler, area_resolver
+from services import refresh_report_sections, has_reusable_sections, stale_sections, report_ttl_seconds, report_structure
+from services import RESEARCH_DEPTHS, ResearchDepth, depths_satisfying, get_research_depth, report_depth
+from upstream import UpstreamError, circuit_breaker_stats
+from scheduler import client_id_var
+from jobs import ResearchJobQueue, JobQueueFullError
+from report_store import create_report_store_from_env
+from retrieval import ReportIndex, estimate_tokens
+from answer_cache import create_answer_cache_from_env
+from report_encoding import EncodedReport, EncodedReportCache, choose_encoding, encode_body, encode_report
+from report_html import RENDERER_VERSION, html_rendering_available, render_report_fragments, rendered_fragments
+from report_parser import STRUCTURE_VERSION
+from areas import MATCH_ALIAS, MATCH_FUZZY, ResolvedArea
+from starlette.routing import Match
+import metrics
+from metrics import REGISTRY, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, PROFILE_REQUESTS, request_id_var, log_event, span, start_profile, end_profile, server_timing_header
 
 # Removed WEASYPRINT_AVAILABLE / REPORTLAB_PISA_AVAILABLE flags
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for all Perplexity calls, kept open for the lifetime of the server.
+    metrics.configure_logging()
+    init_http_client()
+    await research_job_queue.start()
+    try:
+        yield
+    finally:
+        await research_job_queue.stop()
+        await close_http_client()
+        report_store.close()
+
 app = FastAPI(
     title="AI Regional Health Analyzer",
     description="API for conducting extremely detailed regional health analysis using Perplexity AI.",
-    version="0.3.2" # Updated version
+    version="0.3.2", # Updated version
+    lifespan=lifespan
 )
 
+def _route_label(scope) -> str:
+    # The route template (e.g. /research/jobs/{job_id}) rather than the raw path, to keep metric label sets small.
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # Request id (taken from X-Request-ID or generated, echoed back and attached to structured log lines),
+    # in-flight gauge, latency histogram and one access log line per request. With PROFILE_REQUESTS=true the
+    # span breakdown is added to the log line and returned as a Server-Timing header.
+    # The client id (X-Client-ID, else the client address) is what the upstream scheduler shares capacity fairly between.
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    request_id_token = request_id_var.set(request_id)
+    client_id_token = client_id_var.set(request.headers.get("x-client-id") or (request.client.host if request.client else None))
+    profile_token = start_profile() if PROFILE_REQUESTS else None
+    route = _route_label(request.scope)
+    status = 500
+    start = time.perf_counter()
+    try:
+        with HTTP_REQUESTS_IN_FLIGHT.track_inprogress(route=route):
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        duration = time.perf_counter() - start
+        HTTP_REQUEST_DURATION.observe(duration, method=request.method, route=route, status=status)
+        profile = end_profile(profile_token) if profile_token is not None else None
+        log_fields = {"method": request.method, "path": request.url.path, "route": route, "status": status, "duration_ms": round(duration * 1000, 1)}
+        if profile is not None:
+            log_fields["spans"] = profile
+        log_event("request", **log_fields)
+        request_id_var.reset(request_id_token)
+        client_id_var.reset(client_id_token)
+    response.headers["X-Request-ID"] = request_id
+    if profile:
+        response.headers["Server-Timing"] = server_timing_header(profile)
+    return response
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
-generated_reports_cache = {} 
+# Bounded LRU memory tier + SQLite tier with per-entry TTL (see report_store.py; configured via REPORT_* env vars).
+report_store = create_report_store_from_env(BASE_DIR)
+
+def _report_from_record(record: dict) -> ReportResponse:
+    return ReportResponse(
+        report_id=record["report_id"],
+        area_name=record["area_name"],
+        depth=report_depth(record).name,
+        full_report_markdown=record["full_report_markdown"],
+        charts=record.get("charts", []),
+    )
+
+async def get_cached_report(report_id: str, resolved: ResolvedArea = None) -> Optional[ReportResponse]:
+    # resolved: the area as the client asked for it, so hits that only happen thanks to canonicalization are counted.
+    with span("report_store get"):
+        record = await report_store.get(report_id)
+    if record is None:
+        return None
+    if resolved is not None:
+        area_resolver.record_cache_hit(resolved)
+    return _report_from_record(record)
+
+research_depth_stats = {"generated": {name: 0 for name in RESEARCH_DEPTHS}, "served_by_deeper": 0}
+
+async def find_cached_report(area: str, depth: ResearchDepth, resolved: ResolvedArea = None) -> Optional[ReportResponse]:
+    # The cached report of the requested depth or, failing that, of a deeper one (see services.depths_satisfying).
+    for candidate in depths_satisfying(depth):
+        report = await get_cached_report(generate_report_id(area, candidate.name), resolved)
+        if report is not None:
+            if candidate is not depth:
+                research_depth_stats["served_by_deeper"] += 1
+                print(f"Answering {depth.name} request for area: {area} with the cached {candidate.name} report.")
+            return report
+    return None
+
+async def find_cached_report_id(area: str, depth: ResearchDepth) -> Optional[str]:
+    # The id of a stored report that would answer a request for depth, without loading it.
+    for candidate in depths_satisfying(depth):
+        report_id = generate_report_id(area, candidate.name)
+        if await report_store.contains(report_id):
+            return report_id
+    return None
+
+def resolve_depth(depth: Optional[str]) -> ResearchDepth:
+    research_depth = get_research_depth(depth)
+    if research_depth is None:
+        raise HTTPException(status_code=400, detail=f"Unknown depth '{depth}'. Valid depths: {', '.join(RESEARCH_DEPTHS)}.")
+    return research_depth
+
+def resolve_area(raw_area: str) -> ResolvedArea:
+    # Every endpoint that takes an area researches, caches and answers under its canonical name (see areas.py).
+    resolved = area_resolver.resolve(raw_area)
+    if not resolved.key:
+        raise HTTPException(status_code=400, detail="Area cannot be empty.")
+    if resolved.match in (MATCH_ALIAS, MATCH_FUZZY):
+        print(f"Resolved area '{resolved.query.strip()}' to '{resolved.name}' ({resolved.match} match, score {resolved.score:.2f}).")
+    return resolved
+
+# Serialized, hashed and compressed GET /reports/{report_id} bodies, one entry per report (see report_encoding.py).
+encoded_reports = EncodedReportCache(max_bytes=int(os.getenv("REPORT_ENCODED_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+async def get_encoded_report(record: dict) -> EncodedReport:
+    # Keyed by the record's created_at as well, so a regenerated report is re-encoded on its first request.
+    encoded = encoded_reports.get(record["report_id"], record.get("created_at"))
+    if encoded is None:
+        payload = jsonable_encoder(_report_from_record(record))
+        with span("report encode"):
+            encoded = await asyncio.to_thread(encode_report, payload, record.get("created_at"))
+        encoded_reports.set(record["report_id"], encoded)
+    return encoded
+
+# Reports pre-rendered to sanitized HTML fragments with Chart.js configs (see report_html.py), so browsers neither parse
+# the markdown nor build the charts themselves. Rendered once when a report is stored and kept in the record; the
+# encoded GET /reports/{report_id}/html bodies are cached like the JSON ones.
+REPORT_HTML_RENDERING = os.getenv("REPORT_HTML_RENDERING", "true").lower() in ("1", "true", "yes")
+if REPORT_HTML_RENDERING and not html_rendering_available():
+    print("WARNING: REPORT_HTML_RENDERING is enabled but the 'markdown-it-py' package is not installed (pip install markdown-it-py). Reports will be rendered in the browser.")
+    REPORT_HTML_RENDERING = False
+rendered_reports = EncodedReportCache(max_bytes=int(os.getenv("REPORT_HTML_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+async def render_report_html(record: dict) -> list:
+    fragments = rendered_fragments(record)
+    if fragments is None: # stored before pre-rendering (or by an older renderer)
+        with span("report render"):
+            fragments = await asyncio.to_thread(render_report_fragments, record)
+    return fragments
+
+async def get_encoded_report_html(record: dict) -> EncodedReport:
+    # NDJSON: a {"type": "report", ...} header listing the sections, then one {"type": "section", ...} line per fragment,
+    # so the page can insert the first sections while the rest are still being parsed.
+    encoded = rendered_reports.get(record["report_id"], record.get("created_at"))
+    if encoded is None:
+        fragments = await render_report_html(record)
+        header = {"type": "report", "report_id": record["report_id"], "area_name": record["area_name"],
+                  "sections": [{"key": fragment["key"], "title": fragment["title"]} for fragment in fragments]}
+        lines = [header] + [{"type": "section", "index": index, **fragment} for index, fragment in enumerate(fragments)]
+        body = "".join(json.dumps(line, separators=(",", ":"), ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+        with span("report encode"):
+            encoded = await asyncio.to_thread(encode_body, body, record.get("created_at"))
+        rendered_reports.set(record["report_id"], encoded)
+    return encoded
+
+def _encoded_response(request: Request, encoded: EncodedReport, media_type: str) -> Response:
+    coding = choose_encoding(request.headers.get("accept-encoding"), encoded.bodies)
+    headers = {"ETag": encoded.etag(coding), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if encoded.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return Response(content=encoded.bodies[coding], media_type=media_type, headers=headers)
+
+# Follow-up answers keyed by report_id + normalized question; cleared whenever that report is regenerated or purged.
+answer_cache = create_answer_cache_from_env()
+
+# Follow-up retrieval indexes, built once per report and kept in a small LRU; rebuilt from the store if evicted.
+REPORT_INDEX_CACHE_SIZE = int(os.getenv("REPORT_INDEX_CACHE_SIZE", 128))
+_report_indexes = OrderedDict()
+
+def _remember_report_index(report_id: str, markdown: str) -> ReportIndex:
+    index = ReportIndex.from_markdown(markdown)
+    _report_indexes[report_id] = index
+    _report_indexes.move_to_end(report_id)
+    while len(_report_indexes) > REPORT_INDEX_CACHE_SIZE:
+        _report_indexes.popitem(last=False)
+    return index
+
+async def get_report_index(report_id: str) -> Optional[ReportIndex]:
+    index = _report_indexes.get(report_id)
+    if index is not None:
+        _report_indexes.move_to_end(report_id)
+        return index
+    record = await report_store.get(report_id)
+    if record is None:
+        return None
+    return _remember_report_index(report_id, record["full_report_markdown"])
+
+# Single-flight bookkeeping: report_id -> asyncio.Task for the deep-research call currently running.
+# Concurrent /research requests for the same area await the same task instead of paying for another upstream call.
+_inflight_research = {}
+_research_progress = {} # report_id -> latest stage reported by conduct_deep_research
+research_coalescing_stats = {"started": 0, "coalesced": 0, "succeeded": 0, "failed": 0}
+
+def _upstream_http_exception(error: UpstreamError, action: str) -> HTTPException:
+    # Maps a typed upstream failure to our own response: 502/503/504 (see upstream.py), with Retry-After when known.
+    headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))} if error.retry_after else None
+    return HTTPException(status_code=error.status_code, detail=f"{action}: {error}", headers=headers)
+
+SSE_KEEPALIVE_SECONDS = 15.0
+
+async def _consume_research_stream(area: str, report_id: str, event_sink: asyncio.Queue, depth: str = None) -> dict:
+    report_dict_data = None
+    async for event, data in stream_deep_research(area, depth=depth):
+        if event == "status":
+            _research_progress[report_id] = data["stage"]
+        if event == "done":
+            report_dict_data = data
+        else:
+            event_sink.put_nowait((event, data))
+    return report_dict_data
+
+async def _produce_report(area: str, report_id: str, event_sink: asyncio.Queue = None, mode: str = None, refresh_sections: list = None, depth: str = None) -> dict:
+    # An expired report that still has fresh sections is refreshed section by section instead of regenerated;
+    # refresh_sections (even an empty list) asks for such a refresh explicitly, with those sections forced.
+    # report_id already belongs to depth, so a refresh keeps the stored report's depth.
+    previous = await report_store.get(report_id, include_expired=True)
+    if previous is not None and (refresh_sections is not None or has_reusable_sections(previous)):
+        def report_progress(stage: str):
+            _research_progress[report_id] = stage
+            if event_sink is not None:
+                event_sink.put_nowait(("status", {"stage": stage}))
+        return await refresh_report_sections(previous, refresh_sections, progress_callback=report_progress)
+    if event_sink is None:
+        return await conduct_deep_research(area, progress_callback=lambda stage: _research_progress.__setitem__(report_id, stage), mode=mode, depth=depth)
+    return await _consume_research_stream(area, report_id, event_sink, depth)
+
+async def _run_research_and_cache(area: str, report_id: str, event_sink: asyncio.Queue = None, mode: str = None, refresh_sections: list = None, depth: str = None) -> ReportResponse:
+    # With an event_sink the report is generated through the streaming API and every (event, data) pair is
+    # forwarded to it, followed by a None sentinel; the cached result is the same either way.
+    # Upstream failures propagate as UpstreamError, so nothing is cached for a failed run.
+    try:
+        report_dict_data = await _produce_report(area, report_id, event_sink, mode, refresh_sections, depth)
+        response_model = ReportResponse(**report_dict_data)
+        if REPORT_HTML_RENDERING:
+            with span("report render"):
+                fragments = await asyncio.to_thread(render_report_fragments, report_dict_data)
+            report_dict_data["rendered_html"] = {"version": RENDERER_VERSION, "fragments": fragments}
+        ttl = report_ttl_seconds(report_dict_data) # expires when its first section goes stale, within REPORT_TTL_SECONDS
+        if ttl is not None and report_store.default_ttl_seconds:
+            ttl = min(ttl, report_store.default_ttl_seconds)
+        await report_store.set(report_dict_data, ttl_seconds=ttl)
+        _remember_report_index(response_model.report_id, response_model.full_report_markdown)
+        answer_cache.invalidate(response_model.report_id) # answers about the previous version are stale
+        research_coalescing_stats["succeeded"] += 1
+        research_depth_stats["generated"][report_depth(report_dict_data).name] += 1
+        return response_model
+    except BaseException:
+        research_coalescing_stats["failed"] += 1
+        raise
+    finally:
+        _inflight_research.pop(report_id, None)
+        _research_progress.pop(report_id, None)
+        if event_sink is not None:
+            event_sink.put_nowait(None)
+
+def _start_research(area: str, report_id: str, event_sink: asyncio.Queue = None, mode: str = None, refresh_sections: list = None, depth: str = None) -> asyncio.Task:
+    research_coalescing_stats["started"] += 1
+    # A detached task, so one client disconnecting does not cancel the research for everyone else waiting on it.
+    task = asyncio.create_task(_run_research_and_cache(area, report_id, event_sink, mode, refresh_sections, depth))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception()) # mark exceptions as retrieved even if every waiter left
+    _inflight_research[report_id] = task
+    return task
+
+async def get_or_start_research(area: str, report_id: str, mode: str = None, depth: str = None) -> ReportResponse:
+    # Only runs of the same depth share a report id, so a quick request never waits on an in-flight deep run.
+    task = _inflight_research.get(report_id)
+    if task is not None:
+        research_coalescing_stats["coalesced"] += 1
+        print(f"Coalescing request for area: {area} onto in-flight research (ID: {report_id}).")
+    else:
+        task = _start_research(area, report_id, mode=mode, depth=depth)
+    return await asyncio.shield(task)
+
+async def _run_research_job(area: str, report_id: str, mode: str = None, client_id: str = None, depth: str = None, refresh: bool = False) -> ReportResponse:
+    # refresh=True regenerates every section even if a report is cached; the stored record is only replaced once
+    # the new one is ready, and sections that fail keep their previous text.
+    research_depth = get_research_depth(depth)
+    if not refresh:
+        cached_report = await find_cached_report(area, research_depth) # may have been filled while the job sat in the queue
+        if cached_report is not None:
+            return cached_report
+    client_id_var.set(client_id) # workers outlive requests; upstream calls are attributed to whoever submitted the job
+    if not refresh:
+        return await get_or_start_research(area, report_id, mode=mode, depth=depth)
+    task = _inflight_research.get(report_id)
+    if task is not None:
+        research_coalescing_stats["coalesced"] += 1
+    else:
+        task = _start_research(area, report_id, mode=mode, refresh_sections=list(research_depth.section_keys), depth=depth)
+    return await asyncio.shield(task)
+
+research_job_queue = ResearchJobQueue(
+    runner=_run_research_job,
+    max_workers=int(os.getenv("RESEARCH_JOB_WORKERS", 4)),
+    max_queue_depth=int(os.getenv("RESEARCH_JOB_QUEUE_DEPTH", 50)),
+    job_retention_seconds=float(os.getenv("RESEARCH_JOB_RETENTION_SECONDS", 3600)),
+)
+
+def _job_status(job) -> ResearchJobStatus:
+    if job.status == "running":
+        progress = _research_progress.get(job.report_id, "running")
+    else:
+        progress = job.status
+    return ResearchJobStatus(
+        job_id=job.job_id,
+        area_name=job.area_name,
+        report_id=job.report_id,
+        status=job.status,
+        progress=progress,
+        queue_position=research_job_queue.queue_position(job),
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+        report=job.result,
+    )
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -33,55 +379,517 @@ async def read_root(request: Request):
 
 @app.post("/research", response_model=ReportResponse)
 async def create_research_report(research_request: ResearchRequest):
-    area = research_request.area.strip()
-    if not area:
-        raise HTTPException(status_code=400, detail="Area cannot be empty.")
+    resolved = resolve_area(research_request.area)
+    area = resolved.name
+    research_depth = resolve_depth(research_request.depth)
 
-    print(f"Received comprehensive health analysis request for area: {area}")
+    print(f"Received comprehensive health analysis request ({research_depth.name}) for area: {area}")
     
-    report_id = generate_report_id(area)
-    if report_id in generated_reports_cache:
-        print(f"Returning cached report for area: {area}, ID: {report_id}")
-        return generated_reports_cache[report_id]
+    report_id = generate_report_id(area, research_depth.name)
+    cached_report = await find_cached_report(area, research_depth, resolved)
+    if cached_report is not None:
+        print(f"Returning cached report for area: {area}, ID: {cached_report.report_id}")
+        return cached_report
 
     try:
-        report_dict_data = await conduct_deep_research(area)
-        response_model = ReportResponse(**report_dict_data)
-        generated_reports_cache[response_model.report_id] = response_model
+        response_model = await get_or_start_research(area, report_id, mode=research_request.mode, depth=research_depth.name)
         print(f"Comprehensive health analysis complete for: {area}. Report ID: {response_model.report_id}")
         return response_model
+    except UpstreamError as e:
+        print(f"Research failed for area '{area}': {e}")
+        raise _upstream_http_exception(e, "Failed to conduct research")
     except Exception as e:
         print(f"Error during research for area '{area}': {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to conduct research: {str(e)}")
 
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.get("/research/stream")
+async def stream_research_report(area: str, depth: Optional[str] = None):
+    # Server-Sent Events variant of /research. Events: "status", "content" (markdown delta), "chart",
+    # then "done" with the full ReportResponse, or "failed" with {"detail": ...}.
+    # Streaming always uses the single-document prompt, since sectional mode has no single stream to relay.
+    resolved = resolve_area(area)
+    area = resolved.name
+    research_depth = resolve_depth(depth)
+    print(f"Received streaming health analysis request ({research_depth.name}) for area: {area}")
+    report_id = generate_report_id(area, research_depth.name)
+
+    async def event_stream():
+        report = await find_cached_report(area, research_depth, resolved)
+        if report is not None:
+            print(f"Streaming cached report for area: {area}, ID: {report.report_id}")
+            yield _sse_event("status", {"stage": "cached"})
+            yield _sse_event("done", report)
+            return
+
+        task = _inflight_research.get(report_id)
+        if task is None:
+            events = asyncio.Queue()
+            task = _start_research(area, report_id, event_sink=events, depth=research_depth.name)
+            while True:
+                try:
+                    item = await asyncio.wait_for(events.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n" # SSE comment so proxies don't drop an idle connection
+                    continue
+                if item is None:
+                    break
+                yield _sse_event(*item)
+        else:
+            research_coalescing_stats["coalesced"] += 1
+            print(f"Streaming request for area: {area} joined in-flight research (ID: {report_id}).")
+            yield _sse_event("status", {"stage": "joined_in_flight"})
+
+        while True:
+            try:
+                report = await asyncio.wait_for(asyncio.shield(task), timeout=SSE_KEEPALIVE_SECONDS)
+                break
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+            except UpstreamError as e:
+                print(f"Streaming research failed for area '{area}': {e}")
+                yield _sse_event("failed", {"detail": f"Failed to conduct research: {str(e)}", "status": e.status_code, "retry_after": e.retry_after})
+                return
+            except Exception as e:
+                print(f"Error during streaming research for area '{area}': {e}")
+                yield _sse_event("failed", {"detail": f"Failed to conduct research: {str(e)}"})
+                return
+        yield _sse_event("done", report)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/areas/resolve", response_model=AreaResolution)
+async def resolve_area_name(area: str, depth: Optional[str] = None):
+    # The canonical name and report id an area would be researched and cached under, without starting anything.
+    resolved = resolve_area(area)
+    research_depth = resolve_depth(depth)
+    report_id = generate_report_id(resolved.name, research_depth.name)
+    return AreaResolution(query=area, area_name=resolved.name, report_id=report_id, depth=research_depth.name, match=resolved.match,
+                          score=round(resolved.score, 4), kind=resolved.kind, country=resolved.country,
+                          cached=await find_cached_report_id(resolved.name, research_depth) is not None)
+
+BATCH_RESEARCH_CONCURRENCY = int(os.getenv("BATCH_RESEARCH_CONCURRENCY", 4))
+BATCH_RESEARCH_MAX_AREAS = int(os.getenv("BATCH_RESEARCH_MAX_AREAS", 1000))
+
+def _ndjson_line(data: dict) -> str:
+    return json.dumps(jsonable_encoder(data)) + "\n"
+
+def _encode_batch_resume_token(areas: list, mode: Optional[str], depth: Optional[str] = None) -> Optional[str]:
+    # The token is just the outstanding work (zlib-compressed JSON, URL-safe base64); it carries nothing a client couldn't send itself.
+    if not areas:
+        return None
+    payload = json.dumps({"v": 1, "areas": areas, "mode": mode, "depth": depth}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(zlib.compress(payload, 9)).decode()
+
+def _decode_batch_resume_token(token: str) -> dict:
+    try:
+        data = json.loads(zlib.decompress(base64.urlsafe_b64decode(token.encode())))
+    except (binascii.Error, zlib.error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid resume_token.")
+    if not isinstance(data, dict) or data.get("v") != 1 or not isinstance(data.get("areas"), list):
+        raise HTTPException(status_code=400, detail="Invalid resume_token.")
+    return data
+
+@app.get("/reports/{report_id}", response_model=ReportResponse)
+async def get_report(report_id: str, request: Request):
+    # Cached reports by id, for repeat views. The body is pre-compressed (gzip, or brotli if installed) and carries
+    # a strong ETag from its content hash; a matching If-None-Match gets a 304 with no body.
+    with span("report_store get"):
+        record = await report_store.get(report_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Report not found in cache. Please generate the report again.")
+    return _encoded_response(request, await get_encoded_report(record), "application/json")
+
+@app.get("/reports/{report_id}/html")
+async def get_report_html(report_id: str, request: Request):
+    # The report as sanitized HTML fragments, one per section, with ready-to-use Chart.js configs (NDJSON; see
+    # get_encoded_report_html). Cached, compressed and validated like GET /reports/{report_id}.
+    # 404 when server-side rendering is off, in which case the page renders the markdown itself.
+    if not REPORT_HTML_RENDERING:
+        raise HTTPException(status_code=404, detail="Server-side report rendering is disabled.")
+    with span("report_store get"):
+        record = await report_store.get(report_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Report not found in cache. Please generate the report again.")
+    return _encoded_response(request, await get_encoded_report_html(record), "application/x-ndjson")
+
+REPORT_SECTIONS_PAGE_MAX = int(os.getenv("REPORT_SECTIONS_PAGE_MAX", 20))
+
+async def _stored_report_structure(report_id: str):
+    # (record, structure). The structure is stored with reports since it was introduced; older records get one built
+    # per request (not stored, so it is never out of step with the record).
+    with span("report_store get"):
+        record = await report_store.get(report_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Report not found in cache. Please generate the report again.")
+    structure = record.get("structure")
+    if not structure or structure.get("version") != STRUCTURE_VERSION:
+        structure = await asyncio.to_thread(report_structure, record)
+    return record, structure
+
+def _section_response(record: dict, structure: dict, section: dict, include_html: bool) -> ReportSection:
+    references = structure["references"]
+    if section["key"] != "references":
+        references = [entry for entry in references if section["key"] in entry["cited_in"]]
+    html = None
+    if include_html:
+        html = next((fragment["html"] for fragment in rendered_fragments(record) or [] if fragment["key"] == section["key"]), None)
+    charts = record.get("charts", [])
+    return ReportSection(
+        **{field: section[field] for field in ("key", "title", "level", "start", "end", "byte_start", "byte_end", "subsections", "tables", "citations")},
+        markdown=record["full_report_markdown"][section["start"]:section["end"]],
+        html=html,
+        charts=[charts[position] for position in section["charts"] if position < len(charts)],
+        references=references,
+    )
+
+@app.get("/reports/{report_id}/outline", response_model=ReportOutline)
+async def get_report_outline(report_id: str):
+    # The section tree with offsets and per-section counts, without any report text; fetch the sections themselves
+    # with GET /reports/{report_id}/sections/{key} (or a page of them with GET /reports/{report_id}/sections).
+    record, structure = await _stored_report_structure(report_id)
+    sections = [
+        {**{field: section[field] for field in ("key", "title", "level", "start", "end", "byte_start", "byte_end", "subsections")},
+         "table_count": len(section["tables"]), "chart_count": len(section["charts"]),
+         "citation_count": sum(citation["count"] for citation in section["citations"])}
+        for section in structure["sections"]
+    ]
+    return ReportOutline(report_id=record["report_id"], area_name=record["area_name"], sections=sections, reference_count=len(structure["references"]))
+
+@app.get("/reports/{report_id}/sections", response_model=ReportSectionPage)
+async def get_report_sections(report_id: str, offset: int = 0, limit: int = 3, include_html: bool = False):
+    # Sections in report order, limit (at most REPORT_SECTIONS_PAGE_MAX) at a time.
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1.")
+    limit = min(limit, REPORT_SECTIONS_PAGE_MAX)
+    record, structure = await _stored_report_structure(report_id)
+    page = structure["sections"][offset:offset + limit]
+    return ReportSectionPage(report_id=record["report_id"], area_name=record["area_name"], total=len(structure["sections"]),
+                             offset=offset, limit=limit, sections=[_section_response(record, structure, section, include_html) for section in page])
+
+@app.get("/reports/{report_id}/sections/{section_key}", response_model=ReportSection)
+async def get_report_section(report_id: str, section_key: str, include_html: bool = False):
+    # One section: its markdown, subsections, tables as rows, charts, citations and the References entries it cites.
+    record, structure = await _stored_report_structure(report_id)
+    section = next((section for section in structure["sections"] if section["key"] == section_key), None)
+    if section is None:
+        keys = ", ".join(section["key"] for section in structure["sections"])
+        raise HTTPException(status_code=404, detail=f"Section '{section_key}' not found in this report. Sections: {keys}.")
+    return _section_response(record, structure, section, include_html)
+
+@app.post("/reports/{report_id}/refresh", response_model=RefreshReportResponse)
+async def refresh_report(report_id: str, refresh_request: RefreshReportRequest):
+    # Regenerates only the sections past their TTL (plus any listed in "sections", or all with force=true) and
+    # reuses the rest; works on expired reports too, as long as the record is still stored.
+    record = await report_store.get(report_id, include_expired=True)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Report not found in cache. Please generate the report again.")
+    section_keys = report_depth(record).section_keys # a report is refreshed at its own depth
+    requested = list(section_keys) if refresh_request.force else list(refresh_request.sections or [])
+    unknown = [key for key in requested if key not in section_keys]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown section(s): {', '.join(unknown)}. Valid sections: {', '.join(section_keys)}.")
+
+    if not requested and not stale_sections(record):
+        return RefreshReportResponse(report=_report_from_record(record), refreshed=[], reused=list(section_keys), failed={})
+
+    task = _inflight_research.get(report_id)
+    if task is not None:
+        research_coalescing_stats["coalesced"] += 1
+        print(f"Refresh request for report ID: {report_id} joined in-flight research.")
+    else:
+        task = _start_research(record["area_name"], report_id, refresh_sections=requested, depth=report_depth(record).name)
+    try:
+        report = await asyncio.shield(task)
+    except UpstreamError as e:
+        print(f"Refresh failed for report ID '{report_id}': {e}")
+        raise _upstream_http_exception(e, "Failed to refresh report")
+    record = await report_store.get(report_id, include_expired=True)
+    summary = (record or {}).get("last_refresh") or {}
+    return RefreshReportResponse(report=report, refreshed=summary.get("refreshed", []), reused=summary.get("reused", []), failed=summary.get("failed", {}))
+
+@app.post("/research/batch")
+async def research_batch(batch_request: BatchResearchRequest):
+    # Pre-generates many reports in one call. Areas are de-duplicated by report id, cached ones are skipped and the rest
+    # run at most max_concurrency at a time. The response is NDJSON, one line per event as it happens:
+    #   {"type": "batch", ...counts}, {"type": "cached", ...} per skipped area, then {"type": "report", "report": ReportResponse}
+    #   or {"type": "error", "status": ..., "detail": ...} per area in completion order, and finally {"type": "done", ...}.
+    # Every line carries the resume_token for the areas still outstanding (failed ones included); posting it back
+    # continues the batch without regenerating anything that already completed. Reports that finish after the client
+    # disconnects are still cached, since the research itself runs detached.
+    mode, depth = batch_request.mode, batch_request.depth
+    areas = []
+    if batch_request.resume_token:
+        resumed = _decode_batch_resume_token(batch_request.resume_token)
+        areas.extend(resumed["areas"])
+        mode = mode or resumed.get("mode")
+        depth = depth or resumed.get("depth")
+    research_depth = resolve_depth(depth)
+    depth = research_depth.name
+    areas.extend(batch_request.areas)
+    areas = [str(area).strip() for area in areas if str(area).strip()]
+    if not areas:
+        raise HTTPException(status_code=400, detail="Provide at least one area or a resume_token.")
+    if len(areas) > BATCH_RESEARCH_MAX_AREAS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_RESEARCH_MAX_AREAS} areas.")
+    if batch_request.max_concurrency is not None and batch_request.max_concurrency < 1:
+        raise HTTPException(status_code=400, detail="max_concurrency must be at least 1.")
+    concurrency = min(batch_request.max_concurrency or BATCH_RESEARCH_CONCURRENCY, BATCH_RESEARCH_CONCURRENCY)
+
+    outstanding = OrderedDict() # report_id -> canonical area name, in request order
+    resolved_areas = {} # report_id -> ResolvedArea of its first spelling
+    duplicates = []
+    for raw_area in areas:
+        resolved = area_resolver.resolve(raw_area)
+        if not resolved.key:
+            continue
+        report_id = generate_report_id(resolved.name, depth)
+        if report_id in outstanding:
+            duplicates.append({"area_name": raw_area, "report_id": report_id, "duplicate_of": outstanding[report_id]})
+        else:
+            outstanding[report_id] = resolved.name
+            resolved_areas[report_id] = resolved
+    unique_count = len(outstanding)
+    client_id = client_id_var.get()
+    print(f"Received research batch ({depth}): {len(areas)} areas, {unique_count} unique, concurrency {concurrency}.")
+
+    async def run_area(report_id: str, area: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                return report_id, await _run_research_job(area, report_id, mode=mode, client_id=client_id, depth=depth), None
+            except UpstreamError as e:
+                return report_id, None, {"status": e.status_code, "detail": f"Failed to conduct research: {e}", "retry_after": e.retry_after}
+            except Exception as e:
+                print(f"Error during batch research for area '{area}': {e}")
+                return report_id, None, {"status": 500, "detail": f"Failed to conduct research: {str(e)}"}
+
+    async def ndjson_stream():
+        cached = []
+        for report_id, area in list(outstanding.items()):
+            cached_report_id = await find_cached_report_id(area, research_depth) # this depth's report or a deeper one
+            if cached_report_id is not None:
+                area_resolver.record_cache_hit(resolved_areas[report_id])
+                cached.append({"type": "cached", "area_name": area, "report_id": cached_report_id})
+                del outstanding[report_id]
+        resume_token = _encode_batch_resume_token(list(outstanding.values()), mode, depth)
+        yield _ndjson_line({
+            "type": "batch", "areas": len(areas), "unique": unique_count, "duplicates": duplicates, "cached": len(cached),
+            "to_generate": len(outstanding), "concurrency": concurrency, "resume_token": resume_token,
+        })
+        for line in cached:
+            yield _ndjson_line({**line, "resume_token": resume_token})
+
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.create_task(run_area(report_id, area, semaphore)) for report_id, area in outstanding.items()]
+        succeeded, failed = 0, 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                report_id, report, error = await next_done
+                area = outstanding[report_id]
+                if error is None:
+                    succeeded += 1
+                    del outstanding[report_id]
+                    line = {"type": "report", "area_name": area, "report_id": report_id, "report": report}
+                else:
+                    failed += 1
+                    line = {"type": "error", "area_name": area, "report_id": report_id, **error}
+                line["resume_token"] = _encode_batch_resume_token(list(outstanding.values()), mode, depth)
+                yield _ndjson_line(line)
+        finally:
+            for task in tasks: # client went away: stop starting new areas (runs already started finish and are cached)
+                task.cancel()
+        print(f"Research batch finished: {succeeded} generated, {len(cached)} cached, {failed} failed.")
+        yield _ndjson_line({"type": "done", "generated": succeeded, "cached": len(cached), "failed": failed,
+                            "resume_token": _encode_batch_resume_token(list(outstanding.values()), mode, depth)})
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/research/jobs", response_model=ResearchJobStatus, status_code=202)
+async def create_research_job(research_request: ResearchRequest):
+    resolved = resolve_area(research_request.area)
+    area = resolved.name
+    research_depth = resolve_depth(research_request.depth)
+
+    report_id = generate_report_id(area, research_depth.name)
+    cached_report = await find_cached_report(area, research_depth, resolved)
+    if cached_report is not None:
+        print(f"Research job for area: {area} served from cache, ID: {cached_report.report_id}")
+        return _job_status(research_job_queue.add_completed(area, cached_report.report_id, cached_report))
+
+    try:
+        job = research_job_queue.submit(area, report_id, mode=research_request.mode, depth=research_depth.name, client_id=client_id_var.get())
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"{e} Please try again later.")
+    print(f"Queued research job {job.job_id} for area: {area}, ID: {report_id}")
+    return _job_status(job)
+
+@app.get("/research/jobs/{job_id}", response_model=ResearchJobStatus)
+async def get_research_job(job_id: str):
+    job = research_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Research job not found or expired.")
+    return _job_status(job)
+
 @app.post("/ask", response_model=AnswerResponse)
 async def ask_follow_up(question_request: QuestionRequest):
     report_id = question_request.report_id
     question = question_request.question.strip()
-    report_context = question_request.report_context
 
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
-    if not report_context:
-        cached_report = generated_reports_cache.get(report_id)
-        if not cached_report or not cached_report.full_text_for_follow_up:
-             raise HTTPException(status_code=400, detail="Report context is missing and not found in cache.")
-        report_context = cached_report.full_text_for_follow_up
-        print(f"Used cached report context for report ID: {report_id}")
 
-    print(f"Received follow-up question: '{question}' for report ID: {report_id}")
+    with span("answer_cache get"):
+        cached_answer = answer_cache.get(report_id, question)
+    if cached_answer is not None:
+        print(f"Returning cached answer for follow-up question: '{question}' (report ID: {report_id})")
+        return AnswerResponse(answer=cached_answer)
+
+    # Only the chunks most relevant to the question are sent upstream. Clients should send just report_id;
+    # an uploaded report_context is only used (and indexed ad hoc) when the report is no longer cached.
+    with span("retrieval index"):
+        report_index = await get_report_index(report_id)
+    from_client_context = report_index is None
+    if from_client_context:
+        if not question_request.report_context:
+            raise HTTPException(status_code=404, detail="Report not found in cache. Please generate the report again.")
+        report_index = ReportIndex.from_markdown(question_request.report_context)
+        print(f"Report ID {report_id} not cached; indexed the client-supplied report context.")
+    with span("retrieval select"):
+        report_context = report_index.select_context(question)
+
+    print(f"Received follow-up question: '{question}' for report ID: {report_id} (context ~{estimate_tokens(report_context)} of ~{report_index.total_tokens} tokens)")
 
     try:
         answer_text = await answer_follow_up_question(question, report_context)
+        if not from_client_context: # answers from client-supplied text must not be served to others under this report_id
+            answer_cache.set(report_id, question, answer_text)
         return AnswerResponse(answer=answer_text)
+    except UpstreamError as e:
+        print(f"Follow-up question failed upstream: {e}")
+        raise _upstream_http_exception(e, "Failed to get answer")
     except Exception as e:
         print(f"Error answering follow-up question: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to get answer: {str(e)}")
 
+@app.get("/stats")
+async def get_stats():
+    return {
+        "report_store": await report_store.stats(),
+        "answer_cache": answer_cache.stats(),
+        "encoded_reports": encoded_reports.stats(),
+        "rendered_reports": {**rendered_reports.stats(), "enabled": REPORT_HTML_RENDERING},
+        "research_coalescing": {**research_coalescing_stats, "in_flight": len(_inflight_research)},
+        "research_jobs": research_job_queue.stats(),
+        "upstream_circuits": circuit_breaker_stats(),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "areas": area_resolver.stats(),
+        "research_depths": {**research_depth_stats, "default": get_research_depth().name},
+    }
+
+async def _refresh_scrape_time_metrics():
+    # Cache and queue figures are kept by their owners; copy them into the registry on each scrape.
+    store_stats = await report_store.stats()
+    for tier, hits in store_stats["hits"].items():
+        metrics.REPORT_CACHE_HITS.set_total(hits, tier=tier)
+    metrics.REPORT_CACHE_MISSES.set_total(store_stats["misses"])
+    metrics.REPORT_CACHE_ENTRIES.set(store_stats["memory"]["entries"], tier="memory")
+    metrics.REPORT_CACHE_BYTES.set(store_stats["memory"]["bytes"], tier="memory")
+    if "disk" in store_stats:
+        metrics.REPORT_CACHE_ENTRIES.set(store_stats["disk"]["entries"], tier="disk")
+        metrics.REPORT_CACHE_BYTES.set(store_stats["disk"]["compressed_bytes"], tier="disk")
+
+    answer_stats = answer_cache.stats()
+    metrics.ANSWER_CACHE_HITS.set_total(answer_stats["exact_hits"], match="exact")
+    metrics.ANSWER_CACHE_HITS.set_total(answer_stats["similar_hits"], match="similar")
+    metrics.ANSWER_CACHE_MISSES.set_total(answer_stats["misses"])
+    metrics.ANSWER_CACHE_ENTRIES.set(answer_stats["entries"])
+    metrics.REPORT_INDEX_ENTRIES.set(len(_report_indexes))
+
+    job_stats = research_job_queue.stats()
+    for status, count in job_stats["jobs"].items():
+        metrics.RESEARCH_JOBS.set(count, status=status)
+    metrics.RESEARCH_JOB_QUEUE_SIZE.set(job_stats["queue_size"])
+    metrics.RESEARCH_IN_FLIGHT.set(len(_inflight_research))
+
+    area_stats = area_resolver.stats()
+    for match, count in area_stats["matches"].items():
+        metrics.AREA_RESOLUTIONS.set_total(count, match=match)
+    metrics.AREA_ALIAS_CACHE_HITS.set_total(area_stats["alias_cache_hits"])
+    for depth, count in research_depth_stats["generated"].items():
+        metrics.REPORTS_GENERATED.set_total(count, depth=depth)
+    metrics.DEEPER_REPORT_HITS.set_total(research_depth_stats["served_by_deeper"])
+
+    scheduler_stats = upstream_scheduler.stats()
+    for name, budget in [("account", scheduler_stats["account"]), *scheduler_stats["models"].items()]:
+        if budget["tokens_available"] is not None:
+            metrics.SCHEDULER_TOKENS_AVAILABLE.set(budget["tokens_available"], budget=name)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    await _refresh_scrape_time_metrics()
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    # Admin endpoints are disabled (404) unless ADMIN_API_TOKEN is set; then the X-Admin-Token header must match.
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token header.")
+
+@app.delete("/admin/reports/{report_id}", dependencies=[Depends(require_admin)])
+async def purge_report(report_id: str):
+    answer_cache.invalidate(report_id)
+    encoded_reports.invalidate(report_id)
+    rendered_reports.invalidate(report_id)
+    _report_indexes.pop(report_id, None)
+    if not await report_store.delete(report_id):
+        raise HTTPException(status_code=404, detail="Report not found in cache.")
+    print(f"Purged cached report ID: {report_id}")
+    return {"purged": 1}
+
+@app.delete("/admin/reports", dependencies=[Depends(require_admin)])
+async def purge_reports(expired_only: bool = False):
+    purged = await report_store.purge(expired_only=expired_only)
+    if not expired_only:
+        answer_cache.clear()
+        encoded_reports.clear()
+        rendered_reports.clear()
+        _report_indexes.clear()
+    print(f"Purged {purged} cached report(s) (expired_only={expired_only}).")
+    return {"purged": purged}
+
+@app.post("/admin/reports/warm", status_code=202, dependencies=[Depends(require_admin)])
+async def warm_reports(warm_request: WarmCacheRequest):
+    # Queues research jobs for areas that are not cached yet (or all of them with refresh=true).
+    research_depth = resolve_depth(warm_request.depth)
+    queued, skipped, rejected = [], [], []
+    for raw_area in warm_request.areas:
+        area = area_resolver.resolve(raw_area).name
+        if not area:
+            continue
+        report_id = generate_report_id(area, research_depth.name)
+        if not warm_request.refresh:
+            cached_report_id = await find_cached_report_id(area, research_depth)
+            if cached_report_id is not None:
+                skipped.append({"area_name": area, "report_id": cached_report_id})
+                continue
+        try:
+            job = research_job_queue.submit(area, report_id, depth=research_depth.name, client_id=client_id_var.get(), refresh=warm_request.refresh)
+            queued.append({"area_name": area, "report_id": report_id, "job_id": job.job_id})
+        except JobQueueFullError as e:
+            rejected.append({"area_name": area, "report_id": report_id, "error": str(e)})
+    print(f"Cache warm-up: {len(queued)} queued, {len(skipped)} already cached, {len(rejected)} rejected.")
+    return {"queued": queued, "skipped": skipped, "rejected": rejected}
+
 # Removed the @app.post("/export-pdf") endpoint entirely
 # Removed BackgroundTask class if it was only for PDF export
 
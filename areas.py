@@ -0,0 +1,222 @@
+# areas.py
+# Canonical area names, so "Kerala", "kerala, India", "Kerala State" and "  Kerala" share one report id.
+# Input is normalized (Unicode, case, punctuation, whitespace), looked up in a bundled alias/gazetteer file
+# (area_aliases.json) with trailing country/state qualifiers and administrative suffixes stripped, and finally
+# fuzzy-matched with difflib to absorb typos. Areas the gazetteer does not know are keyed by their normalized text.
+import difflib
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+MATCH_EXACT = "exact"     # the input already is a canonical name
+MATCH_ALIAS = "alias"     # an alias, or a canonical name with qualifiers/suffixes stripped
+MATCH_FUZZY = "fuzzy"     # close to a known name or alias (typo)
+MATCH_UNKNOWN = "unknown" # not in the gazetteer; keyed by the normalized input
+
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]|_")
+# Tried (only) when the full text is not in the gazetteer; "Mexico City" itself is looked up before "city" is stripped.
+_AFFIX_PREFIXES = ("union territory of ", "national capital territory of ", "state of ", "city of ", "province of ")
+_AFFIX_SUFFIXES = (" union territory", " metropolitan area", " municipal corporation", " municipality", " territory",
+                   " state", " ut", " district", " province", " region", " city", " metro")
+_QUALIFIER_KINDS = ("country", "state", "territory")
+_MAX_QUALIFIERS = 2 # "Mumbai, Maharashtra, India"
+
+def normalize_area(text: str) -> str:
+    # NFKC, accents dropped, casefolded, "&" spelled out, dots removed ("U.S.A." -> "usa"), other punctuation as spaces.
+    text = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", text))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = text.casefold().replace("&", " and ").replace(".", "").replace("'", "").replace("’", "")
+    return " ".join(_PUNCTUATION_PATTERN.sub(" ", text).split())
+
+@dataclass
+class AreaEntry:
+    name: str
+    key: str
+    kind: str
+    country: str
+
+@dataclass
+class ResolvedArea:
+    query: str            # what the client sent
+    name: str             # canonical display name, used for the research prompt and returned to clients
+    key: str              # canonical key; the report id is derived from it
+    match: str            # MATCH_* constant
+    score: float = 1.0    # difflib ratio for fuzzy matches
+    kind: Optional[str] = None
+    country: Optional[str] = None
+    new_spelling: bool = True # this exact spelling was not seen recently (see AreaResolver.record_cache_hit)
+
+    @property
+    def legacy_key(self) -> str:
+        # What the report id used to be derived from (the lowercased input).
+        return self.query.strip().lower()
+
+class AreaResolver:
+    def __init__(self, entries: List[dict] = (), fuzzy_cutoff: float = 0.88, fuzzy_min_length: int = 5,
+                 memo_size: int = 4096, spelling_memory: int = 10000):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fuzzy_min_length = fuzzy_min_length
+        self.memo_size = memo_size
+        self.spelling_memory = spelling_memory
+        self._entries: List[AreaEntry] = []
+        self._index: Dict[str, AreaEntry] = {}      # normalized name or alias -> entry
+        self._qualifiers: Dict[str, str] = {}       # normalized country/state name or alias -> its country
+        self._fuzzy_keys: List[str] = []
+        self._memo = OrderedDict()                  # normalized input -> (entry, match, score)
+        self._spellings = OrderedDict()             # recently seen legacy keys (lowercased raw input)
+        self.lookups = 0
+        self.matches = {MATCH_EXACT: 0, MATCH_ALIAS: 0, MATCH_FUZZY: 0, MATCH_UNKNOWN: 0}
+        self.cache_hits = 0
+        self.alias_cache_hits = 0
+        for raw_entry in entries:
+            self._add_entry(raw_entry)
+        self._fuzzy_keys = [key for key in self._index if len(key) >= fuzzy_min_length]
+
+    @classmethod
+    def from_file(cls, path: str, **options) -> "AreaResolver":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("areas", [])
+        except FileNotFoundError:
+            print(f"WARNING: Area alias file '{path}' not found; areas will only be normalized, not canonicalized.")
+            entries = []
+        resolver = cls(entries, **options)
+        print(f"Loaded area gazetteer: {len(resolver._entries)} areas, {len(resolver._index)} names and aliases.")
+        return resolver
+
+    def _add_entry(self, raw_entry: dict):
+        name = raw_entry["name"].strip()
+        kind = raw_entry.get("kind", "area")
+        entry = AreaEntry(name=name, key=normalize_area(name), kind=kind,
+                          country=name if kind == "country" else raw_entry.get("country", ""))
+        self._entries.append(entry)
+        for alias in [name, *raw_entry.get("aliases", [])]:
+            alias_key = normalize_area(alias)
+            existing = self._index.get(alias_key)
+            if existing is not None and existing is not entry:
+                print(f"WARNING: Area alias '{alias}' is listed for both '{existing.name}' and '{name}'; keeping '{existing.name}'.")
+                continue
+            self._index[alias_key] = entry
+            if kind in _QUALIFIER_KINDS:
+                self._qualifiers.setdefault(alias_key, entry.country)
+
+    def canonical_key(self, area: str) -> str:
+        # Same key as resolve(area).key, without counting a lookup.
+        entry, _, _ = self._lookup(normalize_area(area))
+        return entry.key if entry is not None else normalize_area(area)
+
+    def resolve(self, area: str) -> ResolvedArea:
+        display = " ".join(area.split())
+        normalized = normalize_area(display)
+        entry, match, score = self._lookup(normalized)
+        if entry is None:
+            resolved = ResolvedArea(query=area, name=display, key=normalized, match=MATCH_UNKNOWN, score=0.0)
+        else:
+            resolved = ResolvedArea(query=area, name=entry.name, key=entry.key, match=match, score=score,
+                                    kind=entry.kind, country=entry.country)
+        self.lookups += 1
+        self.matches[resolved.match] += 1
+        legacy_key = resolved.legacy_key
+        resolved.new_spelling = legacy_key not in self._spellings
+        self._spellings[legacy_key] = True
+        self._spellings.move_to_end(legacy_key)
+        while len(self._spellings) > self.spelling_memory:
+            self._spellings.popitem(last=False)
+        return resolved
+
+    def record_cache_hit(self, resolved: ResolvedArea):
+        # A report cache hit that the old id (MD5 of the lowercased input) would have missed: the spelling differs
+        # from the canonical key and had not been requested recently, so no report under its own id could exist.
+        self.cache_hits += 1
+        if resolved.key != resolved.legacy_key and resolved.new_spelling:
+            self.alias_cache_hits += 1
+
+    def _lookup(self, normalized: str) -> Tuple[Optional[AreaEntry], str, float]:
+        cached = self._memo.get(normalized)
+        if cached is not None:
+            self._memo.move_to_end(normalized)
+            return cached
+        result = self._find(normalized)
+        self._memo[normalized] = result
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return result
+
+    def _find(self, normalized: str) -> Tuple[Optional[AreaEntry], str, float]:
+        if not normalized:
+            return None, MATCH_UNKNOWN, 0.0
+        forms = self._candidate_forms(normalized)
+        for form, countries in forms:
+            entry = self._index.get(form)
+            if entry is not None and self._country_agrees(entry, countries):
+                return entry, MATCH_EXACT if form == normalized == entry.key else MATCH_ALIAS, 1.0
+        best = (None, MATCH_UNKNOWN, 0.0)
+        for form, countries in forms:
+            if len(form) < self.fuzzy_min_length:
+                continue
+            for candidate in difflib.get_close_matches(form, self._fuzzy_keys, n=3, cutoff=self.fuzzy_cutoff):
+                entry = self._index[candidate]
+                score = difflib.SequenceMatcher(None, form, candidate).ratio()
+                if self._country_agrees(entry, countries) and score > best[2]:
+                    best = (entry, MATCH_FUZZY, score)
+        return best
+
+    def _candidate_forms(self, normalized: str) -> List[Tuple[str, Tuple[str, ...]]]:
+        # (form, countries of the stripped qualifiers), most specific first.
+        forms = [(normalized, ())]
+        base, countries = normalized, ()
+        for _ in range(_MAX_QUALIFIERS):
+            stripped = self._strip_qualifier(base)
+            if stripped is None:
+                break
+            base, country = stripped
+            countries += (country,)
+            forms.append((base, countries))
+        for form, form_countries in list(forms):
+            without_affixes = _strip_affixes(form)
+            if without_affixes != form:
+                forms.append((without_affixes, form_countries))
+        return forms
+
+    def _strip_qualifier(self, text: str) -> Optional[Tuple[str, str]]:
+        # Longest trailing country/state name, e.g. "kerala india" -> ("kerala", "India").
+        words = text.split()
+        for length in range(len(words) - 1, 0, -1):
+            country = self._qualifiers.get(" ".join(words[-length:]))
+            if country is not None:
+                return " ".join(words[:-length]), country
+        return None
+
+    @staticmethod
+    def _country_agrees(entry: AreaEntry, countries: Tuple[str, ...]) -> bool:
+        return all(country == entry.country for country in countries)
+
+    def stats(self) -> dict:
+        return {
+            "areas": len(self._entries), "names": len(self._index), "lookups": self.lookups, "matches": dict(self.matches),
+            "cache_hits": self.cache_hits, "alias_cache_hits": self.alias_cache_hits,
+            # Share of looked-up requests answered from cache only thanks to canonicalization.
+            "alias_hit_rate_gain": round(self.alias_cache_hits / self.lookups, 4) if self.lookups else 0.0,
+        }
+
+def _strip_affixes(text: str) -> str:
+    for prefix in _AFFIX_PREFIXES:
+        if text.startswith(prefix) and len(text) > len(prefix):
+            text = text[len(prefix):]
+            break
+    for suffix in _AFFIX_SUFFIXES:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            text = text[:-len(suffix)]
+            break
+    return text
+
+def create_area_resolver_from_env(base_dir: str) -> AreaResolver:
+    return AreaResolver.from_file(
+        os.getenv("AREA_ALIASES_PATH", os.path.join(base_dir, "area_aliases.json")),
+        fuzzy_cutoff=float(os.getenv("AREA_FUZZY_CUTOFF", 0.88)),
+        fuzzy_min_length=int(os.getenv("AREA_FUZZY_MIN_LENGTH", 5)),
+    )
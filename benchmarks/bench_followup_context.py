@@ -0,0 +1,96 @@
+# benchmarks/bench_followup_context.py
+# Compares the /ask prompt built from the full report with the BM25-selected context (retrieval.py).
+#
+#   python benchmarks/bench_followup_context.py                 # simulated upstream latency
+#   python benchmarks/bench_followup_context.py --live          # real Perplexity calls (costs money)
+#
+# Without --live, upstream latency comes from a local mock whose response time grows with prompt size
+# (--ms-per-1k-tokens), so the numbers show the relative effect of the smaller prompt, not real API timings.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services
+from retrieval import ReportIndex, estimate_tokens
+from synthetic_report import generate_report_markdown
+
+QUESTIONS = [
+    "What is the infant mortality rate?",
+    "Which government schemes cover hospital expenditure?",
+    "How many doctors and nurses are there per 1000 people?",
+    "What are the main non-communicable diseases?",
+    "What is the situation with antimicrobial resistance?",
+    "How is air pollution affecting health?",
+    "What recommendations does the report make?",
+    "What share of health spending is out-of-pocket?",
+]
+
+def _mock_upstream(ms_per_1k_tokens: float, base_ms: float):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in body["messages"])
+        await asyncio.sleep((base_ms + ms_per_1k_tokens * prompt_tokens / 1000) / 1000)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "The report states the rate is 6 per 1000 live births."}}],
+                                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 15}})
+    return handler
+
+async def _time_answers(contexts, questions):
+    latencies = []
+    for context, question in zip(contexts, questions):
+        start = time.perf_counter()
+        await services.answer_follow_up_question(question, context)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def _summary(values):
+    ordered = sorted(values)
+    return f"mean {statistics.mean(values):8.1f}  p50 {ordered[len(ordered) // 2]:8.1f}  max {ordered[-1]:8.1f}"
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--report-bytes", type=int, default=45_000, help="size of the synthetic report (~5000+ words is ~40 KB)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true", help="call the real API configured in services.py")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=60.0, help="simulated prefill cost per 1k prompt tokens")
+    parser.add_argument("--base-ms", type=float, default=400.0, help="simulated fixed upstream latency")
+    args = parser.parse_args()
+
+    report = generate_report_markdown(target_bytes=args.report_bytes, seed=args.seed)
+    start = time.perf_counter()
+    index = ReportIndex.from_markdown(report)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    select_times, selected_contexts = [], []
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        selected_contexts.append(index.select_context(question))
+        select_times.append((time.perf_counter() - start) * 1000)
+
+    full_tokens = estimate_tokens(report)
+    selected_tokens = [estimate_tokens(context) for context in selected_contexts]
+    print(f"Report: {len(report):,} chars (~{full_tokens:,} tokens), {len(index.chunks)} chunks, index built in {build_ms:.1f} ms")
+    print(f"Selection time per question (ms): {_summary(select_times)}")
+    print(f"Prompt context tokens  full: {full_tokens:,}  retrieval: mean {statistics.mean(selected_tokens):,.0f} "
+          f"({100 * statistics.mean(selected_tokens) / full_tokens:.1f}% of full)")
+    print(f"/ask request body      full: ~{len(report) + 200:,} bytes  report_id only: ~{len(json.dumps({'report_id': 'x' * 12, 'question': QUESTIONS[0]}))} bytes")
+
+    if not args.live:
+        services._http_client = httpx.AsyncClient(transport=httpx.MockTransport(_mock_upstream(args.ms_per_1k_tokens, args.base_ms)))
+        services.PERPLEXITY_API_KEY = services.PERPLEXITY_API_KEY or "benchmark"
+    full_latencies = await _time_answers([report] * len(QUESTIONS), QUESTIONS)
+    retrieval_latencies = await _time_answers(selected_contexts, QUESTIONS)
+    label = "live" if args.live else "simulated"
+    print(f"Upstream latency ({label}, ms)  full:      {_summary(full_latencies)}")
+    print(f"Upstream latency ({label}, ms)  retrieval: {_summary(retrieval_latencies)}")
+    await services.close_http_client()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# benchmarks/bench_postprocessing.py
+# Micro-benchmark of model-output post-processing on synthetic 50-500 KB reports:
+# the previous multi-pass code path (reproduced below as legacy_*) versus report_parser.
+#
+#   python benchmarks/bench_postprocessing.py [--sizes 50 100 250 500] [--repeat 5]
+import argparse
+import ast
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report_parser import clean_model_output, extract_report
+from synthetic_report import generate_report_markdown, wrap_as_raw_model_output
+
+# --- Previous implementation (services.py before report_parser), kept here only for comparison ---
+def legacy_clean(raw_content: str) -> str:
+    content_without_thoughts = re.sub(r"<think>.*?</think>", "", raw_content, flags=re.DOTALL | re.IGNORECASE).strip()
+    report_start_marker = "Comprehensive Report on Healthcare in"
+    actual_start_index = content_without_thoughts.lower().find(report_start_marker.lower())
+    if actual_start_index > 0:
+        return content_without_thoughts[actual_start_index:].strip()
+    return content_without_thoughts.strip()
+
+def legacy_charts(full_report_markdown_content: str) -> list:
+    chart_pattern_str = r'CHART_DATA:\s*TYPE=(?P<type>\w+)\s*TITLE="(?P<title>[^"]+)"\s*LABELS=(?P<labels>\[[^\]]*\])\s*DATA=(?P<data>\[[^\]]*\])(?:\s*SOURCE="(?P<source>[^"]+)")?'
+    charts = []
+    for chart_match_item in re.finditer(chart_pattern_str, full_report_markdown_content):
+        try:
+            chart_dict = chart_match_item.groupdict()
+            chart_title = re.sub(r'[^\w\s\-\(\)%]', '', chart_dict['title']).strip()
+            chart_source = chart_dict.get('source')
+            try: labels = json.loads(chart_dict['labels'])
+            except json.JSONDecodeError: labels = ast.literal_eval(chart_dict['labels'])
+            try: raw_data_points = json.loads(chart_dict['data'])
+            except json.JSONDecodeError: raw_data_points = ast.literal_eval(chart_dict['data'])
+            if not (isinstance(labels, list) and isinstance(raw_data_points, list) and len(labels) == len(raw_data_points) and len(labels) > 0):
+                continue
+            labels, raw_data_points = labels[:12], raw_data_points[:12]
+            numeric_data_points = []
+            for point in raw_data_points:
+                val_str = str(point).strip().replace('%', '')
+                cleaned_val_str = re.sub(r'[^\d\.\-eE]', '', val_str)
+                numeric_data_points.append(float(cleaned_val_str))
+            label = chart_title + (f" (Source: {chart_source})" if chart_source else "")
+            charts.append({"type": chart_dict['type'].lower(), "title": chart_title, "labels": [str(l) for l in labels],
+                           "datasets": [{"label": label, "data": numeric_data_points}], "source": chart_source})
+        except Exception:
+            continue
+    return charts
+
+def legacy_pipeline(raw: str):
+    cleaned = legacy_clean(raw)
+    return cleaned, legacy_charts(cleaned)
+
+def new_pipeline(raw: str):
+    extracted = extract_report(clean_model_output(raw))
+    return extracted.markdown, extracted.charts
+
+def _best_time(fn, raw: str, repeat: int) -> float:
+    with contextlib.redirect_stdout(io.StringIO()): # the parsers log skipped/truncated charts
+        fn(raw) # warm-up
+        return min(timeit.repeat(lambda: fn(raw), number=5, repeat=repeat)) / 5
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 250, 500], help="report sizes in KB")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'charts':>7} {'legacy ms':>10} {'new ms':>8} {'legacy MB/s':>12} {'new MB/s':>9} {'speedup':>8}")
+    for size_kb in args.sizes:
+        single = wrap_as_raw_model_output(generate_report_markdown(target_bytes=size_kb * 1024, seed=args.seed), seed=args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy_md, legacy_result = legacy_pipeline(single)
+            new_md, new_result = new_pipeline(single)
+        # Same output on single-series reports (directive_index is new metadata).
+        assert legacy_md == new_md, "cleaned markdown differs"
+        assert legacy_result == [{k: v for k, v in chart.items() if k != "directive_index"} for chart in new_result], "charts differ"
+
+        legacy_s = _best_time(legacy_pipeline, single, args.repeat)
+        new_s = _best_time(new_pipeline, single, args.repeat)
+        mb = len(single.encode()) / 1e6
+        print(f"{size_kb:>6}KB {len(new_result):>7} {legacy_s * 1000:>10.2f} {new_s * 1000:>8.2f} {mb / legacy_s:>12.1f} {mb / new_s:>9.1f} {legacy_s / new_s:>7.2f}x")
+
+    multi = generate_report_markdown(target_bytes=100 * 1024, seed=args.seed, multi_series_every=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_count = len(legacy_charts(multi))
+        new_count = len(extract_report(multi).charts)
+    print(f"\nMulti-series report (every 3rd chart uses DATA_SERIES_n): legacy parsed {legacy_count} charts, report_parser parsed {new_count}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# benchmarks/load_test.py
+# Offline load test: drives /research (or /research/stream) and /ask at fixed concurrency levels and reports
+# p50/p95/p99 latency, throughput, growth of the in-memory report cache and post-processing CPU time.
+#
+#   python benchmarks/load_test.py                                   # app + mock_perplexity.py in-process
+#   python benchmarks/load_test.py --concurrency 1 8 32 --latency-ms 500 --output baseline.json
+#   python benchmarks/load_test.py --baseline baseline.json          # exit code 1 on a regression
+#   python benchmarks/load_test.py --base-url http://127.0.0.1:8000  # a running server, started with
+#                                                                    # PERPLEXITY_API_BASE_URL pointing at the mock
+#
+# In-process runs never leave the machine: the app's shared HTTP client is swapped for one that routes to the mock
+# over an ASGI transport. Mock latency, errors and report contents are all derived from --seed, so two runs with the
+# same arguments issue the same upstream responses; compare results against a saved --output file to catch regressions.
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import timeit
+
+import httpx
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+MOCK_BASE_URL = "http://mock-perplexity"
+# services.py reads these at import time (synthetic_report imports it), so set them first. They only matter for
+# in-process runs: memory-only report store, no expiry, and every upstream call addressed to the mock.
+os.environ.setdefault("PERPLEXITY_API_KEY", "load-test")
+os.environ["PERPLEXITY_API_BASE_URL"] = f"{MOCK_BASE_URL}/chat/completions"
+os.environ["REPORT_STORE_BACKEND"] = "memory"
+os.environ["REPORT_TTL_SECONDS"] = "0"
+
+from mock_perplexity import add_settings_arguments, canned_report, create_mock_app, settings_from_args
+
+QUESTIONS = [
+    "What is the infant mortality rate?",
+    "Which government schemes cover hospital expenditure?",
+    "How many doctors and nurses are there per 1000 people?",
+    "What are the main non-communicable diseases?",
+    "What is the situation with antimicrobial resistance?",
+    "What share of health spending is out-of-pocket?",
+]
+# Metrics compared against --baseline, with the direction that counts as worse.
+# Post-processing is checked on the replay figure: in-run CPU times of well under a millisecond are too noisy to compare.
+REGRESSION_CHECKS = {"p95_ms": "higher", "p99_ms": "higher", "throughput_rps": "lower", "postprocess_replay_ms_per_report": "higher"}
+
+def percentile(values, pct: float):
+    # Nearest-rank percentile; None for an empty sample.
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(round(pct / 100 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == "Darwin" else peak # bytes on macOS, KB elsewhere
+
+def replay_postprocessing(raw_responses, repeat: int = 5):
+    # Best-of-N time to post-process the exact responses the mock served; stable enough for regression checks.
+    from report_parser import clean_model_output, extract_report
+    if not raw_responses:
+        return None
+    with contextlib.redirect_stdout(io.StringIO()): # the parser logs skipped/truncated charts
+        best = min(timeit.repeat(lambda: [extract_report(clean_model_output(raw)) for raw in raw_responses], number=1, repeat=repeat))
+    return round(best * 1000 / len(raw_responses), 3)
+
+class PostProcessingTimer:
+    # Wraps the report_parser functions services.py calls and accumulates the CPU time spent in them.
+    def __init__(self, services_module):
+        self.cpu_seconds = 0.0
+        self.calls = 0
+        for name in ("clean_model_output", "extract_report"):
+            setattr(services_module, name, self._timed(getattr(services_module, name)))
+
+    def _timed(self, fn):
+        def wrapper(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.cpu_seconds += time.thread_time() - start
+                self.calls += 1
+        return wrapper
+
+async def _run_phase(name: str, requests, concurrency: int, send):
+    # requests: list of request arguments; send(client_args) -> (ok, status, payload).
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses, results = [], {}, []
+
+    async def one(request_args):
+        async with semaphore:
+            start = time.perf_counter()
+            ok, status, payload = await send(request_args)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if ok:
+            latencies.append(elapsed_ms)
+            results.append(payload)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(request_args) for request_args in requests))
+    wall_seconds = time.perf_counter() - start
+    return {
+        "phase": name,
+        "requests": len(requests),
+        "succeeded": len(latencies),
+        "statuses": statuses,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        "p50_ms": _round(percentile(latencies, 50)),
+        "p95_ms": _round(percentile(latencies, 95)),
+        "p99_ms": _round(percentile(latencies, 99)),
+        "max_ms": _round(max(latencies) if latencies else None),
+    }, results
+
+def _round(value, digits: int = 1):
+    return None if value is None else round(value, digits)
+
+async def _research(client: httpx.AsyncClient, area: str, endpoint: str, mode: str, depth: str):
+    if endpoint == "stream": # always uses the single-prompt streaming path
+        response = await client.get("/research/stream", params={"area": area, "depth": depth})
+        body = response.text
+        if response.status_code != 200 or "event: done" not in body:
+            return False, response.status_code if response.status_code != 200 else "failed", None
+        done_data = body.split("event: done\ndata: ", 1)[1].split("\n\n", 1)[0]
+        return True, 200, json.loads(done_data)
+    response = await client.post("/research", json={"area": area, "mode": mode, "depth": depth})
+    if response.status_code != 200:
+        return False, response.status_code, None
+    return True, 200, response.json()
+
+async def _ask(client: httpx.AsyncClient, report_id: str, question: str):
+    response = await client.post("/ask", json={"report_id": report_id, "question": question})
+    return response.status_code == 200, response.status_code, None
+
+async def _stats(client: httpx.AsyncClient) -> dict:
+    response = await client.get("/stats")
+    return response.json() if response.status_code == 200 else {}
+
+async def run_levels(client: httpx.AsyncClient, args, timer: PostProcessingTimer = None, mock_settings=None) -> list:
+    levels = []
+    for concurrency in args.concurrency:
+        stats_before = await _stats(client)
+        rss_before = _peak_rss_kb()
+        cpu_before = time.process_time()
+        timer_before = (timer.cpu_seconds, timer.calls) if timer else None
+
+        areas = [f"Loadtest Area {args.run_label}-c{concurrency}-{i}" for i in range(args.research_requests)]
+        research_summary, reports = await _run_phase("research", areas, concurrency, lambda area: _research(client, area, args.research_endpoint, args.mode, args.depth))
+        stats_after_research = await _stats(client)
+        if timer is not None:
+            cpu_ms = (timer.cpu_seconds - timer_before[0]) * 1000
+            research_summary["postprocess_cpu_ms_total"] = round(cpu_ms, 2)
+            research_summary["postprocess_cpu_ms_per_request"] = round(cpu_ms / research_summary["succeeded"], 3) if research_summary["succeeded"] else None
+        research_summary["process_cpu_seconds"] = round(time.process_time() - cpu_before, 3) if timer is not None else None
+        if mock_settings is not None and args.mode == "single" and args.depth == "deep": # shallower depths get shorter mock reports
+            research_summary["postprocess_replay_ms_per_report"] = replay_postprocessing(
+                [canned_report(area, mock_settings.report_bytes, mock_settings.seed) for area in areas])
+
+        report_ids = [report["report_id"] for report in reports]
+        ask_summary = None
+        if report_ids and args.ask_requests:
+            asks = [(report_ids[i % len(report_ids)], QUESTIONS[(i // len(report_ids)) % len(QUESTIONS)]) for i in range(args.ask_requests)]
+            cpu_before_ask = time.process_time()
+            ask_summary, _ = await _run_phase("ask", asks, concurrency, lambda item: _ask(client, *item))
+            ask_summary["process_cpu_seconds"] = round(time.process_time() - cpu_before_ask, 3) if timer is not None else None
+        stats_after = await _stats(client)
+
+        memory_before = stats_before.get("report_store", {}).get("memory", {})
+        memory_after = stats_after_research.get("report_store", {}).get("memory", {})
+        growth = memory_after.get("bytes", 0) - memory_before.get("bytes", 0)
+        added = memory_after.get("entries", 0) - memory_before.get("entries", 0)
+        rss_after = _peak_rss_kb()
+        levels.append({
+            "concurrency": concurrency,
+            "research": research_summary,
+            "ask": ask_summary,
+            "memory": {
+                "report_cache_bytes": memory_after.get("bytes"),
+                "report_cache_entries": memory_after.get("entries"),
+                "report_cache_growth_bytes": growth,
+                "report_cache_bytes_per_report": round(growth / added) if added > 0 else None,
+                "peak_rss_growth_kb": (rss_after - rss_before) if rss_before is not None and timer is not None else None,
+            },
+            "answer_cache": stats_after.get("answer_cache"),
+        })
+    return levels
+
+async def run_in_process(args) -> list:
+    import services
+    from app import app
+
+    timer = PostProcessingTimer(services)
+    mock_settings = settings_from_args(args)
+    mock_app = create_mock_app(mock_settings)
+    async with app.router.lifespan_context(app):
+        await services.close_http_client()
+        services._http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_app), base_url=MOCK_BASE_URL, timeout=None)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app", timeout=None) as client:
+            return await run_levels(client, args, timer, mock_settings)
+
+async def run_against_server(args) -> list:
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+        return await run_levels(client, args)
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    baseline_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in results["levels"]:
+        previous = baseline_levels.get(level["concurrency"])
+        if previous is None:
+            continue
+        for phase in ("research", "ask"):
+            current_phase, previous_phase = level.get(phase) or {}, previous.get(phase) or {}
+            for metric, worse in REGRESSION_CHECKS.items():
+                current_value, previous_value = current_phase.get(metric), previous_phase.get(metric)
+                if current_value is None or not previous_value:
+                    continue
+                change = (current_value - previous_value) / previous_value
+                if (worse == "higher" and change > tolerance) or (worse == "lower" and -change > tolerance):
+                    regressions.append(f"concurrency {level['concurrency']} {phase} {metric}: {previous_value} -> {current_value} ({change:+.0%})")
+    return regressions
+
+def print_report(results: dict):
+    print(f"\n{'conc':>4} {'phase':>8} {'ok/total':>9} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'postproc ms/req':>16} {'replay ms/report':>17}")
+    for level in results["levels"]:
+        for phase in ("research", "ask"):
+            summary = level.get(phase)
+            if not summary:
+                continue
+            postprocess = summary.get("postprocess_cpu_ms_per_request")
+            replay = summary.get("postprocess_replay_ms_per_report")
+            print(f"{level['concurrency']:>4} {phase:>8} {summary['succeeded']:>4}/{summary['requests']:<4} {summary['throughput_rps'] or 0:>8.2f} "
+                  f"{summary['p50_ms'] or 0:>9.1f} {summary['p95_ms'] or 0:>9.1f} {summary['p99_ms'] or 0:>9.1f} {'' if postprocess is None else f'{postprocess:.2f}':>16} {'' if replay is None else f'{replay:.3f}':>17}")
+        memory = level["memory"]
+        print(f"     report cache: {memory['report_cache_entries']} entries, {memory['report_cache_bytes']} bytes "
+              f"(+{memory['report_cache_growth_bytes']} bytes, {memory['report_cache_bytes_per_report']} bytes/report), "
+              f"peak RSS +{memory['peak_rss_growth_kb']} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /research and /ask against the mock Perplexity API")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--research-requests", type=int, default=16, help="distinct areas researched per concurrency level")
+    parser.add_argument("--ask-requests", type=int, default=64, help="follow-up questions per concurrency level")
+    parser.add_argument("--research-endpoint", choices=["research", "stream"], default="research")
+    parser.add_argument("--mode", choices=["single", "sectional"], default="single", help="research mode sent with /research requests")
+    parser.add_argument("--depth", choices=["quick", "standard", "deep"], default="deep", help="research depth sent with research requests")
+    parser.add_argument("--run-label", default="run", help="part of every area name; change it to avoid hitting a server's cache")
+    parser.add_argument("--base-url", help="drive a running server instead of an in-process app")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier --output run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own log output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before a metric counts as a regression")
+    add_settings_arguments(parser)
+    parser.set_defaults(latency_ms=200.0, latency_jitter_ms=50.0)
+    args = parser.parse_args()
+
+    runner = run_against_server(args) if args.base_url else run_in_process(args)
+    app_log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()) # the app logs every request
+    logging.getLogger("deep_research").disabled = not args.verbose # structured request/upstream log lines (metrics.py)
+    with app_log:
+        levels = asyncio.run(runner)
+    results = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+               "python": platform.python_version(), "levels": levels}
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}.")
+
+if __name__ == "__main__":
+    main()
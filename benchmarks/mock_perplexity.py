@@ -0,0 +1,179 @@
+# benchmarks/mock_perplexity.py
+# Local stand-in for Perplexity's /chat/completions endpoint, for load tests without paying for API calls.
+# Responses are canned synthetic reports (with <think> blocks, an untagged preamble and CHART_DATA lines)
+# and everything random is derived from --seed plus the request, so repeated runs behave identically.
+#
+#   python benchmarks/mock_perplexity.py --port 8100 --latency-ms 2000 --error-rate 0.05
+#   PERPLEXITY_API_BASE_URL=http://127.0.0.1:8100/chat/completions PERPLEXITY_API_KEY=x python app.py
+#
+# load_test.py mounts create_mock_app() in-process instead, so no port is needed there.
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_report import _chart_line, _paragraph, generate_report_markdown, wrap_as_raw_model_output
+
+FOLLOW_UP_ANSWER = ("According to the report, the infant mortality rate is 6 per 1000 live births (NFHS-5, 2021), "
+                    "well below the national average, although rural districts lag behind urban ones.")
+
+_REPORT_AREA_PATTERN = re.compile(r"Comprehensive Report on Healthcare in (?P<area>.+?):")
+_REPORT_SYSTEM_PROMPT_MARKER = "report writing machine"
+_FULL_REPORT_TOKENS = 8192  # max_tokens that gets a full report_bytes report
+_FULL_SECTION_TOKENS = 4096 # and a full section_bytes section
+_SECTION_PATTERN = re.compile(r"HEALTH REPORT ON '(?P<area>[^']+)'.*?WITH THE HEADING `## (?P<heading>[^`]+)`", re.DOTALL)
+
+@dataclass
+class MockSettings:
+    latency_ms: float = 1500.0         # time before the first byte (the whole response when not streaming)
+    latency_jitter_ms: float = 250.0   # +/- uniform jitter around latency_ms
+    report_bytes: int = 45_000         # size of a canned report (~5000+ words is ~40 KB)
+    section_bytes: int = 6_000         # size of one section in sectional mode
+    stream_chunk_chars: int = 400      # content per SSE chunk when stream=true
+    stream_chunk_delay_ms: float = 5.0 # pause between SSE chunks
+    error_rate: float = 0.0            # fraction of calls answered with error_status
+    error_status: int = 503
+    retry_after: float = None          # Retry-After seconds sent with errors (None = header omitted)
+    seed: int = 7
+
+def _fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def _request_rng(settings: MockSettings, attempts: dict, payload: dict) -> random.Random:
+    # Same seed + same request + same attempt number -> same latency and error decision, whatever the concurrency.
+    # attempts counts calls per request fingerprint, so a retried request draws fresh randomness.
+    fingerprint = _fingerprint(payload)
+    attempt = attempts.get(fingerprint, 0)
+    attempts[fingerprint] = attempt + 1
+    return random.Random(f"{settings.seed}:{fingerprint}:{attempt}")
+
+@lru_cache(maxsize=256)
+def canned_report(area_name: str, report_bytes: int, seed: int) -> str:
+    area_seed = int(hashlib.md5(f"{seed}:{area_name}".encode()).hexdigest()[:8], 16)
+    return wrap_as_raw_model_output(generate_report_markdown(area_name, target_bytes=report_bytes, seed=area_seed), seed=area_seed)
+
+@lru_cache(maxsize=1024)
+def canned_section(area_name: str, heading: str, section_bytes: int, seed: int) -> str:
+    rng = random.Random(f"{seed}:{area_name}:{heading}")
+    blocks = [f"<think>Outlining the '{heading}' section.</think>", f"## {heading}"]
+    size = 0
+    while size < section_bytes:
+        block = _paragraph(rng)
+        if rng.random() < 0.3:
+            block += "\n\n" + _chart_line(rng, area_name)
+        blocks.append(block)
+        size += len(block)
+    blocks.append("#### Sources")
+    blocks.append("\n".join(f"- {org}. Health statistics for {area_name}. {rng.randint(2015, 2025)}." for org in ("WHO", "NFHS-5", "World Bank")))
+    return "\n\n".join(blocks)
+
+def response_content(settings: MockSettings, payload: dict) -> str:
+    # Report prompts are recognized by the report-writing system prompt, whatever the model (the quick and standard
+    # research depths use the same models as follow-ups). Smaller token budgets get proportionally shorter reports.
+    if _REPORT_SYSTEM_PROMPT_MARKER not in payload["messages"][0]["content"]:
+        return FOLLOW_UP_ANSWER # follow-up prompts quote the report, title included
+    prompt = payload["messages"][-1]["content"]
+    max_tokens = payload.get("max_tokens") or _FULL_REPORT_TOKENS
+    section_match = _SECTION_PATTERN.search(prompt)
+    if section_match is not None:
+        section_bytes = int(settings.section_bytes * min(1.0, max_tokens / _FULL_SECTION_TOKENS))
+        return canned_section(section_match.group("area"), section_match.group("heading"), section_bytes, settings.seed)
+    report_match = _REPORT_AREA_PATTERN.search(prompt)
+    if report_match is not None:
+        return canned_report(report_match.group("area"), int(settings.report_bytes * min(1.0, max_tokens / _FULL_REPORT_TOKENS)), settings.seed)
+    return FOLLOW_UP_ANSWER
+
+def create_mock_app(settings: MockSettings = None) -> FastAPI:
+    settings = settings or MockSettings()
+    mock_app = FastAPI(title="Mock Perplexity API")
+    mock_app.state.settings = settings
+    mock_app.state.counters = {"requests": 0, "streamed": 0, "errors": 0}
+    attempts = {}
+
+    @mock_app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        rng = _request_rng(settings, attempts, payload)
+        mock_app.state.counters["requests"] += 1
+        latency = max(0.0, settings.latency_ms + rng.uniform(-settings.latency_jitter_ms, settings.latency_jitter_ms))
+        fail = rng.random() < settings.error_rate
+        await asyncio.sleep(latency / 1000)
+
+        if fail:
+            mock_app.state.counters["errors"] += 1
+            headers = {"Retry-After": str(int(settings.retry_after))} if settings.retry_after is not None else None
+            return JSONResponse(status_code=settings.error_status, headers=headers,
+                                content={"error": {"message": f"Mock upstream error (HTTP {settings.error_status}).", "type": "mock_error"}})
+
+        content = response_content(settings, payload)
+        completion_id = f"mock-{_fingerprint(payload)}"
+        model = payload.get("model", "mock")
+        usage = {"prompt_tokens": len(json.dumps(payload["messages"])) // 4, "completion_tokens": len(content) // 4}
+        if not payload.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        mock_app.state.counters["streamed"] += 1
+        async def event_stream():
+            for start in range(0, len(content), settings.stream_chunk_chars):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": content[start:start + settings.stream_chunk_chars]}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if settings.stream_chunk_delay_ms:
+                    await asyncio.sleep(settings.stream_chunk_delay_ms / 1000)
+            final_chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                           "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            yield f"data: {json.dumps(final_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    @mock_app.get("/mock/stats")
+    async def mock_stats():
+        return {"settings": asdict(settings), **mock_app.state.counters}
+
+    return mock_app
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    defaults = MockSettings()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=defaults.latency_jitter_ms)
+    parser.add_argument("--report-bytes", type=int, default=defaults.report_bytes)
+    parser.add_argument("--section-bytes", type=int, default=defaults.section_bytes)
+    parser.add_argument("--stream-chunk-chars", type=int, default=defaults.stream_chunk_chars)
+    parser.add_argument("--stream-chunk-delay-ms", type=float, default=defaults.stream_chunk_delay_ms)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms, report_bytes=args.report_bytes,
+        section_bytes=args.section_bytes, stream_chunk_chars=args.stream_chunk_chars,
+        stream_chunk_delay_ms=args.stream_chunk_delay_ms, error_rate=args.error_rate,
+        error_status=args.error_status, retry_after=args.retry_after, seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Mock Perplexity /chat/completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
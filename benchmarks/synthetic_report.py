@@ -0,0 +1,105 @@
+# benchmarks/synthetic_report.py
+# Deterministic generator for report-shaped markdown, used by the benchmarks in this folder.
+# Reports follow SECTION_STRUCTURE_GUIDE (H2 sections, H3 subsections, tables, CHART_DATA lines, References).
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import SECTION_STRUCTURE_GUIDE, _get_detailed_focus_points_for_prompt
+
+_VOCABULARY = (
+    "prevalence incidence mortality morbidity tuberculosis malaria dengue diabetes hypertension cancer "
+    "stroke anaemia malnutrition stunting wasting immunization coverage vaccination hospital clinic "
+    "primary secondary tertiary district rural urban population ageing fertility maternal infant "
+    "neonatal child adolescent expenditure insurance out-of-pocket scheme programme outreach surveillance "
+    "antimicrobial resistance pollution climate sanitation water workforce doctors nurses beds access "
+    "equity outcomes trend increase decrease percent rate per 1000 survey national state government"
+).split()
+_ORGS = ["WHO", "NFHS-5", "Ministry of Health", "World Bank", "ICMR", "UNICEF", "Lancet", "NITI Aayog", "IHME", "State Health Department"]
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_VOCABULARY) for _ in range(rng.randint(12, 24))]
+    words[0] = words[0].capitalize()
+    return f"{' '.join(words)} ({rng.choice(_ORGS)}, {rng.randint(2015, 2025)})."
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+
+def _chart_line(rng: random.Random, area_name: str, multi_series: bool = False) -> str:
+    n_points = rng.randint(3, 8)
+    labels = ", ".join(f'"{rng.choice(_VOCABULARY).title()} {i}"' for i in range(n_points))
+    chart_type = rng.choice(["bar", "line", "pie", "doughnut"])
+    title = f'{rng.choice(_VOCABULARY).title()} {rng.choice(_VOCABULARY)} in {area_name}'
+    if multi_series:
+        series = " ".join(
+            f"DATA_SERIES_{s}=[{', '.join(str(round(rng.uniform(0, 100), 1)) for _ in range(n_points))}]" for s in (1, 2)
+        )
+        return f'CHART_DATA: TYPE={chart_type} TITLE="{title}" LABELS=[{labels}] {series} SOURCE="({rng.choice(_ORGS)}, 2023)"'
+    values = ", ".join(rng.choice([str(round(rng.uniform(0, 100), 1)), f'"{round(rng.uniform(0, 100), 1)}%"']) for _ in range(n_points))
+    return f'CHART_DATA: TYPE={chart_type} TITLE="{title}" LABELS=[{labels}] DATA=[{values}] SOURCE="({rng.choice(_ORGS)}, 2023)"'
+
+def _table(rng: random.Random, area_name: str) -> str:
+    rows = [f"Table: {rng.choice(_VOCABULARY).title()} indicators for {area_name}.", "", "| Indicator | 2019 | 2021 | 2023 |", "|---|---|---|---|"]
+    for _ in range(rng.randint(3, 6)):
+        rows.append(f"| {rng.choice(_VOCABULARY).title()} | {rng.uniform(0, 100):.1f} | {rng.uniform(0, 100):.1f} | {rng.uniform(0, 100):.1f} |")
+    return "\n".join(rows)
+
+def generate_report_markdown(area_name: str = "Kerala", target_bytes: int = 40_000, seed: int = 7, multi_series_every: int = 0) -> str:
+    # multi_series_every=N makes every Nth chart a DATA_SERIES_n chart (0 = never).
+    rng = random.Random(seed)
+    focus_points = _get_detailed_focus_points_for_prompt(area_name)
+    section_keys = [key for key in SECTION_STRUCTURE_GUIDE if key not in ("title_page", "table_of_contents", "references")]
+    subsections = {}
+    for key in section_keys:
+        titles = [m.group(1) for point in focus_points.get(key, []) for m in [re.search(r"`### (.*?)`", point)] if m]
+        subsections[key] = titles or [f"{SECTION_STRUCTURE_GUIDE[key].split(' ', 1)[0].rstrip('.')}.1. Overview"]
+
+    header = [f"## {SECTION_STRUCTURE_GUIDE['title_page'].format(area_name=area_name)}", "October 2026", "", "## Contents"]
+    for key in section_keys:
+        header.append(f"- {SECTION_STRUCTURE_GUIDE[key].format(area_name=area_name)}")
+    header += ["", "---", ""]
+
+    body_per_sub = {key: [] for key in section_keys}
+    chart_count = 0
+    total = 0
+    # Grow the body round-robin over all subsections until the target size is reached.
+    while total < target_bytes:
+        for key in section_keys:
+            for sub_index in range(len(subsections[key])):
+                block = [_paragraph(rng)]
+                roll = rng.random()
+                if roll < 0.25:
+                    chart_count += 1
+                    multi = bool(multi_series_every) and chart_count % multi_series_every == 0
+                    block.append(_chart_line(rng, area_name, multi_series=multi))
+                elif roll < 0.35:
+                    block.append(_table(rng, area_name))
+                text = "\n\n".join(block)
+                body_per_sub[key].append((sub_index, text))
+                total += len(text) + 2
+
+    lines = list(header)
+    for key in section_keys:
+        lines.append(f"## {SECTION_STRUCTURE_GUIDE[key].format(area_name=area_name)}")
+        lines.append("")
+        for sub_index, title in enumerate(subsections[key]):
+            lines.append(f"### {title.strip(':*`')}")
+            lines.append("")
+            lines.extend(text + "\n" for idx, text in body_per_sub[key] if idx == sub_index)
+    lines.append("## References")
+    lines.append("")
+    for org in sorted(_ORGS):
+        lines.append(f"- {org}. Health statistics for {area_name}. {rng.randint(2015, 2025)}.")
+    return "\n".join(lines)
+
+def wrap_as_raw_model_output(report_markdown: str, seed: int = 7) -> str:
+    # Adds what the model tends to emit around a report: <think> blocks and an untagged preamble.
+    rng = random.Random(seed)
+    paragraphs = report_markdown.split("\n\n")
+    for _ in range(max(1, len(paragraphs) // 40)):
+        position = rng.randrange(1, len(paragraphs))
+        paragraphs.insert(position, f"<think>Checking sources for this part: {_sentence(rng)}</think>")
+    return "<think>Planning the report structure.\n" + _paragraph(rng) + "</think>\nHere is the report you asked for.\n\n" + "\n\n".join(paragraphs)
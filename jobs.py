@@ -0,0 +1,118 @@
+# jobs.py
+# Background job mode for deep research: POST /research/jobs enqueues work and returns at once,
+# a fixed pool of asyncio workers drains the queue, and clients poll GET /research/jobs/{id}.
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_COMPLETED = "completed"
+JOB_STATUS_FAILED = "failed"
+
+class JobQueueFullError(Exception):
+    pass
+
+@dataclass
+class ResearchJob:
+    job_id: str
+    area_name: str
+    report_id: str
+    status: str = JOB_STATUS_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Any = None
+    options: Dict[str, Any] = field(default_factory=dict) # extra keyword arguments passed to the runner
+
+class ResearchJobQueue:
+    def __init__(self, runner: Callable[[str, str], Awaitable[Any]], max_workers: int = 4, max_queue_depth: int = 50, job_retention_seconds: float = 3600.0):
+        # runner(area, report_id, **options) performs the research and returns the finished report.
+        self._runner = runner
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.job_retention_seconds = job_retention_seconds
+        self._queue: asyncio.Queue = None
+        self._workers = []
+        self._jobs: Dict[str, ResearchJob] = {}
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+        print(f"Started research job pool ({self.max_workers} workers, queue depth {self.max_queue_depth}).")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("Stopped research job pool.")
+
+    def submit(self, area_name: str, report_id: str, **options) -> ResearchJob:
+        if self._queue is None:
+            raise RuntimeError("Research job pool has not been started.")
+        self._prune_finished_jobs()
+        job = ResearchJob(job_id=uuid.uuid4().hex, area_name=area_name, report_id=report_id, options=options)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"Research job queue is full ({self.max_queue_depth} jobs waiting).")
+        self._jobs[job.job_id] = job
+        return job
+
+    def add_completed(self, area_name: str, report_id: str, result: Any) -> ResearchJob:
+        # Used when the report is already cached: the job is born finished and never touches the queue.
+        self._prune_finished_jobs()
+        now = time.time()
+        job = ResearchJob(job_id=uuid.uuid4().hex, area_name=area_name, report_id=report_id,
+                          status=JOB_STATUS_COMPLETED, started_at=now, finished_at=now, result=result)
+        self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        self._prune_finished_jobs()
+        return self._jobs.get(job_id)
+
+    def queue_position(self, job: ResearchJob) -> Optional[int]:
+        if job.status != JOB_STATUS_QUEUED:
+            return None
+        return sum(1 for other in self._jobs.values() if other.status == JOB_STATUS_QUEUED and other.created_at < job.created_at) + 1
+
+    def stats(self) -> dict:
+        counts = {JOB_STATUS_QUEUED: 0, JOB_STATUS_RUNNING: 0, JOB_STATUS_COMPLETED: 0, JOB_STATUS_FAILED: 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {"workers": self.max_workers, "max_queue_depth": self.max_queue_depth,
+                "queue_size": self._queue.qsize() if self._queue is not None else 0, "jobs": counts}
+
+    def _prune_finished_jobs(self):
+        cutoff = time.time() - self.job_retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self, worker_index: int):
+        while True:
+            job = await self._queue.get()
+            job.status = JOB_STATUS_RUNNING
+            job.started_at = time.time()
+            print(f"Research worker {worker_index} picked up job {job.job_id} for area: {job.area_name}")
+            try:
+                job.result = await self._runner(job.area_name, job.report_id, **job.options)
+                job.status = JOB_STATUS_COMPLETED
+            except asyncio.CancelledError:
+                job.status = JOB_STATUS_FAILED
+                job.error = "Server shut down before the job finished."
+                raise
+            except Exception as e:
+                print(f"Research job {job.job_id} failed: {e}")
+                job.status = JOB_STATUS_FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
@@ -0,0 +1,250 @@
+# metrics.py
+# Observability for the app: counters, gauges and histograms rendered in the Prometheus text format at /metrics,
+# a per-request id carried in a contextvar (and into structured JSON log lines), and a debug-only span profiler.
+# Dependency-free; metrics are updated from the event loop only, so no locking.
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# PROFILE_REQUESTS=true records a span breakdown for every request (Server-Timing header + "spans" on the access log line).
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "false").lower() in ("1", "true", "yes")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower() # "json" or "text"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 900)
+CPU_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{self._format_labels(key)} {_format_value(value)}"
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        # For totals counted elsewhere (e.g. ReportStore.hits), copied in when /metrics is scraped.
+        self._values[self._key(labels)] = value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {} # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in sorted(self._series.items()):
+            for upper, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{self._format_labels(key, ('le', _format_value(upper)))} {count}"
+            yield f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {series[-1]}"
+            yield f"{self.name}_sum{self._format_labels(key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{self._format_labels(key)} {series[-1]}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+REGISTRY = MetricsRegistry()
+
+# --- Metrics updated on the hot paths ---
+HTTP_REQUEST_DURATION = Histogram("deep_research_http_request_duration_seconds", "Time to produce the response headers, by route.", ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = Gauge("deep_research_http_requests_in_flight", "HTTP requests currently being handled, by route.", ("route",))
+UPSTREAM_DURATION = Histogram("deep_research_upstream_request_duration_seconds", "Perplexity API call duration (whole stream for streamed calls).", ("model", "outcome", "streamed"), UPSTREAM_BUCKETS)
+UPSTREAM_TIME_TO_FIRST_TOKEN = Histogram("deep_research_upstream_time_to_first_token_seconds", "Time until the first content delta of a streamed Perplexity call.", ("model",), UPSTREAM_BUCKETS)
+UPSTREAM_IN_FLIGHT = Gauge("deep_research_upstream_requests_in_flight", "Perplexity API calls currently open.", ("model",))
+UPSTREAM_PROMPT_TOKENS = Counter("deep_research_upstream_prompt_tokens_total", "Prompt tokens reported in the API usage field.", ("model",))
+UPSTREAM_COMPLETION_TOKENS = Counter("deep_research_upstream_completion_tokens_total", "Completion tokens reported in the API usage field.", ("model",))
+UPSTREAM_RETRIES = Counter("deep_research_upstream_retries_total", "Perplexity API calls retried, by the error that caused the retry.", ("model", "reason"))
+UPSTREAM_HEDGES = Counter("deep_research_upstream_hedges_total", "Hedged follow-up calls, by which attempt produced the answer.", ("outcome",))
+SCHEDULER_QUEUE_DEPTH = Gauge("deep_research_scheduler_queue_depth", "Upstream calls waiting for a scheduler slot, by model and priority.", ("model", "priority"))
+SCHEDULER_WAIT = Histogram("deep_research_scheduler_wait_seconds", "Time upstream calls waited for a scheduler slot.", ("model", "priority"))
+SCHEDULER_REJECTED = Counter("deep_research_scheduler_rejected_total", "Upstream calls turned away by admission control, by reason (over_budget, queue_full, deadline).", ("model", "priority", "reason"))
+SCHEDULER_ACTIVE_SLOTS = Gauge("deep_research_scheduler_active_slots", "Scheduler slots currently held, by model.", ("model",))
+CIRCUIT_STATE = Gauge("deep_research_upstream_circuit_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open).", ("model",))
+POSTPROCESS_DURATION = Histogram("deep_research_postprocess_duration_seconds", "Post-processing time per model response, by stage (clean, extract, structure).", ("stage",), CPU_BUCKETS)
+CHART_PARSE_DURATION = Histogram("deep_research_chart_parse_duration_seconds", "Time spent parsing CHART_DATA directives per report.", (), CPU_BUCKETS)
+
+# --- Values copied from the caches and the job queue when /metrics is scraped ---
+REPORT_CACHE_HITS = Counter("deep_research_report_cache_hits_total", "Report store hits, by tier.", ("tier",))
+REPORT_CACHE_MISSES = Counter("deep_research_report_cache_misses_total", "Report store misses (including expired entries).")
+REPORT_CACHE_ENTRIES = Gauge("deep_research_report_cache_entries", "Reports held, by tier.", ("tier",))
+REPORT_CACHE_BYTES = Gauge("deep_research_report_cache_bytes", "Bytes held, by tier (compressed on disk).", ("tier",))
+ANSWER_CACHE_HITS = Counter("deep_research_answer_cache_hits_total", "Follow-up answer cache hits, by match kind.", ("match",))
+ANSWER_CACHE_MISSES = Counter("deep_research_answer_cache_misses_total", "Follow-up answer cache misses.")
+ANSWER_CACHE_ENTRIES = Gauge("deep_research_answer_cache_entries", "Cached follow-up answers.")
+REPORT_INDEX_ENTRIES = Gauge("deep_research_report_index_entries", "Retrieval indexes held in memory.")
+RESEARCH_JOBS = Gauge("deep_research_research_jobs", "Research jobs known to the job queue, by status.", ("status",))
+RESEARCH_IN_FLIGHT = Gauge("deep_research_research_in_flight", "Distinct research runs currently in progress.")
+SCHEDULER_TOKENS_AVAILABLE = Gauge("deep_research_scheduler_tokens_available", "Tokens left in each tokens-per-minute bucket (budget \"account\" is shared by all models).", ("budget",))
+RESEARCH_JOB_QUEUE_SIZE = Gauge("deep_research_research_job_queue_size", "Research jobs waiting for a worker.")
+AREA_RESOLUTIONS = Counter("deep_research_area_resolutions_total", "Requested areas resolved to a canonical name, by how they matched (exact, alias, fuzzy, unknown).", ("match",))
+AREA_ALIAS_CACHE_HITS = Counter("deep_research_area_alias_cache_hits_total", "Report cache hits the per-spelling report id would have missed; the gain from area canonicalization.")
+REPORTS_GENERATED = Counter("deep_research_reports_generated_total", "Reports generated or refreshed, by research depth (quick, standard, deep).", ("depth",))
+DEEPER_REPORT_HITS = Counter("deep_research_deeper_report_hits_total", "Requests answered by a cached report deeper than the depth they asked for.")
+
+# --- Request id and structured logs ---
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+logger = logging.getLogger("deep_research")
+
+def configure_logging():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(message)s %(fields)s"))
+    else:
+        handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def log_event(event: str, **fields):
+    logger.info(event, extra={"fields": fields})
+
+# --- Debug-only span profiler ---
+_spans_var: contextvars.ContextVar = contextvars.ContextVar("profile_spans", default=None)
+
+def start_profile():
+    # Returns a token for end_profile(); the span list is shared with tasks spawned while handling the request.
+    return _spans_var.set([])
+
+def end_profile(token) -> list:
+    spans = _spans_var.get() or []
+    _spans_var.reset(token)
+    totals = {}
+    for name, duration in spans:
+        total = totals.setdefault(name, [0.0, 0])
+        total[0] += duration
+        total[1] += 1
+    return [{"name": name, "ms": round(total * 1000, 3), "count": count} for name, (total, count) in totals.items()]
+
+@contextmanager
+def span(name: str):
+    spans = _spans_var.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - start))
+
+@contextmanager
+def timed(histogram: Histogram, span_name: str = None, **labels):
+    # Observes the block's wall time on histogram and, when profiling, records it as a span.
+    start = time.perf_counter()
+    try:
+        with span(span_name or histogram.name):
+            yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+def server_timing_header(profile: list) -> str:
+    return ", ".join(f"{entry['name'].replace(' ', '_')};dur={entry['ms']};desc=\"x{entry['count']}\"" for entry in profile)
+
+def record_usage(model: str, usage: Optional[dict]):
+    if not usage:
+        return
+    UPSTREAM_PROMPT_TOKENS.inc(usage.get("prompt_tokens") or 0, model=model)
+    UPSTREAM_COMPLETION_TOKENS.inc(usage.get("completion_tokens") or 0, model=model)
@@ -0,0 +1,123 @@
+# report_encoding.py
+# Wire representation of cached reports for GET /reports/{report_id}. The ReportResponse JSON is serialized once per
+# report version, hashed for a strong ETag and compressed with gzip, plus brotli when the optional "brotli" package
+# is installed. The encoded bytes are kept in a bounded LRU, so repeat hits neither re-serialize nor recompress.
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024 # smaller bodies are sent as they are
+GZIP_LEVEL = 9 # compressed once per report version, so spend the CPU for the smaller body
+BROTLI_QUALITY = 11
+
+@dataclass
+class EncodedReport:
+    version: Optional[float] # the store record's created_at; a regenerated report gets a new one
+    digest: str              # sha256 of the identity body
+    bodies: Dict[str, bytes] # content-coding ("identity", "gzip", "br") -> body
+
+    def etag(self, coding: str = "identity") -> str:
+        # Strong validators must differ between content-codings of the same content.
+        return f'"{self.digest}"' if coding == "identity" else f'"{self.digest}-{coding}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        # If-None-Match uses weak comparison; any coding of the same content counts as a match.
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            tag = tag[2:] if tag.startswith("W/") else tag
+            if tag.strip('"').split("-", 1)[0] == self.digest:
+                return True
+        return False
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+def encode_report(payload: dict, version: Optional[float] = None) -> EncodedReport:
+    return encode_body(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), version)
+
+def encode_body(body: bytes, version: Optional[float] = None) -> EncodedReport:
+    bodies = {"identity": body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        bodies["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return EncodedReport(version=version, digest=hashlib.sha256(body).hexdigest()[:32], bodies=bodies)
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> str:
+    # Highest q-value among the codings we have; brotli wins ties with gzip. Falls back to identity.
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    best, best_weight = "identity", 0.0
+    for coding in ("br", "gzip"):
+        if coding in available:
+            weight = weights.get(coding, weights.get("*", 0.0))
+            if weight > best_weight:
+                best, best_weight = coding, weight
+    return best
+
+class EncodedReportCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # report_id -> EncodedReport
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, report_id: str, version: Optional[float]) -> Optional[EncodedReport]:
+        entry = self._entries.get(report_id)
+        if entry is None or entry.version != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(report_id)
+        self.hits += 1
+        return entry
+
+    def set(self, report_id: str, encoded: EncodedReport):
+        self.invalidate(report_id)
+        if encoded.size > self.max_bytes:
+            return
+        self._entries[report_id] = encoded
+        self._bytes += encoded.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def invalidate(self, report_id: str):
+        entry = self._entries.pop(report_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "brotli": brotli is not None}
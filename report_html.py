@@ -0,0 +1,150 @@
+# report_html.py
+# Server-side rendering of reports for GET /reports/{report_id}/html. The markdown is rendered once per report version
+# with markdown-it-py (raw HTML disabled, so model output cannot inject markup; unsafe link schemes are rejected by its
+# link validator) and split into one fragment per H2 section, each with ready-to-use Chart.js configs whose colors are
+# derived from the chart title, so every viewer and every render gets the same chart. Without the optional
+# "markdown-it-py" package the endpoint is unavailable and the page renders the markdown itself, as before.
+import re
+import secrets
+import zlib
+from typing import List, Optional
+
+from report_parser import extract_report, section_key
+
+try:
+    from markdown_it import MarkdownIt # optional: pip install markdown-it-py
+except ImportError:
+    MarkdownIt = None
+
+# Stored next to the fragments; records rendered by an older renderer are rendered again on their next request.
+RENDERER_VERSION = 1
+
+_CHART_DIRECTIVE_PATTERN = re.compile(r"CHART_DATA:[^\n]*")
+
+# Same palette as the client-side renderer in script.js.
+_PALETTE = [
+    (26, 188, 156, 0.65), (52, 152, 219, 0.65), (155, 89, 182, 0.65), (241, 196, 15, 0.75), (230, 126, 34, 0.65),
+    (231, 76, 60, 0.65), (46, 204, 113, 0.65), (243, 156, 18, 0.75), (52, 73, 94, 0.65), (149, 165, 166, 0.65),
+    (22, 160, 133, 0.65), (41, 128, 185, 0.65), (125, 60, 152, 0.65), (211, 84, 0, 0.65), (189, 195, 199, 0.65),
+]
+_GRID_COLOR = "rgba(200, 200, 200, 0.2)"
+
+_markdown = None
+
+def html_rendering_available() -> bool:
+    return MarkdownIt is not None
+
+def _markdown_renderer():
+    global _markdown
+    if _markdown is None:
+        _markdown = MarkdownIt("commonmark", {"html": False, "breaks": True}).enable(["table", "strikethrough"])
+    return _markdown
+
+def _color(index: int, border: bool = False) -> str:
+    r, g, b, a = _PALETTE[index % len(_PALETTE)]
+    return f"rgba({r},{g},{b},{1 if border else a})"
+
+def chart_config(chart: dict) -> dict:
+    # A Chart.js config for a parsed chart (schemas.ChartData). Only plain data: the page adds the number-formatting
+    # callbacks. Colors start at an offset derived from the title instead of the chart's position in the report.
+    chart_type = (chart.get("type") or "bar").lower()
+    datasets = chart.get("datasets", [])
+    seed = zlib.crc32((chart.get("title") or "").encode("utf-8"))
+    config_datasets = []
+    for dataset_index, dataset in enumerate(datasets):
+        points = dataset.get("data", [])
+        if chart_type in ("pie", "doughnut", "bar"):
+            background = [_color(seed + dataset_index * 5 + point_index) for point_index in range(len(points))]
+            if chart_type == "bar":
+                border = [_color(seed + dataset_index * 5 + point_index, border=True) for point_index in range(len(points))]
+            else:
+                border = "#fff" # white edges separate the slices
+        else:
+            background = dataset.get("backgroundColor") or _color(seed + dataset_index)
+            border = dataset.get("borderColor") or _color(seed + dataset_index, border=True)
+        single_series = len(datasets) == 1
+        config_datasets.append({
+            "label": dataset.get("label") or chart.get("title") or f"Dataset {dataset_index + 1}",
+            "data": points,
+            "backgroundColor": background,
+            "borderColor": border,
+            "borderWidth": 2 if chart_type in ("pie", "doughnut") else 1.5,
+            "tension": 0.3 if chart_type in ("line", "radar") else 0,
+            "fill": "origin" if (chart_type == "radar" and single_series) or (chart_type == "line" and single_series and len(points) > 1) else False,
+        })
+
+    title, source = chart.get("title"), chart.get("source")
+    options = {
+        "responsive": True,
+        "maintainAspectRatio": True,
+        "animation": {"duration": 600, "easing": "easeOutQuart"},
+        "plugins": {
+            "title": {"display": bool(title), "text": title or "", "font": {"size": 16, "weight": "bold"},
+                      "padding": {"top": 10, "bottom": 5 if source else 20}},
+            "subtitle": {"display": bool(source), "text": f"Source: {source}" if source else "",
+                         "font": {"size": 10, "style": "italic"}, "color": "#666", "padding": {"bottom": 15}},
+            "legend": {"display": len(datasets) > 1 or chart_type in ("pie", "doughnut"), "position": "top", "labels": {"font": {"size": 12}}},
+            "tooltip": {"enabled": True, "mode": "index", "intersect": False},
+        },
+    }
+    if chart_type in ("bar", "line", "scatter"):
+        options["scales"] = {
+            "y": {"beginAtZero": True, "ticks": {"font": {"size": 11}}, "grid": {"color": _GRID_COLOR}},
+            "x": {"ticks": {"font": {"size": 11}, "autoSkip": True, "maxTicksLimit": 10}, "grid": {"display": False}},
+        }
+    elif chart_type == "radar":
+        options["scales"] = {"r": {"angleLines": {"display": True, "color": _GRID_COLOR}, "suggestedMin": 0, "pointLabels": {"font": {"size": 11}},
+                                   "grid": {"color": _GRID_COLOR}, "ticks": {"backdropColor": "transparent", "font": {"size": 10}}}}
+    return {"type": chart_type, "data": {"labels": chart.get("labels", []), "datasets": config_datasets}, "options": options}
+
+def render_report_fragments(record: dict) -> List[dict]:
+    # One {"key", "title", "html", "charts"} per H2 section, in document order; text before the first H2 (the title)
+    # is the "title_page" fragment. Known sections use their SECTION_STRUCTURE_GUIDE key (from record["sections"]).
+    # Each CHART_DATA line becomes <div class="chart-render-target" data-chart="i">, i indexing the fragment's charts.
+    markdown = record["full_report_markdown"]
+    outline = record.get("outline")
+    if outline is None:
+        outline = extract_report(markdown, parse_charts=False).outline
+    starts = [0] + [heading["offset"] for heading in outline if heading["level"] == 2 and heading["offset"] > 0]
+    titles = [None] + [heading["title"] for heading in outline if heading["level"] == 2 and heading["offset"] > 0]
+    section_keys_by_start = {section["start"]: key for key, section in (record.get("sections") or {}).items() if "start" in section}
+    charts_by_directive = {}
+    for position, chart in enumerate(record.get("charts", [])):
+        directive_index = chart.get("directive_index")
+        charts_by_directive[position if directive_index is None else directive_index] = chart
+
+    renderer = _markdown_renderer()
+    marker = f"CHARTPLACEHOLDER{secrets.token_hex(8)}N" # cannot occur in the report text, and markdown leaves it alone
+    fragments, used_keys, directive_index = [], set(), 0
+    for position, start in enumerate(starts):
+        end = starts[position + 1] if position + 1 < len(starts) else len(markdown)
+        text = markdown[start:end]
+        if not text.strip():
+            continue
+        charts = []
+
+        def replace_directive(match):
+            nonlocal directive_index
+            chart = charts_by_directive.get(directive_index)
+            directive_index += 1
+            if chart is None: # unparseable directive: dropped, as on the client
+                return ""
+            charts.append(chart_config(chart))
+            return f"\n\n{marker}{len(charts) - 1}\n\n"
+
+        text = _CHART_DIRECTIVE_PATTERN.sub(replace_directive, text)
+        html = renderer.render(text)
+        for chart_index in reversed(range(len(charts))): # highest first, so marker 1 does not match inside marker 10
+            placeholder = f'<div class="chart-render-target" data-chart="{chart_index}"></div>'
+            html = html.replace(f"<p>{marker}{chart_index}</p>", placeholder).replace(f"{marker}{chart_index}", placeholder)
+        title = titles[position]
+        key = "title_page" if title is None else section_key(title, start, section_keys_by_start, used_keys)
+        fragments.append({"key": key, "title": title, "html": html, "charts": charts})
+    return fragments
+
+def rendered_fragments(record: dict) -> Optional[List[dict]]:
+    # The fragments stored with the record, if they came from the current renderer.
+    rendered = record.get("rendered_html")
+    if rendered and rendered.get("version") == RENDERER_VERSION:
+        return rendered["fragments"]
+    return None
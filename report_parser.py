@@ -0,0 +1,386 @@
+# report_parser.py
+# Post-processing of model output with precompiled patterns. clean_model_output() removes <think> blocks and
+# any preamble before the report title; extract_report() then walks the cleaned markdown once and returns the
+# charts, the H2/H3 outline and the References entries together. The two stay separate passes: cleaning runs on
+# every upstream response (sections and follow-up answers included), while extraction runs on the final report,
+# which in sectional mode is assembled from several cleaned responses.
+import ast
+import heapq
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+REPORT_START_MARKER = "Comprehensive Report on Healthcare in"
+MAX_CHART_POINTS = 12
+
+_THINK_BLOCK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+# Headings and CHART_DATA directives are found with literal-prefixed patterns (so the regex engine can use its fast
+# substring search instead of trying an alternation at every offset) and merged back into document order.
+_HEADING_LINE_PATTERN = re.compile(r"\n(?P<hashes>#{2,3})[ \t]+(?P<heading>[^\n]*)")
+_LEADING_HEADING_PATTERN = re.compile(r"(?P<hashes>#{2,3})[ \t]+(?P<heading>[^\n]*)")
+_CHART_DIRECTIVE_PATTERN = re.compile(r"CHART_DATA:(?P<chart>[^\n]*)")
+# Canonical field order from the prompt; anything else goes through the slower key=value scan below.
+_CANONICAL_CHART_PATTERN = re.compile(r'\s*TYPE=(?P<TYPE>\w+)\s*TITLE="(?P<TITLE>[^"]+)"\s*LABELS=(?P<LABELS>\[[^\]]*\])\s*DATA=(?P<DATA>\[[^\]]*\])(?:\s*SOURCE="(?P<SOURCE>[^"]+)")?\s*$')
+_CHART_FIELD_PATTERN = re.compile(r'(?P<key>[A-Z][A-Z0-9_]*)=(?:"(?P<quoted>[^"]*)"|(?P<list>\[[^\]]*\])|(?P<bare>[^\s"\[\]]+))')
+_DATA_SERIES_KEY_PATTERN = re.compile(r"DATA_SERIES_(\d+)$")
+_TITLE_CLEANUP_PATTERN = re.compile(r"[^\w\s\-\(\)%]")
+_NON_NUMERIC_PATTERN = re.compile(r"[^\d\.\-eE]")
+_REFERENCE_ENTRY_PATTERN = re.compile(r"^[ \t]*(?:[-*+]|\d+[.)])[ \t]+(?P<entry>[^\n]+?)[ \t]*$", re.MULTILINE)
+# Structured form (build_report_structure): GFM pipe tables, in-text citations and section keys.
+_TABLE_DELIMITER_PATTERN = re.compile(r"^[ \t]*\|?[ \t]*:?-{3,}:?[ \t]*(?:\|[ \t]*:?-{3,}:?[ \t]*)*\|?[ \t]*$", re.MULTILINE)
+_TABLE_CELL_SEPARATOR_PATTERN = re.compile(r"(?<!\\)\|")
+_TABLE_CAPTION_PATTERN = re.compile(r"^\s*\**\s*Table\s*\d*\s*[:.]\s*(?P<caption>.+?)\**\s*$", re.IGNORECASE)
+_AUTHOR_YEAR_CITATION_PATTERN = re.compile(r"\((?P<body>[^()\n]{2,200}?(?:19|20)\d{2}[a-z]?)\)")
+_AUTHOR_YEAR_PART_PATTERN = re.compile(r"^\s*(?P<author>.+?),?\s+(?P<year>(?:19|20)\d{2})[a-z]?\s*$")
+_NUMERIC_CITATION_PATTERN = re.compile(r"\[(?P<numbers>\d{1,3}(?:\s*[,\u2013-]\s*\d{1,3})*)\](?!\()")
+_LINE_PATTERN = re.compile(r"[^\n]*")
+_NORMALIZE_PATTERN = re.compile(r"[\W_]+")
+_SLUG_PATTERN = re.compile(r"[^a-z0-9]+")
+_SECTION_NUMBER_PREFIX_PATTERN = re.compile(r"^\d+\.\s*")
+STRUCTURE_VERSION = 1
+
+@dataclass
+class ExtractedReport:
+    markdown: str # the markdown that was extracted from, unchanged
+    charts: List[dict] = field(default_factory=list)
+    outline: List[dict] = field(default_factory=list)     # {"level": 2|3, "title": str, "offset": int}
+    references: List[str] = field(default_factory=list)
+    chart_parse_seconds: float = 0.0 # part of the extract_report() time spent in parse_chart_directive
+
+def clean_model_output(raw_content: str, report_start_marker: Optional[str] = REPORT_START_MARKER) -> str:
+    content_without_thoughts = _THINK_BLOCK_PATTERN.sub("", raw_content).strip()
+    if report_start_marker is None: # e.g. follow-up answers, which have no title to anchor on
+        return content_without_thoughts
+
+    marker_match = _marker_pattern(report_start_marker).search(content_without_thoughts)
+    if marker_match is None:
+        print(f"CRITICAL WARNING: Report start marker ('{report_start_marker}') NOT FOUND in AI response AFTER <think> tag removal. AI did not follow crucial instructions. Returning the <think>-stripped content as is, but it's likely malformed or incomplete.")
+        return content_without_thoughts
+    if marker_match.start() > 0:
+        print(f"WARNING: Untagged preamble detected before report title AFTER <think> tag removal. Stripping {marker_match.start()} chars.")
+        return content_without_thoughts[marker_match.start():].strip()
+    return content_without_thoughts
+
+_marker_patterns = {}
+
+def _marker_pattern(marker: str):
+    pattern = _marker_patterns.get(marker)
+    if pattern is None:
+        pattern = _marker_patterns[marker] = re.compile(re.escape(marker), re.IGNORECASE)
+    return pattern
+
+def extract_report(markdown: str, area_name: str = "", parse_charts: bool = True) -> ExtractedReport:
+    # parse_charts=False returns only the outline and references (e.g. when the charts are reused from an earlier run).
+    result = ExtractedReport(markdown=markdown)
+    headings = []
+    leading = _LEADING_HEADING_PATTERN.match(markdown)
+    if leading is not None:
+        headings.append((0, leading))
+    headings.extend((m.start() + 1, m) for m in _HEADING_LINE_PATTERN.finditer(markdown))
+    directives = [(m.start(), m) for m in _CHART_DIRECTIVE_PATTERN.finditer(markdown)] if parse_charts else []
+
+    references_span = None
+    directive_index = 0
+    for offset, item in heapq.merge(headings, directives, key=lambda entry: entry[0]):
+        if item.re is not _CHART_DIRECTIVE_PATTERN:
+            heading = item.group("heading").strip()
+            level = len(item.group("hashes"))
+            result.outline.append({"level": level, "title": heading.strip("*` "), "offset": offset})
+            if level == 2:
+                if references_span is not None and references_span[1] is None:
+                    references_span[1] = offset
+                if heading.strip("*` :").lower() == "references":
+                    references_span = [item.end(), None]
+            continue
+        chart_start = time.perf_counter()
+        chart = parse_chart_directive(item.group("chart"), directive_index, area_name)
+        result.chart_parse_seconds += time.perf_counter() - chart_start
+        if chart is not None:
+            result.charts.append(chart)
+        directive_index += 1
+
+    if references_span is not None:
+        start, end = references_span
+        result.references = [m.group("entry") for m in _REFERENCE_ENTRY_PATTERN.finditer(markdown, start, end if end is not None else len(markdown))]
+    return result
+
+def chart_directives(text: str) -> List[str]:
+    # The CHART_DATA payloads in text, found exactly as extract_report() finds them, so streamed charts get the same
+    # directive_index as the final report's.
+    return [m.group("chart") for m in _CHART_DIRECTIVE_PATTERN.finditer(text)]
+
+def section_key(title: str, offset: int, keys_by_start: dict, used: set) -> str:
+    # The SECTION_STRUCTURE_GUIDE key indexed at this offset, else a slug of the heading ("Contents" -> "contents");
+    # numbered if repeated. Shared by the structured form and the HTML fragments, so both use the same keys.
+    key = keys_by_start.get(offset)
+    if key is None:
+        key = _SLUG_PATTERN.sub("_", _SECTION_NUMBER_PREFIX_PATTERN.sub("", title).lower()).strip("_") or "section"
+    base, suffix = key, 2
+    while key in used:
+        key, suffix = f"{base}_{suffix}", suffix + 1
+    used.add(key)
+    return key
+
+def build_report_structure(markdown: str, charts: List[dict], outline: List[dict], references: List[str], keys_by_start: dict = None) -> dict:
+    # Compact structured form of a report: the H2 sections (text before the first H2 is "title_page") with their
+    # H3 subsections, character and UTF-8 byte offsets, pipe tables as rows, the positions (in charts) of the charts
+    # drawn in them and their in-text citations, (Author, Year) or [n], linked to the References entries they cite.
+    keys_by_start = keys_by_start or {}
+    h2_headings = [entry for entry in outline if entry["level"] == 2 and entry["offset"] > 0]
+    starts = [0] + [entry["offset"] for entry in h2_headings]
+    ends = starts[1:] + [len(markdown)]
+    sections, used_keys = [], set()
+    for position, (start, end) in enumerate(zip(starts, ends)):
+        title = h2_headings[position - 1]["title"] if position else _title_line(markdown, end)
+        sections.append({
+            "key": "title_page" if position == 0 else section_key(title, start, keys_by_start, used_keys),
+            "title": title, "level": 2 if position else 1, "start": start, "end": end,
+            "subsections": [], "tables": [], "charts": [], "citations": [],
+        })
+    if not markdown[:starts[1] if len(starts) > 1 else len(markdown)].strip():
+        sections.pop(0)
+
+    def section_at(offset: int) -> Optional[dict]:
+        for section in reversed(sections):
+            if section["start"] <= offset:
+                return section
+        return None
+
+    h3_headings = [entry for entry in outline if entry["level"] == 3]
+    for position, entry in enumerate(h3_headings):
+        section = section_at(entry["offset"])
+        if section is None:
+            continue
+        following = [other["offset"] for other in h3_headings[position + 1:position + 2]]
+        end = min([section["end"]] + following)
+        section["subsections"].append({"title": entry["title"], "level": 3, "start": entry["offset"], "end": end})
+
+    for table in _extract_tables(markdown):
+        section = section_at(table["start"])
+        if section is not None:
+            section["tables"].append(table)
+
+    directive_offsets = [m.start() for m in _CHART_DIRECTIVE_PATTERN.finditer(markdown)]
+    for chart_position, chart in enumerate(charts):
+        directive_index = chart.get("directive_index", chart_position)
+        if directive_index is not None and directive_index < len(directive_offsets):
+            section = section_at(directive_offsets[directive_index])
+            if section is not None:
+                section["charts"].append(chart_position)
+
+    reference_entries = [{"index": index, "text": text, "cited_in": []} for index, text in enumerate(references)]
+    normalized_references = [_normalize(text) for text in references]
+    references_section = next((s for s in sections if s["title"] and s["title"].strip("*` :").lower() == "references"), None)
+    for section in sections:
+        if section is references_section:
+            continue
+        counts = {} # (text, reference index) -> count, in first-seen order
+        for text, reference in _section_citations(markdown, section["start"], section["end"], normalized_references):
+            counts[(text, reference)] = counts.get((text, reference), 0) + 1
+        section["citations"] = [{"text": text, "reference": reference, "count": count} for (text, reference), count in counts.items()]
+        for reference in sorted({reference for (_, reference) in counts if reference is not None}):
+            reference_entries[reference]["cited_in"].append(section["key"])
+
+    _add_byte_offsets(markdown, sections)
+    return {"version": STRUCTURE_VERSION, "sections": sections, "references": reference_entries}
+
+def _title_line(markdown: str, end: int) -> Optional[str]:
+    for line in markdown[:end].splitlines():
+        if line.strip():
+            return line.strip().lstrip("#").strip().strip("*` ") or None
+    return None
+
+def _extract_tables(markdown: str) -> List[dict]:
+    # GFM pipe tables: a header row, a delimiter row (| --- | :---: |) and the body rows up to the first line without "|".
+    tables = []
+    for delimiter in _TABLE_DELIMITER_PATTERN.finditer(markdown):
+        header_end = delimiter.start() - 1
+        if header_end <= 0:
+            continue
+        header_start = markdown.rfind("\n", 0, header_end) + 1
+        header_line = markdown[header_start:header_end]
+        if "|" not in header_line:
+            continue
+        rows, end = [], delimiter.end()
+        while end < len(markdown):
+            line = _LINE_PATTERN.match(markdown, end + 1).group()
+            if "|" not in line or not line.strip():
+                break
+            rows.append(_table_cells(line))
+            end += 1 + len(line)
+        caption = None
+        previous_end = header_start - 1
+        while previous_end > 0:
+            previous_start = markdown.rfind("\n", 0, previous_end) + 1
+            previous_line = markdown[previous_start:previous_end]
+            if previous_line.strip():
+                caption_match = _TABLE_CAPTION_PATTERN.match(previous_line)
+                caption = caption_match.group("caption").strip() if caption_match else None
+                break
+            previous_end = previous_start - 1
+        tables.append({"caption": caption, "header": _table_cells(header_line), "rows": rows, "start": header_start, "end": end})
+    return tables
+
+def _table_cells(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in _TABLE_CELL_SEPARATOR_PATTERN.split(line)]
+
+def _section_citations(markdown: str, start: int, end: int, normalized_references: List[str]):
+    # Yields (citation text, index of the cited References entry or None) in document order, skipping CHART_DATA lines
+    # (their SOURCE="(Org, Year)" attributes the chart, which the chart itself carries).
+    cache = {}
+    matches = [(m.start(), m) for m in _AUTHOR_YEAR_CITATION_PATTERN.finditer(markdown, start, end)]
+    matches += [(m.start(), m) for m in _NUMERIC_CITATION_PATTERN.finditer(markdown, start, end)]
+    for offset, match in sorted(matches, key=lambda item: item[0]):
+        line_start = markdown.rfind("\n", 0, offset) + 1
+        if markdown.startswith("CHART_DATA:", line_start):
+            continue
+        if match.re is _NUMERIC_CITATION_PATTERN:
+            for number in _expand_numbers(match.group("numbers")):
+                yield f"[{number}]", number - 1 if 0 < number <= len(normalized_references) else None
+            continue
+        for part in match.group("body").split(";"):
+            part_match = _AUTHOR_YEAR_PART_PATTERN.match(part)
+            if part_match is None:
+                continue
+            author, year = part_match.group("author").strip(), part_match.group("year")
+            cache_key = (author, year)
+            if cache_key not in cache:
+                cache[cache_key] = _match_reference(_normalize(author), year, normalized_references)
+            yield f"{author}, {year}", cache[cache_key]
+
+def _expand_numbers(text: str) -> List[int]:
+    numbers = []
+    for part in text.split(","):
+        bounds = [int(value) for value in re.split(r"\s*[\u2013-]\s*", part.strip()) if value]
+        if len(bounds) == 2 and 0 <= bounds[1] - bounds[0] <= 50:
+            numbers.extend(range(bounds[0], bounds[1] + 1))
+        else:
+            numbers.extend(bounds[:1])
+    return numbers
+
+def _match_reference(author: str, year: str, normalized_references: List[str]) -> Optional[int]:
+    # Best References entry for an (Author, Year) citation: starts with the author and has the year, then starts with
+    # the author, then mentions the author and the year.
+    if not author:
+        return None
+    fallback, weak = None, None
+    for index, reference in enumerate(normalized_references):
+        if reference.startswith(author):
+            if year in reference:
+                return index
+            fallback = index if fallback is None else fallback
+        elif weak is None and f" {author} " in f" {reference} " and year in reference:
+            weak = index
+    return fallback if fallback is not None else weak
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE_PATTERN.sub(" ", text.lower()).strip()
+
+def _add_byte_offsets(markdown: str, sections: List[dict]):
+    # UTF-8 byte offsets next to the character offsets, computed in one pass over the sorted positions.
+    items = sections + [sub for section in sections for sub in section["subsections"]] + [table for section in sections for table in section["tables"]]
+    positions = sorted({item[field] for item in items for field in ("start", "end")})
+    byte_offsets, previous, byte_offset = {}, 0, 0
+    for position in positions:
+        byte_offset += len(markdown[previous:position].encode("utf-8"))
+        byte_offsets[position] = byte_offset
+        previous = position
+    for item in items:
+        item["byte_start"], item["byte_end"] = byte_offsets[item["start"]], byte_offsets[item["end"]]
+
+def parse_chart_directive(directive: str, directive_index: int = 0, area_name: str = "") -> Optional[dict]:
+    # directive is the text after "CHART_DATA:". Returns a dict shaped like schemas.ChartData, or None.
+    canonical = _CANONICAL_CHART_PATTERN.match(directive)
+    if canonical is not None:
+        fields = {key: value for key, value in canonical.groupdict().items() if value is not None}
+    else:
+        fields = {}
+        for field_match in _CHART_FIELD_PATTERN.finditer(directive):
+            value = field_match.group("quoted")
+            if value is None:
+                value = field_match.group("list") or field_match.group("bare")
+            fields.setdefault(field_match.group("key"), value)
+
+    chart_type = fields.get("TYPE")
+    raw_title = fields.get("TITLE")
+    if not chart_type or not raw_title or "LABELS" not in fields:
+        print(f"Incomplete CHART_DATA directive {directive_index} (needs TYPE, TITLE and LABELS). Skipping.")
+        return None
+    chart_title = _TITLE_CLEANUP_PATTERN.sub("", raw_title).strip()
+    chart_source = fields.get("SOURCE")
+
+    series = []
+    if "DATA" in fields:
+        series.append((None, fields["DATA"]))
+    if canonical is None:
+        series.extend(sorted(
+            ((int(m.group(1)), value) for key, value in fields.items() for m in [_DATA_SERIES_KEY_PATTERN.match(key)] if m),
+            key=lambda item: item[0],
+        ))
+    if not series:
+        print(f"CHART_DATA directive {directive_index} ('{chart_title}') has no DATA or DATA_SERIES_n values. Skipping.")
+        return None
+
+    try:
+        labels = _parse_list(fields["LABELS"])
+        series_names = _parse_list(fields["SERIES_LABELS"]) if "SERIES_LABELS" in fields else []
+        parsed_series = [(number, _parse_list(values)) for number, values in series]
+    except Exception as e_parse: # json/ast errors on malformed arrays
+        print(f"Error parsing CHART_DATA {directive_index} ('{chart_title}'): {e_parse}. Skipping.")
+        return None
+
+    if not labels or any(len(points) != len(labels) for _, points in parsed_series):
+        print(f"Chart data format/length mismatch for '{chart_title}' (Match {directive_index}). Labels: {len(labels)}, Data: {[len(points) for _, points in parsed_series]}. Skipping.")
+        return None
+    if len(labels) > MAX_CHART_POINTS:
+        print(f"Warning: Chart '{chart_title}' has {len(labels)} data points, truncating to {MAX_CHART_POINTS} for display.")
+        labels = labels[:MAX_CHART_POINTS]
+
+    datasets = []
+    for series_position, (number, points) in enumerate(parsed_series):
+        numeric_points = []
+        for point in points[:MAX_CHART_POINTS]:
+            value = _to_number(point)
+            if value is None:
+                print(f"Could not convert chart data point '{point}' for '{chart_title}'. Skipping chart.")
+                return None
+            numeric_points.append(value)
+        if number is None:
+            dataset_label = chart_title + (f" (Source: {chart_source})" if chart_source else "")
+        elif series_position < len(series_names):
+            dataset_label = str(series_names[series_position])
+        else:
+            dataset_label = f"Series {number}"
+        datasets.append({"label": dataset_label, "data": numeric_points})
+
+    return {
+        "type": chart_type.lower(), "title": chart_title, "labels": [str(label) for label in labels],
+        "datasets": datasets, "source": chart_source, "directive_index": directive_index,
+    }
+
+def _parse_list(text: str) -> list:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        value = ast.literal_eval(text)
+    if not isinstance(value, list):
+        raise ValueError(f"expected a list, got {type(value).__name__}")
+    return value
+
+def _to_number(point) -> Optional[float]:
+    if isinstance(point, (int, float)) and not isinstance(point, bool):
+        return float(point)
+    cleaned = _NON_NUMERIC_PATTERN.sub("", str(point).strip().replace("%", ""))
+    if not cleaned:
+        return None
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
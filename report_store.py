@@ -0,0 +1,232 @@
+# report_store.py
+# Report cache used by app.py. Reports are kept as plain "records" (the dict conduct_deep_research returns)
+# in a bounded in-memory LRU tier, optionally backed by a SQLite tier with zlib-compressed payloads so finished
+# reports survive restarts.
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+class MemoryLRUTier:
+    def __init__(self, max_entries: int = 200, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # report_id -> (record, size_bytes)
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, report_id: str) -> Optional[dict]:
+        entry = self._entries.get(report_id)
+        if entry is None:
+            return None
+        self._entries.move_to_end(report_id)
+        return entry[0]
+
+    def set(self, record: dict):
+        report_id = record["report_id"]
+        self.delete(report_id)
+        size = _record_size(record)
+        if size > self.max_bytes:
+            print(f"Report {report_id} ({size} bytes) is larger than the memory tier budget; keeping it on disk only.")
+            return
+        self._entries[report_id] = (record, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            evicted_id, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+            print(f"Evicted report {evicted_id} from memory cache ({evicted_size} bytes).")
+
+    def delete(self, report_id: str) -> bool:
+        entry = self._entries.pop(report_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+class SQLiteTier:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                " report_id TEXT PRIMARY KEY, area_name TEXT, payload BLOB NOT NULL,"
+                " created_at REAL NOT NULL, expires_at REAL)"
+            )
+            self._conn.commit()
+
+    def get(self, report_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, record: dict):
+        payload = zlib.compress(json.dumps(record).encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (report_id, area_name, payload, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (record["report_id"], record.get("area_name"), payload, record["created_at"], record.get("expires_at")),
+            )
+            self._conn.commit()
+
+    def delete(self, report_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM reports WHERE report_id = ?", (report_id,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def delete_expired(self, now: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM reports WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def clear(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM reports")
+            self._conn.commit()
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, stored_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM reports").fetchone()
+        return {"path": self.path, "entries": entries, "compressed_bytes": stored_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ReportStore:
+    # Tiered store: memory first, then disk (hits on disk are promoted back into memory).
+    # All methods are async so the SQLite work runs off the event loop.
+    def __init__(self, memory: MemoryLRUTier, disk: Optional[SQLiteTier] = None, default_ttl_seconds: Optional[float] = None):
+        self.memory = memory
+        self.disk = disk
+        self.default_ttl_seconds = default_ttl_seconds
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.expirations = 0
+
+    async def get(self, report_id: str, include_expired: bool = False) -> Optional[dict]:
+        # Expired records count as misses but are kept (until purged or evicted), so a refresh can reuse their
+        # still-fresh sections; include_expired=True returns them without touching the counters.
+        record = self.memory.get(report_id)
+        tier = "memory"
+        if record is None and self.disk is not None:
+            record = await asyncio.to_thread(self.disk.get, report_id)
+            tier = "disk"
+        if record is None:
+            if not include_expired:
+                self.misses += 1
+            return None
+        if tier == "disk":
+            self.memory.set(record)
+        if include_expired:
+            return record
+        if _is_expired(record):
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits[tier] += 1
+        return record
+
+    async def contains(self, report_id: str) -> bool:
+        # Does not touch the hit/miss counters.
+        record = self.memory.get(report_id)
+        if record is None and self.disk is not None:
+            record = await asyncio.to_thread(self.disk.get, report_id)
+        return record is not None and not _is_expired(record)
+
+    async def set(self, record: dict, ttl_seconds: Optional[float] = None) -> dict:
+        record = dict(record)
+        record.pop("full_text_for_follow_up", None) # older callers sent the markdown twice; store it once
+        ttl = self.default_ttl_seconds if ttl_seconds is None else ttl_seconds
+        record["created_at"] = time.time()
+        record["expires_at"] = record["created_at"] + ttl if ttl else None
+        self.memory.set(record)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, record)
+        return record
+
+    async def delete(self, report_id: str) -> bool:
+        deleted = self.memory.delete(report_id)
+        if self.disk is not None:
+            deleted = await asyncio.to_thread(self.disk.delete, report_id) or deleted
+        return deleted
+
+    async def purge(self, expired_only: bool = False) -> int:
+        now = time.time()
+        if expired_only:
+            expired_ids = [report_id for report_id in self.memory.keys() if _is_expired(self.memory.get(report_id), now)]
+            for report_id in expired_ids:
+                self.memory.delete(report_id)
+            removed = len(expired_ids)
+            if self.disk is not None:
+                removed = max(removed, await asyncio.to_thread(self.disk.delete_expired, now))
+            return removed
+        removed = len(self.memory.keys())
+        self.memory.clear()
+        if self.disk is not None:
+            removed = max(removed, await asyncio.to_thread(self.disk.clear))
+        return removed
+
+    async def stats(self) -> dict:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        stats = {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits["memory"] + self.hits["disk"]) / lookups, 4) if lookups else None,
+            "default_ttl_seconds": self.default_ttl_seconds,
+            "memory": self.memory.stats(),
+        }
+        if self.disk is not None:
+            stats["disk"] = await asyncio.to_thread(self.disk.stats)
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+def _record_size(record: dict) -> int:
+    return len(json.dumps(record).encode("utf-8"))
+
+def _is_expired(record: dict, now: float = None) -> bool:
+    expires_at = record.get("expires_at")
+    return expires_at is not None and expires_at <= (now or time.time())
+
+def create_report_store_from_env(base_dir: str) -> ReportStore:
+    # REPORT_STORE_BACKEND: "tiered" (memory + SQLite, default) or "memory".
+    backend = os.getenv("REPORT_STORE_BACKEND", "tiered").lower()
+    memory = MemoryLRUTier(
+        max_entries=int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 200)),
+        max_bytes=int(os.getenv("REPORT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    )
+    disk = None
+    if backend == "tiered":
+        disk = SQLiteTier(os.getenv("REPORT_STORE_PATH", os.path.join(base_dir, "report_cache.sqlite3")))
+    elif backend != "memory":
+        print(f"WARNING: Unknown REPORT_STORE_BACKEND '{backend}', using the in-memory store only.")
+    ttl = float(os.getenv("REPORT_TTL_SECONDS", 7 * 24 * 3600)) # 0 disables expiry
+    return ReportStore(memory, disk, default_ttl_seconds=ttl or None)
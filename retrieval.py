@@ -0,0 +1,136 @@
+# retrieval.py
+# Per-report BM25 index used to pick only the relevant parts of a report as context for /ask,
+# instead of sending the whole 5000+ word document to the follow-up model every time.
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Tuple
+
+FOLLOW_UP_TOP_K = int(os.getenv("FOLLOW_UP_TOP_K", 6))
+FOLLOW_UP_CONTEXT_TOKEN_BUDGET = int(os.getenv("FOLLOW_UP_CONTEXT_TOKEN_BUDGET", 2500))
+MAX_CHUNK_TOKENS = int(os.getenv("FOLLOW_UP_MAX_CHUNK_TOKENS", 600))
+CHARS_PER_TOKEN = 3.7 # same rough estimate services.py uses for prompt sizes
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_HEADING_PATTERN = re.compile(r"^(#{1,3})\s+(.+?)\s*$")
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can did do does for from has have how i in is it its of on or our "
+    "that the their there these this to was were what when where which who why will with about "
+    "please tell me report according".split()
+)
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+@dataclass
+class ReportChunk:
+    position: int
+    heading_path: str
+    text: str
+    tokens: int
+
+def split_report_into_chunks(markdown: str, max_chunk_tokens: int = MAX_CHUNK_TOKENS) -> List[ReportChunk]:
+    # Chunks follow the H2/H3 structure; oversized sections are further split on paragraph boundaries.
+    sections = []
+    headings = {}
+    current_lines = []
+
+    def flush():
+        text = "\n".join(current_lines).strip()
+        if text:
+            path = " > ".join(headings[level] for level in sorted(headings))
+            sections.append((path, text))
+
+    for line in markdown.splitlines():
+        heading_match = _HEADING_PATTERN.match(line)
+        if heading_match and len(heading_match.group(1)) >= 2:
+            flush()
+            current_lines = [line]
+            level = len(heading_match.group(1))
+            headings = {lvl: title for lvl, title in headings.items() if lvl < level}
+            headings[level] = heading_match.group(2).strip()
+        else:
+            current_lines.append(line)
+    flush()
+
+    chunks = []
+    for path, text in sections:
+        for piece in _split_oversized(text, max_chunk_tokens):
+            chunks.append(ReportChunk(position=len(chunks), heading_path=path, text=piece, tokens=estimate_tokens(piece)))
+    return chunks
+
+def _split_oversized(text: str, max_chunk_tokens: int) -> List[str]:
+    if estimate_tokens(text) <= max_chunk_tokens:
+        return [text]
+    pieces, current = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        candidate = "\n\n".join(current + [paragraph])
+        if current and estimate_tokens(candidate) > max_chunk_tokens:
+            pieces.append("\n\n".join(current))
+            current = [paragraph]
+        else:
+            current.append(paragraph)
+    if current:
+        pieces.append("\n\n".join(current))
+    return pieces
+
+class ReportIndex:
+    def __init__(self, chunks: List[ReportChunk]):
+        self.chunks = chunks
+        # Heading terms are indexed with each chunk (and counted twice) so "schemes" finds the "Government Schemes" section.
+        self._term_freqs = [Counter(tokenize(chunk.heading_path) * 2 + tokenize(chunk.text)) for chunk in chunks]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        doc_freqs = Counter()
+        for freqs in self._term_freqs:
+            doc_freqs.update(freqs.keys())
+        n_chunks = len(chunks)
+        self._idf = {term: math.log(1 + (n_chunks - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+        self.total_tokens = sum(chunk.tokens for chunk in chunks)
+
+    @classmethod
+    def from_markdown(cls, markdown: str) -> "ReportIndex":
+        return cls(split_report_into_chunks(markdown))
+
+    def search(self, question: str) -> List[Tuple[float, ReportChunk]]:
+        query_terms = set(tokenize(question))
+        scored = []
+        for chunk, freqs, length in zip(self.chunks, self._term_freqs, self._lengths):
+            score = 0.0
+            for term in query_terms:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self._avg_length or 1))
+                score += self._idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            scored.append((score, chunk))
+        scored.sort(key=lambda item: (-item[0], item[1].position))
+        return scored
+
+    def select_context(self, question: str, top_k: int = FOLLOW_UP_TOP_K, token_budget: int = FOLLOW_UP_CONTEXT_TOKEN_BUDGET) -> str:
+        ranked = self.search(question)
+        if not ranked or ranked[0][0] <= 0:
+            # No lexical overlap at all: fall back to the start of the report (title, contents, introduction).
+            ranked = [(0.0, chunk) for chunk in self.chunks]
+        selected, used_tokens = [], 0
+        for score, chunk in ranked:
+            if len(selected) >= top_k:
+                break
+            if used_tokens + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used_tokens += chunk.tokens
+        if not selected and ranked:
+            # Even the best chunk is over budget on its own; send a truncated copy rather than nothing.
+            best = ranked[0][1]
+            selected = [ReportChunk(best.position, best.heading_path, best.text[:int(token_budget * CHARS_PER_TOKEN)], token_budget)]
+        selected.sort(key=lambda chunk: chunk.position) # keep document order so the excerpts read naturally
+        return "\n\n[...]\n\n".join(f"[Section: {chunk.heading_path}]\n{chunk.text}" if chunk.heading_path else chunk.text for chunk in selected)
@@ -0,0 +1,345 @@
+# scheduler.py
+# Central admission control for Perplexity calls, used by services.py. Every upstream attempt takes a slot first.
+# Slots are limited by a concurrency cap and a tokens-per-minute bucket, both per model and for the account as a
+# whole, plus optionally an extra budget of the caller's (e.g. a research depth's cap on its model's capacity). Follow-up questions are served before deep research. Within one priority, the client with the fewest
+# calls in progress goes next. Calls whose estimated queue wait exceeds their latency budget are turned away up
+# front with a 429, using the estimate as Retry-After. Everything runs on the event loop, so no locking.
+import asyncio
+import contextvars
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from metrics import SCHEDULER_ACTIVE_SLOTS, SCHEDULER_QUEUE_DEPTH, SCHEDULER_REJECTED, SCHEDULER_WAIT
+from upstream import Deadline, DeadlineExceededError, LatencyWindow, UpstreamError
+
+PRIORITY_INTERACTIVE = 0 # /ask follow-ups
+PRIORITY_RESEARCH = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_RESEARCH: "research"}
+
+# Whose behalf the current request runs on, for fair sharing. The HTTP middleware sets it from X-Client-ID or the client address.
+client_id_var: contextvars.ContextVar = contextvars.ContextVar("client_id", default=None)
+
+class AdmissionRejectedError(UpstreamError):
+    # Raised before anything is sent upstream, so it is neither retried nor counted by the circuit breaker.
+    status_code = 429
+
+class TokenBucket:
+    # Refills continuously at tokens_per_minute / 60 per second, up to one minute's worth. tokens_per_minute <= 0 means unlimited.
+    def __init__(self, tokens_per_minute: float):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def available(self) -> float:
+        if self.unlimited:
+            return math.inf
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return self.tokens
+
+    def seconds_until(self, amount: float) -> float:
+        # A single call larger than the whole bucket only waits for a full bucket; it can never fit otherwise.
+        if self.unlimited:
+            return 0.0
+        return max(0.0, (min(amount, self.capacity) - self.available()) / self.rate)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.tokens = self.available() - min(amount, self.capacity)
+
+    def settle(self, charged: float, used: float):
+        # Swap the up-front estimate for the usage the API reported. The balance may go negative, which delays later calls.
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.available() + min(charged, self.capacity) - used)
+
+@dataclass
+class Budget:
+    name: str
+    max_concurrency: int
+    tokens_per_minute: float = 0
+    active: int = 0
+    bucket: TokenBucket = field(init=False)
+
+    def __post_init__(self):
+        self.bucket = TokenBucket(self.tokens_per_minute)
+
+    def stats(self) -> dict:
+        available = self.bucket.available()
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute or None,
+            "tokens_available": None if math.isinf(available) else round(available),
+        }
+
+@dataclass
+class SchedulerSlot:
+    model: str
+    priority: int
+    client_id: str
+    estimated_tokens: int
+    granted_at: float
+    used_tokens: Optional[int] = None # set from the API usage field; release() then corrects the token buckets
+    extra_budget: Optional[str] = None
+
+@dataclass
+class _Waiter:
+    seq: int
+    model: str
+    priority: int
+    client_id: str
+    tokens: int
+    enqueued_at: float
+    future: asyncio.Future
+    extra_budget: Optional[str] = None
+
+class UpstreamScheduler:
+    def __init__(self, model_budgets: Dict[str, Budget], account_budget: Budget, max_wait_seconds: Dict[int, float], max_queue: int = 200):
+        # max_wait_seconds: latency budget per priority; calls expected to wait longer (or past their deadline) are rejected.
+        self.model_budgets = dict(model_budgets)
+        self.account_budget = account_budget
+        self.max_wait_seconds = max_wait_seconds
+        self.max_queue = max_queue
+        self._waiters = [] # arrival order
+        self._seq = itertools.count()
+        self._active_by_client = {}
+        self._hold_seconds = {} # budget name -> moving average of how long a slot is held
+        self._wait_windows = {priority: LatencyWindow(min_samples=1) for priority in PRIORITY_NAMES}
+        self._queue_depth_keys = set()
+        self._wakeup = None
+        self.granted = 0
+        self.rejected = {"over_budget": 0, "queue_full": 0, "deadline": 0}
+
+    @asynccontextmanager
+    async def slot(self, model: str, estimated_tokens: int, deadline: Deadline, priority: int = PRIORITY_RESEARCH, client_id: str = None, extra_budget: str = None):
+        granted = await self.acquire(model, estimated_tokens, deadline, priority, client_id, extra_budget)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    async def acquire(self, model: str, estimated_tokens: int, deadline: Deadline, priority: int = PRIORITY_RESEARCH, client_id: str = None, extra_budget: str = None) -> SchedulerSlot:
+        # extra_budget names a budget the call is charged to on top of its model's and the account's.
+        waiter = _Waiter(next(self._seq), model, priority, client_id or client_id_var.get() or "anonymous", estimated_tokens,
+                         time.monotonic(), asyncio.get_running_loop().create_future(), extra_budget)
+        self._waiters.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return waiter.future.result()
+
+        estimate = self.estimate_wait(waiter)
+        limit = min(self.max_wait_seconds.get(priority, math.inf), deadline.remaining())
+        if len(self._waiters) > self.max_queue or estimate > limit:
+            reason = "queue_full" if len(self._waiters) > self.max_queue else "over_budget"
+            self._abandon(waiter)
+            self._count_rejection(waiter, reason)
+            print(f"Rejecting {PRIORITY_NAMES.get(priority, priority)} call to {model} for client {waiter.client_id}: {reason} (estimated wait {estimate:.1f}s, budget {limit:.1f}s, {len(self._waiters)} queued).")
+            raise AdmissionRejectedError(f"The server is at capacity for {model} requests (estimated wait {estimate:.0f}s). Please try again later.",
+                                         retry_after=max(1.0, estimate if math.isfinite(estimate) else self._hold_seconds.get(model, 1.0)))
+
+        self._publish_queue_depth()
+        try:
+            await asyncio.wait({waiter.future}, timeout=deadline.remaining())
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not waiter.future.done():
+            self._abandon(waiter)
+            self._count_rejection(waiter, "deadline")
+            raise DeadlineExceededError(f"No upstream capacity for {model} became free within the {deadline.seconds:.0f}s time budget. Please try again later.")
+        return waiter.future.result()
+
+    def release(self, slot: SchedulerSlot):
+        self.account_budget.active -= 1
+        remaining = self._active_by_client.get(slot.client_id, 1) - 1
+        if remaining > 0:
+            self._active_by_client[slot.client_id] = remaining
+        else:
+            self._active_by_client.pop(slot.client_id, None)
+        held = time.monotonic() - slot.granted_at
+        for budget in self._budgets(slot.model, slot.extra_budget):
+            budget.active -= 1
+            previous = self._hold_seconds.get(budget.name)
+            self._hold_seconds[budget.name] = held if previous is None else 0.8 * previous + 0.2 * held
+            if slot.used_tokens is not None:
+                budget.bucket.settle(slot.estimated_tokens, slot.used_tokens)
+            SCHEDULER_ACTIVE_SLOTS.set(budget.active, model=budget.name)
+        if slot.used_tokens is not None:
+            self.account_budget.bucket.settle(slot.estimated_tokens, slot.used_tokens)
+        self._dispatch()
+
+    def estimate_wait(self, waiter: _Waiter) -> float:
+        # Rough queueing estimate: full rounds of the model's concurrency cap ahead of this call (times the average
+        # slot hold time), or the time for the token buckets to refill for everything ahead, whichever is longer.
+        ahead = [other for other in self._waiters if other is not waiter and
+                 (other.priority < waiter.priority or (other.priority == waiter.priority and other.seq < waiter.seq))]
+
+        estimate = 0.0
+        queues = [(self.account_budget.bucket, ahead)]
+        for budget in self._budgets(waiter.model, waiter.extra_budget):
+            same_budget = [other for other in ahead if budget.name in (other.model, other.extra_budget)]
+            hold = self._hold_seconds.get(budget.name)
+            slots_short = budget.active + len(same_budget) + 1 - budget.max_concurrency
+            if hold is not None and slots_short > 0:
+                estimate = max(estimate, math.ceil(slots_short / budget.max_concurrency) * hold)
+            queues.append((budget.bucket, same_budget))
+        for bucket, queued in queues:
+            if not bucket.unlimited:
+                needed = sum(min(other.tokens, bucket.capacity) for other in queued) + min(waiter.tokens, bucket.capacity)
+                estimate = max(estimate, (needed - bucket.available()) / bucket.rate)
+        return estimate
+
+    def stats(self) -> dict:
+        queued = {}
+        now = time.monotonic()
+        for waiter in self._waiters:
+            counts = queued.setdefault(waiter.model, {})
+            name = PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+            counts[name] = counts.get(name, 0) + 1
+        waits = {}
+        for priority, window in self._wait_windows.items():
+            p50, p95 = window.percentile(50), window.percentile(95)
+            waits[PRIORITY_NAMES[priority]] = {"p50_seconds": round(p50, 3) if p50 is not None else None,
+                                               "p95_seconds": round(p95, 3) if p95 is not None else None}
+        return {
+            "account": self.account_budget.stats(),
+            "models": {name: {**budget.stats(), "queued": queued.get(name, {}),
+                              "avg_hold_seconds": round(self._hold_seconds[name], 3) if name in self._hold_seconds else None}
+                       for name, budget in self.model_budgets.items()},
+            "queued": len(self._waiters),
+            "oldest_wait_seconds": round(now - self._waiters[0].enqueued_at, 3) if self._waiters else None,
+            "max_wait_seconds": {PRIORITY_NAMES.get(priority, str(priority)): seconds for priority, seconds in self.max_wait_seconds.items()},
+            "wait": waits,
+            "clients_active": len(self._active_by_client),
+            "granted": self.granted,
+            "rejected": dict(self.rejected),
+        }
+
+    def _budget(self, model: str) -> Budget:
+        budget = self.model_budgets.get(model)
+        if budget is None: # a model without its own settings is limited by the account budget only
+            budget = self.model_budgets[model] = Budget(model, self.account_budget.max_concurrency)
+        return budget
+
+    def _budgets(self, model: str, extra_budget: Optional[str]) -> List[Budget]:
+        if extra_budget is None or extra_budget == model:
+            return [self._budget(model)]
+        return [self._budget(model), self._budget(extra_budget)]
+
+    def _dispatch(self):
+        # Grants free slots in (priority, client fairness, arrival) order. A client's n-th queued call ranks as if
+        # the client already had n more calls in progress, so clients are served round-robin.
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        ranks, ordered = {}, []
+        for waiter in self._waiters:
+            rank = ranks.get((waiter.priority, waiter.client_id), 0)
+            ranks[(waiter.priority, waiter.client_id)] = rank + 1
+            ordered.append(((waiter.priority, self._active_by_client.get(waiter.client_id, 0) + rank, waiter.seq), waiter))
+        ordered.sort(key=lambda item: item[0])
+
+        blocked_budgets = set()
+        refill_in = None
+        for _, waiter in ordered:
+            if self.account_budget.active >= self.account_budget.max_concurrency:
+                break
+            budgets = self._budgets(waiter.model, waiter.extra_budget)
+            if any(budget.name in blocked_budgets for budget in budgets):
+                continue
+            account_wait = self.account_budget.bucket.seconds_until(waiter.tokens)
+            if account_wait > 0:
+                # Account tokens go to the best-ranked waiter first, so nobody behind it may take them.
+                refill_in = account_wait if refill_in is None else min(refill_in, account_wait)
+                break
+            full = [budget for budget in budgets if budget.active >= budget.max_concurrency]
+            if full:
+                blocked_budgets.update(budget.name for budget in full)
+                continue
+            budget_waits = [(budget, budget.bucket.seconds_until(waiter.tokens)) for budget in budgets]
+            short = [(budget, wait) for budget, wait in budget_waits if wait > 0]
+            if short:
+                # Hold the line for these budgets so a run of small calls can't starve a large one.
+                blocked_budgets.update(budget.name for budget, _ in short)
+                budget_wait = max(wait for _, wait in short)
+                refill_in = budget_wait if refill_in is None else min(refill_in, budget_wait)
+                continue
+            self._waiters.remove(waiter)
+            waiter.future.set_result(self._grant(waiter))
+
+        if refill_in is not None and self._waiters:
+            self._wakeup = asyncio.get_running_loop().call_later(refill_in, self._dispatch)
+        self._publish_queue_depth()
+
+    def _grant(self, waiter: _Waiter) -> SchedulerSlot:
+        budgets = self._budgets(waiter.model, waiter.extra_budget)
+        for budget in budgets:
+            budget.active += 1
+            budget.bucket.take(waiter.tokens)
+            SCHEDULER_ACTIVE_SLOTS.set(budget.active, model=budget.name)
+        self.account_budget.active += 1
+        self.account_budget.bucket.take(waiter.tokens)
+        self._active_by_client[waiter.client_id] = self._active_by_client.get(waiter.client_id, 0) + 1
+        self.granted += 1
+        now = time.monotonic()
+        waited = now - waiter.enqueued_at
+        self._wait_windows.setdefault(waiter.priority, LatencyWindow(min_samples=1)).add(waited)
+        SCHEDULER_WAIT.observe(waited, model=waiter.model, priority=PRIORITY_NAMES.get(waiter.priority, str(waiter.priority)))
+        return SchedulerSlot(waiter.model, waiter.priority, waiter.client_id, waiter.tokens, now, extra_budget=waiter.extra_budget)
+
+    def _abandon(self, waiter: _Waiter):
+        # The caller gave up (rejected, cancelled or out of time). Hand back a slot granted in the meantime.
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self._dispatch()
+        elif waiter.future.done() and not waiter.future.cancelled():
+            self.release(waiter.future.result())
+
+    def _count_rejection(self, waiter: _Waiter, reason: str):
+        self.rejected[reason] += 1
+        SCHEDULER_REJECTED.inc(model=waiter.model, priority=PRIORITY_NAMES.get(waiter.priority, str(waiter.priority)), reason=reason)
+
+    def _publish_queue_depth(self):
+        depth = {}
+        for waiter in self._waiters:
+            key = (waiter.model, PRIORITY_NAMES.get(waiter.priority, str(waiter.priority)))
+            depth[key] = depth.get(key, 0) + 1
+        for key in self._queue_depth_keys | set(depth):
+            SCHEDULER_QUEUE_DEPTH.set(depth.get(key, 0), model=key[0], priority=key[1])
+        self._queue_depth_keys |= set(depth)
+
+def research_budget_name(depth_name: str) -> str:
+    # Research calls are charged to their model's budget and also to a per-depth one, so each depth has its own cap
+    # even when it runs on the follow-up model or on a model nobody configured a budget for.
+    return f"research:{depth_name}"
+
+def create_upstream_scheduler_from_env(research_depth_concurrency: Dict[str, int], follow_up_model: str) -> UpstreamScheduler:
+    # research_depth_concurrency: depth name -> default concurrency cap, overridable via UPSTREAM_RESEARCH_<DEPTH>_*
+    # ("deep" keeps the original UPSTREAM_RESEARCH_* names). Keep their sum below UPSTREAM_MAX_CONCURRENCY so
+    # follow-ups always find a free slot.
+    model_budgets = {}
+    for depth_name, default_concurrency in research_depth_concurrency.items():
+        prefix = "UPSTREAM_RESEARCH_" if depth_name == "deep" else f"UPSTREAM_RESEARCH_{depth_name.upper()}_"
+        name = research_budget_name(depth_name)
+        model_budgets[name] = Budget(name, int(os.getenv(prefix + "MAX_CONCURRENCY", default_concurrency)), float(os.getenv(prefix + "TOKENS_PER_MINUTE", 0)))
+    model_budgets[follow_up_model] = Budget(follow_up_model, int(os.getenv("UPSTREAM_FOLLOW_UP_MAX_CONCURRENCY", 12)), float(os.getenv("UPSTREAM_FOLLOW_UP_TOKENS_PER_MINUTE", 0)))
+    return UpstreamScheduler(
+        model_budgets=model_budgets,
+        account_budget=Budget("account", int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 12)), float(os.getenv("UPSTREAM_TOKENS_PER_MINUTE", 0))),
+        max_wait_seconds={
+            PRIORITY_INTERACTIVE: float(os.getenv("SCHEDULER_MAX_WAIT_INTERACTIVE", 15.0)),
+            PRIORITY_RESEARCH: float(os.getenv("SCHEDULER_MAX_WAIT_RESEARCH", 600.0)),
+        },
+        max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", 200)),
+    )
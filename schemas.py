@@ -1,9 +1,24 @@
 # schemas.py
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Literal
+
+ResearchDepthName = Literal["quick", "standard", "deep"]
 
 class ResearchRequest(BaseModel):
     area: str
+    mode: Optional[Literal["single", "sectional"]] = None # None uses the server's RESEARCH_MODE
+    depth: Optional[ResearchDepthName] = None # None uses the server's DEFAULT_RESEARCH_DEPTH; a cached deeper report also answers
+
+class AreaResolution(BaseModel):
+    query: str
+    area_name: str # canonical name; reports for any spelling of the area are generated and cached under it
+    report_id: str # of the requested depth
+    depth: str = "deep"
+    match: str # exact | alias | fuzzy | unknown
+    score: float
+    kind: Optional[str] = None # country | state | territory | city, for areas in the gazetteer
+    country: Optional[str] = None
+    cached: bool = False # a report of this depth or a deeper one is cached
 
 class ChartDataset(BaseModel):
     label: str
@@ -17,18 +32,124 @@ class ChartData(BaseModel):
     datasets: List[ChartDataset]
     title: Optional[str] = None
     source: Optional[str] = None
+    directive_index: Optional[int] = None # position of the CHART_DATA line this chart came from in the markdown
 
 class ReportResponse(BaseModel):
     report_id: str
     area_name: str
+    depth: str = "deep" # may be deeper than requested when a cached deeper report answered; reports from before depths are deep
     full_report_markdown: str
     charts: List[ChartData] = []
-    full_text_for_follow_up: str
+
+class ReportSubsection(BaseModel):
+    title: str
+    level: int
+    start: int # character offsets into full_report_markdown
+    end: int
+    byte_start: int # the same positions in the UTF-8 encoded markdown
+    byte_end: int
+
+class ReportTable(BaseModel):
+    caption: Optional[str] = None
+    header: List[str]
+    rows: List[List[str]]
+    start: int
+    end: int
+    byte_start: int
+    byte_end: int
+
+class ReportCitation(BaseModel):
+    text: str # "WHO, 2022" or "[3]"
+    reference: Optional[int] = None # index into the report's references, None if no entry matched
+    count: int = 1 # occurrences in the section
+
+class ReferenceEntry(BaseModel):
+    index: int
+    text: str
+    cited_in: List[str] = [] # section keys
+
+class ReportSectionSummary(BaseModel):
+    key: str # SECTION_STRUCTURE_GUIDE key where known ("major_diseases"), else a slug of the heading ("contents")
+    title: Optional[str] = None
+    level: int
+    start: int
+    end: int
+    byte_start: int
+    byte_end: int
+    subsections: List[ReportSubsection] = []
+    table_count: int = 0
+    chart_count: int = 0
+    citation_count: int = 0
+
+class ReportOutline(BaseModel):
+    report_id: str
+    area_name: str
+    sections: List[ReportSectionSummary]
+    reference_count: int = 0
+
+class ReportSection(BaseModel):
+    key: str
+    title: Optional[str] = None
+    level: int
+    start: int
+    end: int
+    byte_start: int
+    byte_end: int
+    markdown: str
+    html: Optional[str] = None # the pre-rendered fragment (see GET /reports/{report_id}/html), with include_html=true
+    subsections: List[ReportSubsection] = []
+    tables: List[ReportTable] = []
+    charts: List[ChartData] = []
+    citations: List[ReportCitation] = []
+    references: List[ReferenceEntry] = [] # the entries cited in this section (all of them for the References section)
+
+class ReportSectionPage(BaseModel):
+    report_id: str
+    area_name: str
+    total: int
+    offset: int
+    limit: int
+    sections: List[ReportSection]
+
+class ResearchJobStatus(BaseModel):
+    job_id: str
+    area_name: str
+    report_id: str
+    status: str # queued | running | completed | failed
+    progress: Optional[str] = None
+    queue_position: Optional[int] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    report: Optional[ReportResponse] = None
+
+class BatchResearchRequest(BaseModel):
+    areas: List[str] = []
+    mode: Optional[Literal["single", "sectional"]] = None
+    depth: Optional[ResearchDepthName] = None
+    max_concurrency: Optional[int] = None # capped at the server's BATCH_RESEARCH_CONCURRENCY
+    resume_token: Optional[str] = None # from the last NDJSON line of an interrupted batch; its outstanding areas are added to areas
+
+class RefreshReportRequest(BaseModel):
+    sections: Optional[List[str]] = None # SECTION_STRUCTURE_GUIDE keys to regenerate even if still fresh
+    force: bool = False # regenerate every section
+
+class RefreshReportResponse(BaseModel):
+    report: ReportResponse
+    refreshed: List[str] = []
+    reused: List[str] = []
+    failed: Dict[str, str] = {} # section key -> error; these keep their previous text
+
+class WarmCacheRequest(BaseModel):
+    areas: List[str]
+    depth: Optional[ResearchDepthName] = None
+    refresh: bool = False # regenerate even if a cached report exists
 
 class QuestionRequest(BaseModel):
     report_id: str
     question: str
-    report_context: str
+    report_context: Optional[str] = None # deprecated: the server looks the report up by report_id
 
 class AnswerResponse(BaseModel):
     answer: str
@@ -1,6 +1,7 @@
 // static/js/script.js
 document.addEventListener('DOMContentLoaded', () => {
     const researchAreaInput = document.getElementById('researchAreaInput');
+    const researchDepthSelect = document.getElementById('researchDepthSelect');
     const startResearchBtn = document.getElementById('startResearchBtn');
     const loadingIndicator = document.getElementById('loadingIndicator');
     const errorMessageDiv = document.getElementById('errorMessage');
@@ -62,6 +63,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     startResearchBtn.addEventListener('click', async () => {
         const area = researchAreaInput.value.trim();
+        const depth = researchDepthSelect.value;
         if (!area) {
             displayError('Please enter a geographical area.');
             return;
@@ -80,40 +82,222 @@ document.addEventListener('DOMContentLoaded', () => {
         startResearchBtn.disabled = true;
         researchAreaInput.disabled = true;
 
+        if (await loadKnownReport(area, depth)) return;
+        streamResearchReport(area, depth);
+    });
+
+    // Report ids of areas viewed before. A repeat view becomes a conditional GET /reports/{id}, which is usually
+    // a 304 served from the browser cache, instead of downloading the whole report again over the research stream.
+    // Deep reports are remembered by area alone (as before depths existed), other depths by "area|depth".
+    const REPORT_IDS_STORAGE_KEY = 'reportIdsByArea';
+
+    function reportIdKey(area, depth) {
+        return depth === 'deep' ? area.toLowerCase() : `${area.toLowerCase()}|${depth}`;
+    }
+
+    function knownReportIds() {
         try {
-            const response = await fetch('/research', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ area: area }) 
-            });
+            return JSON.parse(localStorage.getItem(REPORT_IDS_STORAGE_KEY)) || {};
+        } catch (e) {
+            return {};
+        }
+    }
 
-            if (!response.ok) {
-                let errorMsg = `HTTP error! Status: ${response.status}`;
-                try {
-                    const errorData = await response.json();
-                    errorMsg = errorData.detail || errorMsg;
-                } catch (e) {
-                    errorMsg = `${errorMsg} - ${response.statusText || 'Server error'}`;
-                }
-                throw new Error(errorMsg);
+    function rememberReportId(area, depth, reportId) {
+        const ids = knownReportIds();
+        ids[reportIdKey(area, depth)] = reportId;
+        try {
+            localStorage.setItem(REPORT_IDS_STORAGE_KEY, JSON.stringify(ids));
+        } catch (e) {
+            // Storage full or disabled: repeat views just go through the stream again.
+        }
+    }
+
+    async function loadKnownReport(area, depth) {
+        const reportId = knownReportIds()[reportIdKey(area, depth)];
+        if (!reportId) return false;
+        if (await displayRenderedReport(reportId)) {
+            loadingIndicator.style.display = 'none';
+            startResearchBtn.disabled = false;
+            researchAreaInput.disabled = false;
+            return true;
+        }
+        let data;
+        try {
+            const response = await fetch(`/reports/${encodeURIComponent(reportId)}`, { cache: 'no-cache' });
+            if (!response.ok) return false; // evicted or expired on the server: generate it again
+            data = await response.json();
+        } catch (error) {
+            return false;
+        }
+        loadingIndicator.style.display = 'none';
+        startResearchBtn.disabled = false;
+        researchAreaInput.disabled = false;
+        currentReportData = data;
+        displayReport(currentReportData);
+        return true;
+    }
+
+    // Streams the report over Server-Sent Events (/research/stream) and renders the markdown as it arrives.
+    // The final "done" event carries the full ReportResponse, which is rendered with charts by displayReport.
+    function streamResearchReport(area, depth) {
+        const eventSource = new EventSource(`/research/stream?area=${encodeURIComponent(area)}&depth=${encodeURIComponent(depth)}`);
+        let streamedMarkdown = '';
+        let renderScheduled = false;
+        let finished = false;
+
+        const finish = () => {
+            finished = true;
+            eventSource.close();
+            loadingIndicator.style.display = 'none';
+            startResearchBtn.disabled = false;
+            researchAreaInput.disabled = false;
+        };
+
+        const renderPartialReport = () => {
+            renderScheduled = false;
+            if (finished) return;
+            // Charts are drawn once the full report arrives; until then show a placeholder for each directive line.
+            const partialMarkdown = streamedMarkdown.replace(/^CHART_DATA:.*$/gm, '*(Chart will appear when the report is complete.)*');
+            reportContentDiv.innerHTML = renderMarkdownToHtml(partialMarkdown);
+        };
+
+        eventSource.addEventListener('content', (event) => {
+            const payload = JSON.parse(event.data);
+            streamedMarkdown += payload.delta;
+            if (reportSectionDiv.style.display !== 'block') {
+                reportAreaTitleH2.textContent = `Comprehensive Health Analysis Report for: ${area}`;
+                reportSectionDiv.style.display = 'block';
             }
+            if (!renderScheduled) {
+                renderScheduled = true;
+                requestAnimationFrame(renderPartialReport);
+            }
+        });
 
-            currentReportData = await response.json();
+        eventSource.addEventListener('done', async (event) => {
+            finish();
+            currentReportData = JSON.parse(event.data);
+            rememberReportId(area, depth, currentReportData.report_id);
+            if (await displayRenderedReport(currentReportData.report_id)) return;
             displayReport(currentReportData);
+        });
+
+        eventSource.addEventListener('failed', (event) => {
+            finish();
+            const payload = JSON.parse(event.data);
+            console.error('Research error:', payload.detail);
+            displayError(`Failed to generate health report: ${payload.detail}`);
+        });
 
+        eventSource.onerror = () => {
+            // EventSource would otherwise reconnect and start a new stream; treat a dropped connection as final.
+            if (finished) return;
+            finish();
+            displayError('Failed to generate health report: the connection to the server was lost. Please try again.');
+        };
+    }
+
+    // Server-rendered reports (GET /reports/{id}/html): NDJSON with a header line, then one sanitized HTML fragment per
+    // section with its Chart.js configs. Each fragment is inserted as soon as its line arrives, yielding to the browser
+    // in between so the first sections show before the rest are parsed; charts are created when scrolled into view.
+    // Returns false when server-side rendering is unavailable, and the caller renders the markdown itself.
+    async function displayRenderedReport(reportId) {
+        let response;
+        try {
+            response = await fetch(`/reports/${encodeURIComponent(reportId)}/html`, { cache: 'no-cache' });
         } catch (error) {
-            console.error('Research error:', error);
-            displayError(`Failed to generate health report: ${error.message}`);
-            if (currentReportData && currentReportData.full_report_markdown && currentReportData.full_report_markdown.startsWith("Error:")) {
-                 reportContentDiv.innerHTML = `<div class="report-subsection"><h3>Raw AI Error Details</h3><pre style="white-space: pre-wrap; word-wrap: break-word;">${currentReportData.full_report_markdown}</pre></div>`;
-                 reportSectionDiv.style.display = 'block';
+            return false;
+        }
+        if (!response.ok || !response.body) return false;
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const chartObserver = 'IntersectionObserver' in window ? new IntersectionObserver((entries, observer) => {
+            entries.filter(entry => entry.isIntersecting).forEach(entry => {
+                observer.unobserve(entry.target);
+                renderServerChart(entry.target, entry.target.chartConfig);
+            });
+        }, { rootMargin: '200px' }) : null;
+        let buffered = '';
+        let started = false;
+
+        const handleLine = (line) => {
+            const item = JSON.parse(line);
+            if (item.type === 'report') {
+                currentReportData = { report_id: item.report_id, area_name: item.area_name };
+                reportAreaTitleH2.textContent = `Comprehensive Health Analysis Report for: ${item.area_name}`;
+                chartInstances.forEach(chart => chart.destroy());
+                chartInstances = [];
+                reportContentDiv.innerHTML = '';
+                reportSectionDiv.style.display = 'block';
+                started = true;
+                return;
             }
-        } finally {
-            loadingIndicator.style.display = 'none';
-            startResearchBtn.disabled = false;
-            researchAreaInput.disabled = false;
+            const sectionElement = document.createElement('section');
+            sectionElement.className = 'report-fragment';
+            sectionElement.dataset.section = item.key;
+            sectionElement.innerHTML = item.html; // sanitized on the server (raw HTML in the markdown is escaped)
+            sectionElement.querySelectorAll('.chart-render-target[data-chart]').forEach(target => {
+                target.chartConfig = item.charts[Number(target.dataset.chart)];
+                if (chartObserver) chartObserver.observe(target);
+                else renderServerChart(target, target.chartConfig);
+            });
+            reportContentDiv.appendChild(sectionElement);
+        };
+
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop();
+                for (const line of lines) {
+                    if (!line) continue;
+                    handleLine(line);
+                    await new Promise(resolve => requestAnimationFrame(resolve));
+                }
+            }
+            if (buffered.trim()) handleLine(buffered);
+        } catch (error) {
+            console.error('Error reading the rendered report:', error);
+            return started;
         }
-    });
+        return started;
+    }
+
+    function renderServerChart(target, chartConfig) {
+        if (!chartConfig) return;
+        const canvas = document.createElement('canvas');
+        target.appendChild(canvas);
+        // The server sends plain data; number formatting needs functions, which are added here.
+        const config = structuredClone(chartConfig);
+        config.options.plugins.tooltip.callbacks = {
+            label: function(context) {
+                const chartType = context.chart.config.type;
+                let label = (chartType === 'pie' || chartType === 'doughnut') ? (context.label || '') : (context.dataset.label || '');
+                if (label) { label += ': '; }
+                let value;
+                if (context.parsed.y !== undefined) value = context.parsed.y;
+                else if (context.parsed.r !== undefined) value = context.parsed.r;
+                else value = context.parsed;
+                if (value !== null && value !== undefined) {
+                    label += new Intl.NumberFormat('en-US', { maximumFractionDigits: 2 }).format(value);
+                }
+                return label;
+            }
+        };
+        Object.values(config.options.scales || {}).forEach(scale => {
+            if (scale.ticks) scale.ticks.callback = value => Number(value.toFixed(1));
+        });
+        try {
+            chartInstances.push(new Chart(canvas.getContext('2d'), config));
+        } catch (e) {
+            console.error("Error rendering chart:", e, "Chart config:", JSON.stringify(chartConfig, null, 2));
+            target.innerHTML = `<p class="error-message">Could not render chart: ${chartConfig.options.plugins.title.text || 'Untitled Chart'}. Error: ${e.message}</p>`;
+        }
+    }
 
     function displayReport(data) {
         if (!data || !data.area_name || typeof data.full_report_markdown !== 'string') {
@@ -127,22 +311,22 @@ document.addEventListener('DOMContentLoaded', () => {
         chartInstances = [];
         reportContentDiv.innerHTML = '';
 
-        if (data.full_report_markdown.startsWith("Error:")) {
-            reportContentDiv.innerHTML = `<div class="report-subsection"><h3>Report Generation Error</h3><pre style="white-space: pre-wrap; word-wrap: break-word;">${data.full_report_markdown}</pre></div>`;
-            reportSectionDiv.style.display = 'block';
-            return;
-        }
-        
         let markdownWithPlaceholders = data.full_report_markdown;
         const chartDataForRendering = []; 
-        const chartDirectiveRegex = /CHART_DATA:\s*TYPE=(?<type>\w+)\s*TITLE="(?<title>[^"]+)"\s*LABELS=(?<labels>\[[^\]]*\])\s*DATA=(?<data>\[[^\]]*\])(?:\s*SOURCE="(?<source>[^"]+)")?/g;
+        // Matches every CHART_DATA line (single DATA=[...] or multi-series DATA_SERIES_n=[...]), in the same order
+        // the server counts them; each parsed chart carries the directive_index of the line it came from.
+        const chartDirectiveRegex = /CHART_DATA:[^\n]*/g;
+        const chartsByDirective = new Map();
+        data.charts.forEach((chart, position) => {
+            chartsByDirective.set(chart.directive_index ?? position, chart);
+        });
         
         let match;
         let chartIndex = 0;
         while ((match = chartDirectiveRegex.exec(data.full_report_markdown)) !== null) {
             const placeholderId = `chart-placeholder-${chartIndex}`;
             markdownWithPlaceholders = markdownWithPlaceholders.replace(match[0], `<div id="${placeholderId}" class="chart-render-target"></div>`);
-            const parsedChart = data.charts[chartIndex]; 
+            const parsedChart = chartsByDirective.get(chartIndex); 
             if (parsedChart) {
                  chartDataForRendering.push({ placeholderId, chartConfig: parsedChart });
             } else {
@@ -296,7 +480,7 @@ document.addEventListener('DOMContentLoaded', () => {
             displayError('Please enter a follow-up question.', followUpErrorMessageDiv);
             return;
         }
-        if (!currentReportData || !currentReportData.report_id || !currentReportData.full_text_for_follow_up) {
+        if (!currentReportData || !currentReportData.report_id) {
             displayError('No report context available for follow-up. Please generate a report first.', followUpErrorMessageDiv);
             return;
         }
@@ -311,10 +495,10 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/ask', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
+                // The server keeps an index of the report, so only the id is sent (not the full text).
                 body: JSON.stringify({
                     report_id: currentReportData.report_id,
-                    question: question,
-                    report_context: currentReportData.full_text_for_follow_up 
+                    question: question
                 })
             });
 
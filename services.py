@@ -1,11 +1,29 @@
 # services.py
 import os
+import asyncio
 import httpx
 from dotenv import load_dotenv
 import hashlib
-import ast
 import json
 import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from report_parser import REPORT_START_MARKER, build_report_structure, chart_directives, clean_model_output, extract_report, parse_chart_directive
+from metrics import (
+    CHART_PARSE_DURATION, POSTPROCESS_DURATION, UPSTREAM_DURATION, UPSTREAM_HEDGES, UPSTREAM_IN_FLIGHT, UPSTREAM_RETRIES,
+    UPSTREAM_TIME_TO_FIRST_TOKEN, log_event, record_usage, span, timed,
+)
+from upstream import (
+    ConnectionPoolBusyError, Deadline, DeadlineExceededError, LatencyWindow, RETRY_POLICY, UpstreamConfigurationError,
+    UpstreamConnectionError, UpstreamError, UpstreamRateLimitedError, UpstreamRequestError, UpstreamServerError,
+    UpstreamTimeoutError, get_circuit_breaker, parse_retry_after,
+)
+from scheduler import PRIORITY_INTERACTIVE, PRIORITY_RESEARCH, SchedulerSlot, create_upstream_scheduler_from_env, research_budget_name
+from retrieval import estimate_tokens
+from areas import create_area_resolver_from_env
 
 load_dotenv()
 
@@ -13,12 +31,111 @@ PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 if not PERPLEXITY_API_KEY:
     print("CRITICAL ERROR: PERPLEXITY_API_KEY not found in .env file. Application will not function.")
 
-API_BASE_URL = "https://api.perplexity.ai/chat/completions"
+# Override to point at another OpenAI-compatible endpoint, e.g. the local stand-in in benchmarks/mock_perplexity.py.
+API_BASE_URL = os.getenv("PERPLEXITY_API_BASE_URL", "https://api.perplexity.ai/chat/completions")
 RESEARCH_MODEL_NAME = "sonar-deep-research"
+
+# "single" asks for the whole report in one prompt; "sectional" researches every section of
+# SECTION_STRUCTURE_GUIDE concurrently and assembles the report locally.
+RESEARCH_MODE = os.getenv("RESEARCH_MODE", "single").lower()
+SECTIONAL_MAX_CONCURRENCY = int(os.getenv("SECTIONAL_MAX_CONCURRENCY", 4))
+SECTIONAL_MAX_TOKENS = int(os.getenv("SECTIONAL_MAX_TOKENS", 4096))
 FOLLOW_UP_MODEL_NAME = "sonar"
 
-def generate_report_id(area_name: str) -> str:
-    return hashlib.md5(area_name.lower().encode()).hexdigest()[:12]
+# Research depths, shallowest first (see ResearchDepth below). "deep" is the full report this service has always produced.
+RESEARCH_DEPTH_NAMES = ("quick", "standard", "deep")
+DEEP_RESEARCH_DEPTH = "deep"
+DEFAULT_RESEARCH_DEPTH = os.getenv("DEFAULT_RESEARCH_DEPTH", DEEP_RESEARCH_DEPTH).lower()
+if DEFAULT_RESEARCH_DEPTH not in RESEARCH_DEPTH_NAMES:
+    print(f"WARNING: Unknown DEFAULT_RESEARCH_DEPTH '{DEFAULT_RESEARCH_DEPTH}'; using '{DEEP_RESEARCH_DEPTH}'.")
+    DEFAULT_RESEARCH_DEPTH = DEEP_RESEARCH_DEPTH
+
+# Overall time budgets. All retries of one call (and all sections of a sectional run) share one deadline.
+RESEARCH_DEADLINE_SECONDS = float(os.getenv("RESEARCH_DEADLINE_SECONDS", 900.0))
+FOLLOW_UP_DEADLINE_SECONDS = float(os.getenv("FOLLOW_UP_DEADLINE_SECONDS", 60.0))
+# Hedging for /ask: once FOLLOW_UP_HEDGE_MIN_SAMPLES answers have been timed, a call still running after the
+# rolling p95 (but at least FOLLOW_UP_HEDGE_MIN_DELAY seconds) gets a duplicate request; the first answer wins.
+FOLLOW_UP_HEDGING = os.getenv("FOLLOW_UP_HEDGING", "false").lower() in ("1", "true", "yes")
+FOLLOW_UP_HEDGE_MIN_DELAY = float(os.getenv("FOLLOW_UP_HEDGE_MIN_DELAY", 1.0))
+FOLLOW_UP_HEDGE_MIN_SAMPLES = int(os.getenv("FOLLOW_UP_HEDGE_MIN_SAMPLES", 20))
+
+# Every attempt waits for a slot here first: per-model and account-wide concurrency and tokens-per-minute budgets,
+# follow-ups ahead of research, fair shares per client (see scheduler.py; configured via UPSTREAM_*/SCHEDULER_* env vars).
+# Research calls also take a slot of their depth's budget; the defaults leave 2 of the 12 account slots to follow-ups.
+upstream_scheduler = create_upstream_scheduler_from_env({"quick": 2, "standard": 2, DEEP_RESEARCH_DEPTH: 6}, FOLLOW_UP_MODEL_NAME)
+
+# Canonical area names and keys (see areas.py; the alias/gazetteer file is AREA_ALIASES_PATH, default area_aliases.json).
+area_resolver = create_area_resolver_from_env(os.path.dirname(os.path.abspath(__file__)))
+
+# --- Shared HTTP connection pool ---
+# One AsyncClient is created at app startup (see the lifespan handler in app.py) and reused by
+# every Perplexity call, so repeat requests skip DNS lookups and TCP/TLS handshakes.
+HTTP2_ENABLED = os.getenv("PERPLEXITY_HTTP2", "true").lower() in ("1", "true", "yes")
+HTTP_MAX_CONNECTIONS = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PERPLEXITY_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("PERPLEXITY_KEEPALIVE_EXPIRY", 60.0))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT", 10.0))
+HTTP_READ_TIMEOUT = float(os.getenv("PERPLEXITY_READ_TIMEOUT", 900.0)) # deep research can take ~15 minutes
+HTTP_WRITE_TIMEOUT = float(os.getenv("PERPLEXITY_WRITE_TIMEOUT", 30.0))
+HTTP_POOL_TIMEOUT = float(os.getenv("PERPLEXITY_POOL_TIMEOUT", 30.0))
+
+_http_client: httpx.AsyncClient = None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401 -- provided by the httpx[http2] extra
+        return True
+    except ImportError:
+        return False
+
+def init_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        return _http_client
+
+    use_http2 = HTTP2_ENABLED and _http2_available()
+    if HTTP2_ENABLED and not use_http2:
+        print("WARNING: HTTP/2 requested but the 'h2' package is not installed (pip install 'httpx[http2]'). Falling back to HTTP/1.1.")
+
+    _http_client = httpx.AsyncClient(
+        http2=use_http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT,
+        ),
+    )
+    print(f"Initialized shared Perplexity HTTP client (http2={use_http2}, max_connections={HTTP_MAX_CONNECTIONS}, max_keepalive={HTTP_MAX_KEEPALIVE_CONNECTIONS}).")
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        print("Closed shared Perplexity HTTP client.")
+    _http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    # Lazily create the pool if services are used outside the FastAPI lifespan (e.g. from a script).
+    if _http_client is None or _http_client.is_closed:
+        return init_http_client()
+    return _http_client
+
+def generate_report_id(area_name: str, depth: str = None) -> str:
+    # Derived from the canonical key, so every spelling of an area shares one report. For a canonical name without
+    # punctuation the key is its lowercased form, which keeps the ids of reports cached before canonicalization.
+    # Deep reports keep that id; the other depths add their name to the key.
+    key = area_resolver.canonical_key(area_name)
+    depth = depth or DEFAULT_RESEARCH_DEPTH
+    if depth != DEEP_RESEARCH_DEPTH:
+        key = f"{key}:{depth}"
+    return hashlib.md5(key.encode()).hexdigest()[:12]
 
 SECTION_STRUCTURE_GUIDE = {
     "title_page": "Comprehensive Report on Healthcare in {area_name}: Diseases, Emerging Risks, and Government Schemes",
@@ -81,92 +198,398 @@ def _get_detailed_focus_points_for_prompt(area_name: str) -> dict:
         ]
     }
 
-async def get_perplexity_response(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3) -> str:
-    if not PERPLEXITY_API_KEY:
-        return "Error: API Key is not configured on the server."
+# UPDATED System Prompt
+DEFAULT_REPORT_SYSTEM_PROMPT = (
+    "You are an AI report writing machine. Your SOLE function is to produce the report text EXACTLY as requested by the user's prompt structure. "
+    "DO NOT include ANY conversational phrases, introductory remarks, summaries of your understanding, self-corrections, or ANY text whatsoever that is not part of the direct report content. "
+    "If you have any internal planning, thoughts, or meta-commentary about the generation process, you MUST enclose this information in <think>Your thought here</think> tags. These tags and their content will be programmatically removed and MUST NOT appear in the final report body. "
+    "Your final output, after these <think> tags are notionally removed, MUST begin *EXACTLY* with the specified report title (e.g., 'Comprehensive Report on Healthcare in...')."
+)
 
+def _build_chat_payload(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3, stream: bool = False) -> dict:
     if system_prompt_content is None:
-        # UPDATED System Prompt
-        system_prompt_content = (
-            "You are an AI report writing machine. Your SOLE function is to produce the report text EXACTLY as requested by the user's prompt structure. "
-            "DO NOT include ANY conversational phrases, introductory remarks, summaries of your understanding, self-corrections, or ANY text whatsoever that is not part of the direct report content. "
-            "If you have any internal planning, thoughts, or meta-commentary about the generation process, you MUST enclose this information in <think>Your thought here</think> tags. These tags and their content will be programmatically removed and MUST NOT appear in the final report body. "
-            "Your final output, after these <think> tags are notionally removed, MUST begin *EXACTLY* with the specified report title (e.g., 'Comprehensive Report on Healthcare in...')."
-        )
-    
+        system_prompt_content = DEFAULT_REPORT_SYSTEM_PROMPT
     messages = [{"role": "system", "content": system_prompt_content}, {"role": "user", "content": prompt_content}]
     payload = {"model": model_name, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
-    headers = {"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json", "Accept": "application/json"}
-    timeout_duration = 900.0 # 15 minutes
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def _build_request_headers(stream: bool = False) -> dict:
+    accept = "text/event-stream" if stream else "application/json"
+    return {"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json", "Accept": accept}
 
+@contextmanager
+def _track_upstream_call(model_name: str, streamed: bool, slot: SchedulerSlot = None):
+    # Latency histogram, in-flight gauge, profiling span and a structured log line for one Perplexity call.
+    # The call counts as failed if the block raises or sets call["outcome"] = "error"; set call["usage"] to log token counts
+    # (they are also handed to the scheduler slot, so the token buckets are charged what was actually used).
+    call = {"outcome": "ok", "usage": None}
+    start = time.perf_counter()
+    UPSTREAM_IN_FLIGHT.inc(model=model_name)
     try:
-        async with httpx.AsyncClient(timeout=timeout_duration) as client:
-            print(f"Sending prompt to Perplexity (model: {model_name}, prompt length: {len(prompt_content)} chars). Expecting a long response.")
-            response = await client.post(API_BASE_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            response_data = response.json()
-
-        if response_data.get("choices") and response_data["choices"][0].get("message"):
-            raw_content = response_data["choices"][0]["message"]["content"]
-            print(f"Raw response received from {model_name} (length: {len(raw_content)} chars).")
-
-            # STAGE 1: Remove <think>...</think> blocks
-            # Using re.DOTALL to ensure newlines within <think> tags are matched, and re.IGNORECASE
-            content_without_thoughts = re.sub(r"<think>.*?</think>", "", raw_content, flags=re.DOTALL | re.IGNORECASE).strip()
-            # .strip() here is important to remove any leading/trailing whitespace left by the removal
-            print(f"Content after stripping <think> tags (length: {len(content_without_thoughts)} chars).")
-
-            # STAGE 2: Find the report start marker in the *cleaned* content and remove any preceding text
-            report_start_marker = "Comprehensive Report on Healthcare in" 
-            
-            # Find the marker, ignoring case for robustness
-            actual_start_index = content_without_thoughts.lower().find(report_start_marker.lower())
-
-            if actual_start_index == 0: 
-                # Ideal case: report starts exactly as expected after thought removal and stripping leading/trailing whitespace.
-                cleaned_content = content_without_thoughts
-                print(f"Report starts correctly after <think> tag removal. Final content length: {len(cleaned_content)} chars.")
-            elif actual_start_index > 0: 
-                # Report title found, but there's some preamble *after* <think> tag removal.
-                # This means the AI put some text (not in <think> tags) before the title. Strip it.
-                print(f"WARNING: Untagged preamble detected before report title AFTER <think> tag removal. Stripping it. Original start index in thought-stripped content: {actual_start_index}")
-                cleaned_content = content_without_thoughts[actual_start_index:]
-                print(f"Preamble stripped. Final cleaned content length: {len(cleaned_content)} chars.")
-            else: # actual_start_index == -1; marker not found
-                # This is a more problematic case. The AI didn't start with the title.
-                print(f"CRITICAL WARNING: Report start marker ('{report_start_marker}') NOT FOUND in AI response AFTER <think> tag removal. AI did not follow crucial instructions. Returning the <think>-stripped content as is, but it's likely malformed or incomplete.")
-                cleaned_content = content_without_thoughts 
-                # You might want to return an error string or the raw (but thought-stripped) content for debugging.
-                # For now, returning what we have, which might be the AI's attempt at the report without the proper title.
-
-            return cleaned_content.strip() # Final strip for safety
-        else:
-            error_msg = response_data.get("error", {}).get("message", "Unknown API response format.")
-            print(f"API Error (model: {model_name}): {error_msg} Full response: {json.dumps(response_data, indent=2)}")
-            return f"Error: AI API returned an error: {error_msg}"
-    except httpx.HTTPStatusError as http_err:
-        error_content = "Unknown error"
-        try:
-            error_details = http_err.response.json()
-            error_content = error_details.get("error", {}).get("message", http_err.response.text)
-        except json.JSONDecodeError: error_content = http_err.response.text
-        print(f"HTTP error (model: {model_name}): {http_err} - Details: {error_content}")
-        return f"Error: AI API request failed (HTTP {http_err.response.status_code}). Details: {error_content}"
-    except httpx.TimeoutException:
-        print(f"API request timed out for model {model_name} after {timeout_duration}s.")
-        return "Error: The AI API request timed out. This can happen with very long report requests. Please try a more focused area or try again later."
-    except httpx.RequestError as req_err:
-        print(f"Request error (model: {model_name}): {req_err}")
-        return f"Error: AI API request failed due to a network issue: {str(req_err)}"
+        with span(f"upstream {model_name}"):
+            yield call
+    except BaseException:
+        call["outcome"] = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        UPSTREAM_IN_FLIGHT.dec(model=model_name)
+        UPSTREAM_DURATION.observe(duration, model=model_name, outcome=call["outcome"], streamed=str(streamed).lower())
+        record_usage(model_name, call["usage"])
+        if slot is not None and call["usage"]:
+            slot.used_tokens = call["usage"].get("total_tokens") or (call["usage"].get("prompt_tokens") or 0) + (call["usage"].get("completion_tokens") or 0)
+        log_event("upstream_call", model=model_name, streamed=streamed, outcome=call["outcome"],
+                  duration_ms=round(duration * 1000, 1), usage=call["usage"])
+
+def _attempt_timeout(deadline: Deadline) -> httpx.Timeout:
+    # No single phase of an attempt may outlive the request's remaining budget.
+    remaining = max(deadline.remaining(), 0.001)
+    return httpx.Timeout(
+        connect=min(HTTP_CONNECT_TIMEOUT, remaining),
+        read=min(HTTP_READ_TIMEOUT, remaining),
+        write=min(HTTP_WRITE_TIMEOUT, remaining),
+        pool=min(HTTP_POOL_TIMEOUT, remaining),
+    )
+
+def _error_from_response(status_code: int, headers, body_text: str) -> UpstreamError:
+    error_content = body_text
+    try:
+        error_content = json.loads(body_text).get("error", {}).get("message", body_text)
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    message = f"AI API request failed (HTTP {status_code}). Details: {error_content}"
+    retry_after = parse_retry_after(headers.get("retry-after"))
+    if status_code == 429:
+        return UpstreamRateLimitedError(message, upstream_status=status_code, retry_after=retry_after)
+    if status_code >= 500:
+        return UpstreamServerError(message, upstream_status=status_code, retry_after=retry_after)
+    return UpstreamRequestError(message, upstream_status=status_code)
+
+def _error_from_transport(exc: Exception, model_name: str) -> UpstreamError:
+    if isinstance(exc, httpx.PoolTimeout):
+        print(f"Timed out waiting for a free connection in the shared pool (model: {model_name}) after {HTTP_POOL_TIMEOUT}s.")
+        return ConnectionPoolBusyError("The server is handling too many AI requests right now. Please try again shortly.")
+    if isinstance(exc, httpx.ConnectTimeout):
+        print(f"Connecting to the AI API timed out for model {model_name} after {HTTP_CONNECT_TIMEOUT}s.")
+        return UpstreamConnectionError("Could not connect to the AI API in time. Please try again later.")
+    if isinstance(exc, httpx.TimeoutException):
+        print(f"API request timed out for model {model_name} (read timeout {HTTP_READ_TIMEOUT}s).")
+        return UpstreamTimeoutError("The AI API request timed out. This can happen with very long report requests. Please try a more focused area or try again later.")
+    print(f"Request error (model: {model_name}): {exc}")
+    return UpstreamConnectionError(f"AI API request failed due to a network issue: {str(exc)}")
+
+def _deadline_error(model_name: str, deadline: Deadline) -> DeadlineExceededError:
+    print(f"Deadline of {deadline.seconds:.0f}s exhausted for a {model_name} request.")
+    return DeadlineExceededError(f"The AI API did not answer within the {deadline.seconds:.0f}s time budget. Please try again later.")
+
+def _retry_delay(model_name: str, error: UpstreamError, attempt: int, deadline: Deadline):
+    # Seconds to wait before the next attempt, or None if the error should be raised now.
+    if not error.retryable or attempt >= RETRY_POLICY.max_attempts:
+        return None
+    delay = RETRY_POLICY.backoff(attempt, error.retry_after)
+    if delay >= deadline.remaining():
+        print(f"Not retrying {model_name}: waiting {delay:.1f}s would exceed the remaining {deadline.remaining():.1f}s budget.")
+        return None
+    UPSTREAM_RETRIES.inc(model=model_name, reason=type(error).__name__)
+    print(f"Retrying {model_name} in {delay:.1f}s (attempt {attempt + 1}/{RETRY_POLICY.max_attempts}) after: {error}")
+    return delay
+
+def _default_deadline(model_name: str) -> Deadline:
+    return Deadline(FOLLOW_UP_DEADLINE_SECONDS if model_name == FOLLOW_UP_MODEL_NAME else RESEARCH_DEADLINE_SECONDS)
+
+def _scheduler_priority(model_name: str) -> int:
+    return PRIORITY_INTERACTIVE if model_name == FOLLOW_UP_MODEL_NAME else PRIORITY_RESEARCH
+
+def _estimated_call_tokens(payload: dict) -> int:
+    # What the call is charged against the tokens-per-minute budgets until the API reports its real usage.
+    return sum(estimate_tokens(message["content"]) for message in payload["messages"]) + payload["max_tokens"]
+
+async def _post_chat_completion(payload: dict, headers: dict, model_name: str, deadline: Deadline, slot: SchedulerSlot = None) -> dict:
+    # One attempt. Returns the parsed response body or raises an UpstreamError.
+    client = get_http_client()
+    try:
+        with _track_upstream_call(model_name, streamed=False, slot=slot) as call:
+            try:
+                response = await asyncio.wait_for(
+                    client.post(API_BASE_URL, json=payload, headers=headers, timeout=_attempt_timeout(deadline)),
+                    timeout=deadline.remaining(),
+                )
+            except asyncio.TimeoutError:
+                raise _deadline_error(model_name, deadline)
+            except httpx.RequestError as req_err:
+                raise _error_from_transport(req_err, model_name)
+            if response.status_code >= 400:
+                error = _error_from_response(response.status_code, response.headers, response.text)
+                print(f"HTTP error (model: {model_name}): {error}")
+                raise error
+            try:
+                response_data = response.json()
+            except json.JSONDecodeError:
+                raise UpstreamRequestError(f"AI API returned a response that is not valid JSON (HTTP {response.status_code}).")
+            call["usage"] = response_data.get("usage")
+            if not (response_data.get("choices") and response_data["choices"][0].get("message")):
+                error_msg = (response_data.get("error") or {}).get("message", "Unknown API response format.")
+                print(f"API Error (model: {model_name}): {error_msg} Full response: {json.dumps(response_data, indent=2)}")
+                raise UpstreamRequestError(f"AI API returned an error: {error_msg}")
+            return response_data
+    except UpstreamError:
+        raise
     except Exception as e:
         print(f"Generic error in get_perplexity_response (model: {model_name}): {e.__class__.__name__} - {e}")
         import traceback; traceback.print_exc()
-        return f"Error: An unexpected error occurred: {str(e)}"
+        raise UpstreamError(f"An unexpected error occurred: {str(e)}")
 
+async def get_perplexity_response(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3, report_start_marker: str = REPORT_START_MARKER, deadline: Deadline = None, priority: int = None, budget: str = None) -> str:
+    # Returns the cleaned response text. Failures raise an UpstreamError subclass once retries or the deadline
+    # (default: RESEARCH_/FOLLOW_UP_DEADLINE_SECONDS for the model) are exhausted. priority defaults to the model's.
+    # budget names a scheduler budget the call is charged to on top of the model's (research calls: their depth's).
+    if not PERPLEXITY_API_KEY:
+        raise UpstreamConfigurationError("API Key is not configured on the server.")
 
-def _build_single_document_prompt_from_structure(area_name: str) -> str:
-    from datetime import datetime
-    current_date_str = datetime.now().strftime("%B %Y")
+    deadline = deadline or _default_deadline(model_name)
+    payload = _build_chat_payload(prompt_content, model_name, system_prompt_content, max_tokens, temperature)
+    headers = _build_request_headers()
+    breaker = get_circuit_breaker(model_name)
+    priority, estimated_tokens = _scheduler_priority(model_name) if priority is None else priority, _estimated_call_tokens(payload)
+
+    print(f"Sending prompt to Perplexity (model: {model_name}, prompt length: {len(prompt_content)} chars). Expecting a long response.")
+    attempt = 0
+    while True:
+        attempt += 1
+        if deadline.expired: # before before_call(), which may take the breaker's half-open trial slot
+            raise _deadline_error(model_name, deadline)
+        breaker.before_call()
+        try:
+            async with upstream_scheduler.slot(model_name, estimated_tokens, deadline, priority, extra_budget=budget) as slot:
+                response_data = await _post_chat_completion(payload, headers, model_name, deadline, slot)
+        except UpstreamError as error:
+            breaker.record_failure(error)
+            delay = _retry_delay(model_name, error, attempt, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except BaseException: # cancelled, e.g. the losing side of a hedged call
+            breaker.release()
+            raise
+        breaker.record_success()
+        break
+
+    raw_content = response_data["choices"][0]["message"]["content"]
+    print(f"Raw response received from {model_name} (length: {len(raw_content)} chars).")
+    with timed(POSTPROCESS_DURATION, "postprocess clean", stage="clean"):
+        cleaned_content = clean_model_output(raw_content, report_start_marker)
+    print(f"Cleaned response from {model_name} (length: {len(cleaned_content)} chars).")
+    return cleaned_content
+
+async def _stream_chat_completion(payload: dict, headers: dict, model_name: str, deadline: Deadline, slot: SchedulerSlot = None):
+    # One streamed attempt: yields content deltas, raises an UpstreamError on failure.
+    client = get_http_client()
+    received_chars = 0
+    stream_start = time.perf_counter()
+    try:
+        with _track_upstream_call(model_name, streamed=True, slot=slot) as call:
+            async with client.stream("POST", API_BASE_URL, json=payload, headers=headers, timeout=_attempt_timeout(deadline)) as response:
+                if response.status_code >= 400:
+                    error_text = (await response.aread()).decode(errors="replace")
+                    error = _error_from_response(response.status_code, response.headers, error_text)
+                    print(f"HTTP error while streaming (model: {model_name}): {error}")
+                    raise error
+
+                async for line in response.aiter_lines():
+                    if deadline.expired:
+                        raise _deadline_error(model_name, deadline)
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        print(f"Skipping malformed stream chunk from {model_name}: {data[:200]}")
+                        continue
+                    if chunk.get("usage"):
+                        call["usage"] = chunk["usage"] # running totals; the last chunk carries the final counts
+                    if chunk.get("error"):
+                        raise UpstreamServerError(f"AI API returned an error: {chunk['error'].get('message', 'Unknown error')}")
+                    choices = chunk.get("choices") or [{}]
+                    delta_text = (choices[0].get("delta") or {}).get("content")
+                    if delta_text:
+                        if not received_chars:
+                            UPSTREAM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - stream_start, model=model_name)
+                        received_chars += len(delta_text)
+                        yield delta_text
+        print(f"Stream from {model_name} finished (received {received_chars} chars).")
+    except httpx.RequestError as req_err:
+        raise _error_from_transport(req_err, model_name)
+
+async def stream_perplexity_response(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3, deadline: Deadline = None, priority: int = None, budget: str = None):
+    # Async generator yielding raw content deltas from a stream=true chat completion (OpenAI-style SSE chunks).
+    # budget is as for get_perplexity_response.
+    # Failed attempts are retried only until the first delta has been yielded; after that the error is raised.
+    if not PERPLEXITY_API_KEY:
+        raise UpstreamConfigurationError("API Key is not configured on the server.")
+
+    deadline = deadline or _default_deadline(model_name)
+    payload = _build_chat_payload(prompt_content, model_name, system_prompt_content, max_tokens, temperature, stream=True)
+    headers = _build_request_headers(stream=True)
+    breaker = get_circuit_breaker(model_name)
+    priority, estimated_tokens = _scheduler_priority(model_name) if priority is None else priority, _estimated_call_tokens(payload)
+
+    print(f"Streaming prompt to Perplexity (model: {model_name}, prompt length: {len(prompt_content)} chars).")
+    attempt = 0
+    while True:
+        attempt += 1
+        if deadline.expired: # before before_call(), which may take the breaker's half-open trial slot
+            raise _deadline_error(model_name, deadline)
+        breaker.before_call()
+        streamed_any = False
+        try:
+            async with upstream_scheduler.slot(model_name, estimated_tokens, deadline, priority, extra_budget=budget) as slot:
+                async for delta_text in _stream_chat_completion(payload, headers, model_name, deadline, slot):
+                    streamed_any = True
+                    yield delta_text
+        except UpstreamError as error:
+            breaker.record_failure(error)
+            delay = None if streamed_any else _retry_delay(model_name, error, attempt, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except BaseException: # cancelled, or the consumer closed the generator
+            breaker.release()
+            raise
+        breaker.record_success()
+        return
+
+class StreamingReportCleaner:
+    # Incremental counterpart of report_parser.clean_model_output. feed() takes raw deltas and returns the text that is
+    # safe to show so far; finish() flushes the rest. The concatenation of everything returned, stripped,
+    # equals clean_model_output() on the full raw response.
+    _THINK_OPEN = "<think>"
+    _THINK_CLOSE = "</think>"
+
+    def __init__(self, report_start_marker: str = REPORT_START_MARKER):
+        self._marker_lower = report_start_marker.lower()
+        self._pending = ""      # raw text not yet classified as inside/outside a <think> block
+        self._inside_think = False
+        self._think_raw = ""    # held <think> block, emitted verbatim if it is never closed
+        self._preamble = ""     # thought-free text seen before the report start marker
+        self._marker_scan_from = 0
+        self.marker_found = False
+        self._emitted = []
+
+    def feed(self, raw_delta: str) -> str:
+        self._pending += raw_delta
+        return self._emit(self._strip_thoughts(final=False))
+
+    def finish(self) -> str:
+        text = self._strip_thoughts(final=True)
+        if self._inside_think:
+            # No closing tag ever arrived, so the regex in clean_model_output would leave this block in place.
+            text += self._think_raw
+            self._inside_think = False
+            self._think_raw = ""
+        out = self._emit(text)
+        if not self.marker_found:
+            print("CRITICAL WARNING: Report start marker NOT FOUND in streamed AI response. Returning the <think>-stripped content as is.")
+            out += self._preamble
+            self._emitted.append(self._preamble)
+            self._preamble = ""
+        return out
+
+    @property
+    def cleaned_content(self) -> str:
+        return "".join(self._emitted).strip()
+
+    def _strip_thoughts(self, final: bool) -> str:
+        out = []
+        while self._pending:
+            lowered = self._pending.lower()
+            if self._inside_think:
+                close_idx = lowered.find(self._THINK_CLOSE)
+                if close_idx == -1:
+                    self._think_raw += self._pending
+                    self._pending = ""
+                    # Keep a tail in _pending so a closing tag split across chunks is still found.
+                    keep = len(self._THINK_CLOSE) - 1
+                    if len(self._think_raw) > keep and not final:
+                        self._pending = self._think_raw[-keep:]
+                        self._think_raw = self._think_raw[:-keep]
+                    break
+                self._pending = self._pending[close_idx + len(self._THINK_CLOSE):]
+                self._inside_think = False
+                self._think_raw = ""
+            else:
+                open_idx = lowered.find(self._THINK_OPEN)
+                if open_idx == -1:
+                    hold = 0 if final else self._partial_tag_suffix_len(lowered)
+                    out.append(self._pending[:len(self._pending) - hold])
+                    self._pending = self._pending[len(self._pending) - hold:]
+                    break
+                out.append(self._pending[:open_idx])
+                self._think_raw = self._pending[open_idx:open_idx + len(self._THINK_OPEN)]
+                self._pending = self._pending[open_idx + len(self._THINK_OPEN):]
+                self._inside_think = True
+        if final and self._inside_think:
+            self._think_raw += self._pending
+            self._pending = ""
+        return "".join(out)
+
+    def _partial_tag_suffix_len(self, lowered: str) -> int:
+        for size in range(min(len(self._THINK_OPEN) - 1, len(lowered)), 0, -1):
+            if self._THINK_OPEN.startswith(lowered[-size:]):
+                return size
+        return 0
+
+    def _emit(self, text: str) -> str:
+        if not text:
+            return ""
+        if self.marker_found:
+            self._emitted.append(text)
+            return text
+        self._preamble += text
+        start_idx = self._preamble[self._marker_scan_from:].lower().find(self._marker_lower)
+        if start_idx != -1:
+            start_idx += self._marker_scan_from
+        else:
+            self._marker_scan_from = max(0, len(self._preamble) - len(self._marker_lower) + 1)
+            return ""
+        if start_idx > 0 and self._preamble[:start_idx].strip():
+            print(f"WARNING: Untagged preamble detected before report title in stream. Stripping {start_idx} chars.")
+        self.marker_found = True
+        text = self._preamble[start_idx:]
+        self._preamble = ""
+        self._emitted.append(text)
+        return text
+
+
+def _format_section_instructions(section_key: str, actual_section_title: str, focus_points_map: dict, section_number: str = None) -> str:
+    # section_number renumbers the "### N.M." subsection headings when a depth leaves out earlier sections.
+    instructions = f"\n## {actual_section_title}\n"
+    if section_key in focus_points_map:
+        for point in focus_points_map[section_key]:
+            if section_number:
+                point = _SUBSECTION_NUMBER_PATTERN.sub(f"### {section_number}.", point)
+            if point.strip().startswith("**Under a subsection titled"):
+                h3_match = re.search(r"`(### .*?)`", point)
+                if h3_match:
+                    h3_title = h3_match.group(1)
+                    instructions += f"{h3_title}\n"
+                    instruction_for_h3 = point.split("`:**", 1)[-1].strip()
+                    instructions += f"- {instruction_for_h3}\n"
+                else:
+                    instructions += f"- {point}\n"
+            else:
+                instructions += f"- {point}\n"
+    else:
+        instructions += f"- (Provide comprehensive information for this section: {actual_section_title})\n"
+    return instructions
+
+def _build_single_document_prompt_from_structure(area_name: str, current_date_str: str, depth: "ResearchDepth") -> str:
     focus_points_map = _get_detailed_focus_points_for_prompt(area_name)
 
     # UPDATED prompt_start
@@ -185,7 +608,7 @@ def _build_single_document_prompt_from_structure(area_name: str) -> str:
     prompt_body_instructions = f"""
 **MAIN REPORT BODY INSTRUCTIONS:**
 Following the Table of Contents (which you will generate based on the H2 and H3 headings below), proceed to generate the full report content.
-The report MUST be AT LEAST **5000 WORDS** (or as extensively detailed as possible for '{area_name}').
+The report MUST be {depth.length_guide}.
 Use ONLY certified and official sources of data. AIM TO INCLUDE SEVERAL RELEVANT CHARTS THROUGHOUT THE REPORT AS GUIDED.
 **Remember to use <think>...</think> for any internal thought processes or meta-commentary that are not part of the report itself. These will be stripped out.**
 
@@ -197,31 +620,15 @@ Use ONLY certified and official sources of data. AIM TO INCLUDE SEVERAL RELEVANT
 **Detailed Content Guide for Each Section:**
 """
 
-    for section_key, section_title_template in SECTION_STRUCTURE_GUIDE.items():
-        actual_section_title = section_title_template.format(area_name=area_name)
-        if section_key == "title_page" or section_key == "table_of_contents":
-            continue
-        prompt_body_instructions += f"\n## {actual_section_title}\n"
-        if section_key in focus_points_map:
-            for point in focus_points_map[section_key]:
-                if point.strip().startswith("**Under a subsection titled"):
-                    h3_match = re.search(r"`(### .*?)`", point)
-                    if h3_match:
-                        h3_title = h3_match.group(1)
-                        prompt_body_instructions += f"{h3_title}\n"
-                        instruction_for_h3 = point.split("`:**", 1)[-1].strip()
-                        prompt_body_instructions += f"- {instruction_for_h3}\n"
-                    else:
-                        prompt_body_instructions += f"- {point}\n"
-                else:
-                    prompt_body_instructions += f"- {point}\n"
-        else:
-            prompt_body_instructions += f"- (Provide comprehensive information for this section: {actual_section_title})\n"
+    for section_key in depth.section_keys:
+        actual_section_title = depth.section_title(area_name, section_key)
+        prompt_body_instructions += _format_section_instructions(section_key, actual_section_title, focus_points_map, _section_number(actual_section_title))
+    prompt_body_instructions += _format_section_instructions("references", SECTION_STRUCTURE_GUIDE["references"], focus_points_map)
 
     # UPDATED prompt_end_rules
     prompt_end_rules = f"""
 **General Content Style:**
-- Provide EXTREMELY IN-DEPTH analysis, not just lists. Explain data significance. Aim for a total report length of AT LEAST 5000 WORDS.
+- Provide EXTREMELY IN-DEPTH analysis, not just lists. Explain data significance. Aim for a total report length of {depth.length_guide}.
 - Integrate statistics smoothly and extensively.
 - Use bullet points (`* item`) for lists where appropriate, but main content should be detailed prose.
 
@@ -247,98 +654,532 @@ Use ONLY certified and official sources of data. AIM TO INCLUDE SEVERAL RELEVANT
     full_prompt = prompt_start + prompt_body_instructions + prompt_end_rules
     return full_prompt
 
-async def conduct_deep_research(area_name: str):
-    print(f"Starting COMPREHENSIVE HEALTH ANALYSIS (Single Doc Prompt) for area: {area_name} using {RESEARCH_MODEL_NAME}")
-    report_id = generate_report_id(area_name)
+# --- Sectional research mode ---
+# Every generated section (everything except the title page, contents and references) is its own prompt.
+SECTIONAL_SECTION_KEYS = [key for key in SECTION_STRUCTURE_GUIDE if key not in ("title_page", "table_of_contents", "references")]
+SECTION_SOURCES_HEADING = "#### Sources"
+_SECTION_SOURCES_PATTERN = re.compile(r"^#{2,4}\s*Sources\s*:?\s*$", re.IGNORECASE | re.MULTILINE)
+_REFERENCE_BULLET_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+_HEADING_PATTERN = re.compile(r"^(#{2,3})\s+(.+?)\s*$", re.MULTILINE)
+_SECTION_NUMBER_PATTERN = re.compile(r"^(\d+)\.")
+_SUBSECTION_NUMBER_PATTERN = re.compile(r"### \d+\.")
+
+def _section_number(title: str) -> Optional[str]:
+    number_match = _SECTION_NUMBER_PATTERN.match(title)
+    return number_match.group(1) if number_match else None
+
+def _build_section_prompt(area_name: str, section_key: str, depth: "ResearchDepth") -> str:
+    focus_points_map = _get_detailed_focus_points_for_prompt(area_name)
+    actual_section_title = depth.section_title(area_name, section_key)
+    section_instructions = _format_section_instructions(section_key, actual_section_title, focus_points_map, _section_number(actual_section_title))
+
+    return f"""**CRITICAL INSTRUCTION: YOU ARE WRITING ONE SECTION OF A LARGER HEALTH REPORT ON '{area_name}'. YOUR ENTIRE RESPONSE MUST BE ONLY THIS SECTION'S CONTENT, STARTING *EXACTLY* WITH THE HEADING `## {actual_section_title}`.**
+**If you have any internal planning, thoughts, or self-correction steps during generation, you MUST enclose them in <think>...</think> tags. These tags and their content will be programmatically removed.**
+
+**Section Guide:**
+{section_instructions}
+**Formatting and Content Rules:**
+- The section heading MUST be the H2 heading `## {actual_section_title}`; subsections MUST use H3 headings exactly as given above.
+- Provide THOROUGH and IN-DEPTH analysis for each subsection (aim for {depth.section_words} words for this section). Use ONLY certified and official sources of data.
+- Include data in Markdown tables where relevant. Caption *above* table: "Table: Description for {area_name}."
+- For EACH chart, provide data ON ITS OWN LINE, immediately after the paragraph discussing it:
+    `CHART_DATA: TYPE=[bar|line|pie|doughnut] TITLE="Chart Title for {area_name}" LABELS=["L1","L2"] DATA=[V1,V2] SOURCE="(Source, Year)"`
+- ALL data/claims MUST be attributed in-text: `(Author/Organization, Year)`.
+- Do NOT write a title page, table of contents, introduction to the whole report, or a References section.
+- END the section with the line `{SECTION_SOURCES_HEADING}` followed by a bullet list (`- ...`) with full details of every source cited in this section.
+"""
+
+# --- Research depths ---
+# A depth fixes what a report costs: the model, which sections are written, the token budgets and the deadline.
+# Its prompts are built once, here, with the area name and the date left as placeholders; a request only fills them in.
+# A cached report of a deeper depth also answers requests for a shallower one (see depths_satisfying). Override per
+# depth with RESEARCH_DEPTH_<NAME>_MODEL, _SECTIONS (comma-separated keys), _MAX_TOKENS, _SECTION_MAX_TOKENS and
+# _DEADLINE_SECONDS.
+_AREA_PLACEHOLDER = "{area_name}"
+_DATE_PLACEHOLDER = "{report_date}"
+
+def _fill_prompt_template(template: str, area_name: str) -> str:
+    from datetime import datetime
+    return template.replace(_DATE_PLACEHOLDER, datetime.now().strftime("%B %Y")).replace(_AREA_PLACEHOLDER, area_name)
+
+@dataclass
+class ResearchDepth:
+    name: str
+    model: str
+    section_keys: List[str]  # SECTIONAL_SECTION_KEYS subset, in report order
+    max_tokens: int          # for the single-prompt report
+    section_max_tokens: int  # per section of a sectional run or refresh
+    deadline_seconds: float
+    length_guide: str        # the report length, as the prompt asks for it
+    section_words: str       # the section length in sectional prompts
+    section_titles: Dict[str, str] = field(default_factory=dict) # key -> guide title, renumbered when sections are left out
+    prompt_template: str = ""
+    section_prompt_templates: Dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for number, key in enumerate(self.section_keys, start=1):
+            self.section_titles[key] = _SECTION_NUMBER_PATTERN.sub(f"{number}.", SECTION_STRUCTURE_GUIDE[key], count=1)
+        self.prompt_template = _build_single_document_prompt_from_structure(_AREA_PLACEHOLDER, _DATE_PLACEHOLDER, self)
+        self.section_prompt_templates = {key: _build_section_prompt(_AREA_PLACEHOLDER, key, self) for key in self.section_keys}
+
+    @property
+    def budget(self) -> str:
+        return research_budget_name(self.name)
+
+    @property
+    def rank(self) -> int:
+        return RESEARCH_DEPTH_NAMES.index(self.name)
+
+    def section_title(self, area_name: str, section_key: str) -> str:
+        return self.section_titles[section_key].format(area_name=area_name)
+
+    def prompt(self, area_name: str) -> str:
+        return _fill_prompt_template(self.prompt_template, area_name)
+
+    def section_prompt(self, area_name: str, section_key: str) -> str:
+        return _fill_prompt_template(self.section_prompt_templates[section_key], area_name)
+
+def _research_depth_from_env(name: str, model: str, section_keys: List[str], max_tokens: int, section_max_tokens: int,
+                             deadline_seconds: float, length_guide: str, section_words: str) -> ResearchDepth:
+    prefix = f"RESEARCH_DEPTH_{name.upper()}_"
+    sections_override = os.getenv(prefix + "SECTIONS")
+    if sections_override:
+        requested = [key.strip() for key in sections_override.split(",") if key.strip()]
+        unknown = [key for key in requested if key not in SECTIONAL_SECTION_KEYS]
+        if unknown:
+            print(f"WARNING: Ignoring unknown section(s) in {prefix}SECTIONS: {', '.join(unknown)}.")
+        section_keys = [key for key in SECTIONAL_SECTION_KEYS if key in requested] or section_keys
+    return ResearchDepth(
+        name=name,
+        model=os.getenv(prefix + "MODEL", model),
+        section_keys=list(section_keys),
+        max_tokens=int(os.getenv(prefix + "MAX_TOKENS", max_tokens)),
+        section_max_tokens=int(os.getenv(prefix + "SECTION_MAX_TOKENS", section_max_tokens)),
+        deadline_seconds=float(os.getenv(prefix + "DEADLINE_SECONDS", deadline_seconds)),
+        length_guide=length_guide,
+        section_words=section_words,
+    )
+
+RESEARCH_DEPTHS = {depth.name: depth for depth in (
+    # One fast, cheap call: an overview of the essentials in well under a minute.
+    _research_depth_from_env("quick", FOLLOW_UP_MODEL_NAME, ["introduction", "major_diseases", "govt_schemes", "conclusion"],
+                             2048, 1024, 90.0, "about **1200 WORDS** (a concise overview; stay close to this length)", "250-400"),
+    _research_depth_from_env("standard", "sonar-pro", ["introduction", "major_diseases", "emerging_risks", "govt_schemes", "healthcare_system", "conclusion"],
+                             4096, 2048, 300.0, "about **2500 WORDS**", "400-600"),
+    _research_depth_from_env(DEEP_RESEARCH_DEPTH, RESEARCH_MODEL_NAME, SECTIONAL_SECTION_KEYS,
+                             8192, SECTIONAL_MAX_TOKENS, RESEARCH_DEADLINE_SECONDS, "AT LEAST **5000 WORDS** (or as extensively detailed as possible for '{area_name}')", "700-1000"),
+)}
+
+def get_research_depth(name: str = None) -> Optional[ResearchDepth]:
+    # None for an unknown name; no name means DEFAULT_RESEARCH_DEPTH.
+    return RESEARCH_DEPTHS.get((name or DEFAULT_RESEARCH_DEPTH).lower())
+
+def depths_satisfying(depth: ResearchDepth) -> List[ResearchDepth]:
+    # The depths whose reports can answer a request for depth: itself first, then the deeper ones.
+    return [depth] + [RESEARCH_DEPTHS[name] for name in RESEARCH_DEPTH_NAMES[depth.rank + 1:]]
+
+def report_depth(record: dict) -> ResearchDepth:
+    # Reports stored before depths existed are deep reports.
+    return RESEARCH_DEPTHS.get(record.get("depth"), RESEARCH_DEPTHS[DEEP_RESEARCH_DEPTH])
+
+def _split_section_sources(section_markdown: str):
+    # Returns (body, [reference lines]) by cutting at the last "#### Sources" heading.
+    matches = list(_SECTION_SOURCES_PATTERN.finditer(section_markdown))
+    if not matches:
+        return section_markdown.strip(), []
+    last = matches[-1]
+    references = []
+    for line in section_markdown[last.end():].splitlines():
+        if not line.strip():
+            continue
+        reference = _REFERENCE_BULLET_PATTERN.sub("", line).strip()
+        if reference:
+            references.append(reference)
+    return section_markdown[:last.start()].strip(), references
+
+def _merge_references(reference_lists) -> list:
+    # De-duplicate case/punctuation-insensitively, keep the first spelling, and sort alphabetically.
+    merged = {}
+    for references in reference_lists:
+        for reference in references:
+            dedupe_key = re.sub(r"[\W_]+", " ", reference.lower()).strip()
+            if dedupe_key and dedupe_key not in merged:
+                merged[dedupe_key] = reference
+    return sorted(merged.values(), key=lambda ref: ref.lower())
+
+def _build_table_of_contents(section_bodies) -> str:
+    toc_lines = []
+    for body in section_bodies:
+        for heading_match in _HEADING_PATTERN.finditer(body):
+            indent = "" if heading_match.group(1) == "##" else "  "
+            toc_lines.append(f"{indent}- {heading_match.group(2).strip('*` ')}")
+    toc_lines.append("- References")
+    return "\n".join(toc_lines)
+
+def _assemble_sectional_report(area_name: str, section_bodies: list, references: list) -> str:
+    from datetime import datetime
+    current_date_str = datetime.now().strftime("%B %Y")
+    title = SECTION_STRUCTURE_GUIDE["title_page"].format(area_name=area_name)
+    parts = [
+        f"## {title}\n{current_date_str}",
+        f"## {SECTION_STRUCTURE_GUIDE['table_of_contents']}\n{_build_table_of_contents(section_bodies)}",
+        "---",
+        *section_bodies,
+        f"## {SECTION_STRUCTURE_GUIDE['references']}\n" + ("\n".join(f"- {ref}" for ref in references) or "*No references were returned.*"),
+    ]
+    return "\n\n".join(parts)
+
+async def _research_section(area_name: str, section_key: str, semaphore: asyncio.Semaphore, deadline: Deadline, depth: ResearchDepth):
+    # Returns (content, None) or (None, UpstreamError) so one failed section doesn't sink the whole report.
+    actual_section_title = depth.section_title(area_name, section_key)
+    async with semaphore:
+        print(f"Researching section '{section_key}' for {area_name}.")
+        try:
+            content = await get_perplexity_response(
+                prompt_content=depth.section_prompt(area_name, section_key),
+                model_name=depth.model,
+                max_tokens=depth.section_max_tokens,
+                temperature=0.3,
+                report_start_marker=f"## {actual_section_title}",
+                deadline=deadline,
+                priority=PRIORITY_RESEARCH,
+                budget=depth.budget,
+            )
+        except UpstreamError as error:
+            return None, error
+    return content, None
+
+async def _research_sections(area_name: str, section_keys: list, report_progress, deadline: Deadline, depth: ResearchDepth, require_any: bool = True):
+    # Researches the given sections concurrently. Returns ({key: (body, references)}, {key: UpstreamError});
+    # with require_any, raises the first error if no section at all could be generated.
+    semaphore = asyncio.Semaphore(SECTIONAL_MAX_CONCURRENCY)
+    completed = 0
+
+    async def run(section_key: str):
+        nonlocal completed
+        result = await _research_section(area_name, section_key, semaphore, deadline, depth)
+        completed += 1
+        report_progress(f"sections_completed:{completed}/{len(section_keys)}")
+        return result
+
+    report_progress(f"sections_completed:0/{len(section_keys)}")
+    results = await asyncio.gather(*(run(section_key) for section_key in section_keys))
+
+    generated, errors = {}, {}
+    for section_key, (content, error) in zip(section_keys, results):
+        if error:
+            print(f"Section '{section_key}' failed for {area_name}: {error}")
+            errors[section_key] = error
+        else:
+            generated[section_key] = _split_section_sources(content)
+    if not generated and require_any:
+        # Nothing usable came back; fail like a single-prompt run would.
+        raise next(iter(errors.values()))
+    if errors:
+        print(f"WARNING: {len(errors)} of {len(section_keys)} sections failed for {area_name}.")
+    return generated, errors
+
+def _failed_section_body(area_name: str, section_key: str, error: UpstreamError, depth: ResearchDepth) -> str:
+    actual_section_title = depth.section_title(area_name, section_key)
+    return f"## {actual_section_title}\n\n*This section could not be generated at this time. {error}*"
+
+async def _conduct_sectional_research(area_name: str, report_progress, deadline: Deadline, depth: ResearchDepth):
+    # Returns (markdown, {key: references}, {key: generated_at}); failed sections get a placeholder and generated_at 0,
+    # so the next refresh regenerates them.
+    generated, errors = await _research_sections(area_name, depth.section_keys, report_progress, deadline, depth)
+    now = time.time()
+    section_bodies = [generated[key][0] if key in generated else _failed_section_body(area_name, key, errors[key], depth) for key in depth.section_keys]
+    references_by_key = {key: references for key, (_, references) in generated.items()}
+    markdown = _assemble_sectional_report(area_name, section_bodies, _merge_references(references_by_key.values()))
+    return markdown, references_by_key, {key: (now if key in generated else 0.0) for key in depth.section_keys}
+
+# --- Per-section freshness and incremental refresh ---
+# Every report record carries a "sections" index: where each section of its depth sits in the markdown,
+# when it was generated, how long it stays fresh, which CHART_DATA directives it holds and (for sectional runs) its
+# sources. refresh_report_sections() regenerates only the stale sections and reuses the rest as they are.
+# Statistics-heavy sections go stale sooner than narrative ones; override per section with SECTION_TTL_<KEY>_SECONDS.
+SECTION_TTL_DEFAULT_SECONDS = float(os.getenv("SECTION_TTL_SECONDS", 30 * 24 * 3600))
+_SECTION_TTL_DEFAULTS = {
+    "major_diseases": 7 * 24 * 3600,
+    "emerging_risks": 7 * 24 * 3600,
+    "govt_schemes": 7 * 24 * 3600,
+    "healthcare_system": 7 * 24 * 3600,
+}
+MIN_REPORT_TTL_SECONDS = 300 # floor for a record whose sections are already stale (e.g. a failed one), so it isn't refreshed on every request
+
+def section_ttl_seconds(section_key: str) -> float:
+    override = os.getenv(f"SECTION_TTL_{section_key.upper()}_SECONDS")
+    if override is not None:
+        return float(override)
+    return float(_SECTION_TTL_DEFAULTS.get(section_key, SECTION_TTL_DEFAULT_SECONDS))
+
+def _normalize_heading(title: str) -> str:
+    return " ".join(title.strip("*`: ").lower().split())
+
+def _index_sections(area_name: str, markdown: str, outline: list, generated_at: dict, references_by_key: dict = None, depth: ResearchDepth = None) -> dict:
+    # Matches H2 headings to the depth's section keys by their exact (renumbered) guide title, falling back to the
+    # section number ("2. ..."), since single-prompt runs don't always reproduce the titles verbatim.
+    depth = depth or RESEARCH_DEPTHS[DEEP_RESEARCH_DEPTH]
+    by_title, by_number = {}, {}
+    for key in depth.section_keys:
+        title = depth.section_title(area_name, key)
+        by_title[_normalize_heading(title)] = key
+        number_match = _SECTION_NUMBER_PATTERN.match(title)
+        if number_match:
+            by_number[number_match.group(1)] = key
+
+    h2_headings = [entry for entry in outline if entry["level"] == 2]
+    sections = {}
+    for position, entry in enumerate(h2_headings):
+        number_match = _SECTION_NUMBER_PATTERN.match(entry["title"])
+        key = by_title.get(_normalize_heading(entry["title"])) or (by_number.get(number_match.group(1)) if number_match else None)
+        if key is None or key in sections:
+            continue
+        start = entry["offset"]
+        end = h2_headings[position + 1]["offset"] if position + 1 < len(h2_headings) else len(markdown)
+        sections[key] = {
+            "title": entry["title"],
+            "start": start,
+            "end": end,
+            "generated_at": generated_at.get(key, 0.0),
+            "ttl_seconds": section_ttl_seconds(key),
+            "directive_start": markdown.count("CHART_DATA:", 0, start),
+            "directive_count": markdown.count("CHART_DATA:", start, end),
+            "references": (references_by_key or {}).get(key, []),
+        }
+    return sections
+
+def stale_sections(record: dict, now: float = None) -> list:
+    # Section keys of the report's depth (in report order) that are past their TTL or missing from the report.
+    now = now or time.time()
+    sections = record.get("sections") or {}
+    return [key for key in report_depth(record).section_keys
+            if key not in sections or sections[key]["generated_at"] + sections[key]["ttl_seconds"] <= now]
+
+def has_reusable_sections(record: dict) -> bool:
+    return bool(record.get("sections")) and len(stale_sections(record)) < len(report_depth(record).section_keys)
+
+def report_ttl_seconds(report_data: dict) -> Optional[float]:
+    # A report expires when its first section goes stale; None (the store's default TTL) if it has no section index.
+    sections = report_data.get("sections")
+    if not sections:
+        return None
+    expires_at = min(section["generated_at"] + section["ttl_seconds"] for section in sections.values())
+    return max(MIN_REPORT_TTL_SECONDS, expires_at - time.time())
+
+async def refresh_report_sections(record: dict, section_keys: list = None, progress_callback=None) -> dict:
+    # Regenerates the stale sections plus any in section_keys and reuses the others, including their charts, which
+    # are only renumbered. The title page, contents and references are rebuilt. Returns a new report dict like
+    # conduct_deep_research, with a "last_refresh" summary. Sections that fail to refresh keep their previous text.
+    def report_progress(stage: str):
+        if progress_callback:
+            progress_callback(stage)
+
+    area_name = record["area_name"]
+    depth = report_depth(record) # the refreshed report keeps its depth, sections and models
+    old_markdown = record["full_report_markdown"]
+    old_sections = record.get("sections")
+    if old_sections is None: # stored before sections were indexed; treat the whole report as generated with the record
+        outline = record.get("outline") or extract_report(old_markdown, area_name, parse_charts=False).outline
+        old_sections = _index_sections(area_name, old_markdown, outline, {key: record.get("created_at", 0.0) for key in depth.section_keys}, depth=depth)
+        record = {**record, "sections": old_sections}
+    to_refresh = [key for key in depth.section_keys if key in stale_sections(record) or key in (section_keys or ())]
+    print(f"Refreshing {len(to_refresh)} of {len(depth.section_keys)} sections for {area_name} ({depth.name}): {', '.join(to_refresh) or 'none'}.")
+
+    report_progress("refreshing_sections")
+    # require_any=False: even if every section fails, the report keeps its previous text and lists them as failed.
+    generated, errors = await _research_sections(area_name, to_refresh, report_progress, Deadline(depth.deadline_seconds), depth, require_any=False) if to_refresh else ({}, {})
+
+    now = time.time()
+    section_bodies, references_by_key, generated_at, charts_by_key = [], {}, {}, {}
+    for key in depth.section_keys:
+        old = old_sections.get(key)
+        if key in generated:
+            body, references_by_key[key] = generated[key]
+            generated_at[key] = now
+            with timed(POSTPROCESS_DURATION, "postprocess extract", stage="extract"):
+                charts_by_key[key] = extract_report(body, area_name).charts # directive_index relative to the section
+        elif old is not None:
+            body = old_markdown[old["start"]:old["end"]].strip()
+            references_by_key[key] = old["references"]
+            generated_at[key] = old["generated_at"]
+            charts_by_key[key] = [{**chart, "directive_index": chart["directive_index"] - old["directive_start"]}
+                                  for chart in record.get("charts", [])
+                                  if old["directive_start"] <= chart.get("directive_index", -1) < old["directive_start"] + old["directive_count"]]
+        else:
+            body = _failed_section_body(area_name, key, errors[key], depth)
+            generated_at[key] = 0.0
+            charts_by_key[key] = []
+        section_bodies.append(body)
+
+    references = _merge_references([record.get("unattributed_references", []), *references_by_key.values()])
+    markdown = _assemble_sectional_report(area_name, section_bodies, references)
+    extracted = extract_report(markdown, area_name, parse_charts=False)
+    sections = _index_sections(area_name, markdown, extracted.outline, generated_at, references_by_key, depth)
+    charts = [{**chart, "directive_index": chart["directive_index"] + sections[key]["directive_start"]}
+              for key in depth.section_keys if key in sections for chart in charts_by_key[key]]
+
+    refreshed = [key for key in to_refresh if key in generated]
+    print(f"Refreshed {len(refreshed)} sections for {area_name} ({len(errors)} failed, {len(depth.section_keys) - len(to_refresh)} reused).")
+    return _with_structure({
+        "report_id": record["report_id"],
+        "area_name": area_name,
+        "depth": depth.name,
+        "full_report_markdown": markdown,
+        "charts": charts,
+        "outline": extracted.outline,
+        "references": extracted.references,
+        "sections": sections,
+        "unattributed_references": record.get("unattributed_references", []),
+        "last_refresh": {
+            "refreshed_at": now,
+            "refreshed": refreshed,
+            "reused": [key for key in depth.section_keys if key not in to_refresh],
+            "failed": {key: str(error) for key, error in errors.items()},
+        },
+    })
+
+def _extract_report_timed(markdown: str, area_name: str):
+    with timed(POSTPROCESS_DURATION, "postprocess extract", stage="extract"):
+        extracted = extract_report(markdown, area_name)
+    CHART_PARSE_DURATION.observe(extracted.chart_parse_seconds)
+    return extracted
+
+def report_structure(report_data: dict) -> dict:
+    # The structured form (see report_parser.build_report_structure), keyed like the "sections" index.
+    keys_by_start = {section["start"]: key for key, section in (report_data.get("sections") or {}).items()}
+    outline = report_data.get("outline")
+    references = report_data.get("references")
+    if outline is None or references is None: # records stored before the outline was kept
+        extracted = extract_report(report_data["full_report_markdown"], report_data["area_name"], parse_charts=False)
+        outline, references = extracted.outline, extracted.references
+    with timed(POSTPROCESS_DURATION, "postprocess structure", stage="structure"):
+        return build_report_structure(report_data["full_report_markdown"], report_data.get("charts", []), outline, references, keys_by_start)
+
+def _with_structure(report_data: dict) -> dict:
+    report_data["structure"] = report_structure(report_data)
+    return report_data
+
+async def stream_deep_research(area_name: str, depth: str = None):
+    # Streaming variant of conduct_deep_research. Yields (event, data) tuples:
+    #   ("status", {"stage": ...}), ("content", {"delta": markdown}), ("chart", chart_dict) as soon as the
+    #   CHART_DATA line is complete, and finally ("done", report_data) with the same shape conduct_deep_research returns.
+    # Upstream failures raise an UpstreamError subclass (see upstream.py).
+    research_depth = get_research_depth(depth)
+    print(f"Starting STREAMING HEALTH ANALYSIS ({research_depth.name}) for area: {area_name} using {research_depth.model}")
+    yield "status", {"stage": "building_prompt"}
+    mega_prompt = research_depth.prompt(area_name)
+
+    yield "status", {"stage": "waiting_for_model"}
+    cleaner = StreamingReportCleaner()
+    line_buffer = ""
+    streamed_chart_count = 0
+    first_content = True
+
+    async def _drain(text: str):
+        nonlocal line_buffer, streamed_chart_count
+        line_buffer += text
+        *complete_lines, line_buffer = line_buffer.split("\n")
+        for directive in chart_directives("\n".join(complete_lines)):
+            chart = parse_chart_directive(directive, streamed_chart_count, area_name)
+            streamed_chart_count += 1
+            if chart:
+                yield "chart", chart
+
+    async for raw_delta in stream_perplexity_response(prompt_content=mega_prompt, model_name=research_depth.model, max_tokens=research_depth.max_tokens, temperature=0.3,
+                                                      deadline=Deadline(research_depth.deadline_seconds), priority=PRIORITY_RESEARCH, budget=research_depth.budget):
+        text = cleaner.feed(raw_delta)
+        if not text:
+            continue
+        if first_content:
+            first_content = False
+            yield "status", {"stage": "streaming"}
+        yield "content", {"delta": text}
+        async for event in _drain(text):
+            yield event
+
+    tail = cleaner.finish()
+    if tail:
+        yield "content", {"delta": tail}
+    async for event in _drain(tail + "\n"):
+        yield event
+
+    # The final report is built from the whole cleaned text exactly like the non-streaming path,
+    # so the cached report is identical regardless of which endpoint produced it.
+    yield "status", {"stage": "parsing_charts"}
+    full_report_markdown_content = cleaner.cleaned_content
+    extracted = _extract_report_timed(full_report_markdown_content, area_name)
+    report_data = {
+        "report_id": generate_report_id(area_name, research_depth.name),
+        "area_name": area_name,
+        "depth": research_depth.name,
+        "full_report_markdown": full_report_markdown_content,
+        "charts": extracted.charts,
+        "outline": extracted.outline,
+        "references": extracted.references,
+        "sections": _index_sections(area_name, full_report_markdown_content, extracted.outline,
+                                    {key: time.time() for key in research_depth.section_keys}, depth=research_depth),
+        "unattributed_references": extracted.references,
+    }
+    _with_structure(report_data)
+    print(f"Finished STREAMING HEALTH ANALYSIS for area: {area_name} ({len(report_data['charts'])} charts).")
+    yield "done", report_data
+
+async def conduct_deep_research(area_name: str, progress_callback=None, mode: str = None, depth: str = None):
+    # progress_callback(stage: str) is optional; the job API uses it to report where a long run currently is.
+    # mode: "single" or "sectional"; defaults to RESEARCH_MODE. depth: a RESEARCH_DEPTHS name; defaults to
+    # DEFAULT_RESEARCH_DEPTH. Upstream failures raise an UpstreamError subclass.
+    mode = (mode or RESEARCH_MODE).lower()
+    research_depth = get_research_depth(depth)
+    def report_progress(stage: str):
+        if progress_callback:
+            progress_callback(stage)
+
+    print(f"Starting COMPREHENSIVE HEALTH ANALYSIS ({'Sectional' if mode == 'sectional' else 'Single Doc'} Prompt, {research_depth.name}) for area: {area_name} using {research_depth.model}")
+    report_id = generate_report_id(area_name, research_depth.name)
 
     report_data = {
         "report_id": report_id,
         "area_name": area_name,
+        "depth": research_depth.name,
         "full_report_markdown": "",
         "charts": [],
-        "full_text_for_follow_up": ""
     }
 
-    mega_prompt = _build_single_document_prompt_from_structure(area_name)
+    deadline = Deadline(research_depth.deadline_seconds)
+    # A single prompt can't attribute its sources to sections, so its References list is carried over as a whole on refresh.
+    references_by_key, generated_at = {}, {key: time.time() for key in research_depth.section_keys}
+    if mode == "sectional":
+        full_report_markdown_content, references_by_key, generated_at = await _conduct_sectional_research(area_name, report_progress, deadline, research_depth)
+    else:
+        report_progress("building_prompt")
+        mega_prompt = research_depth.prompt(area_name)
 
-    estimated_tokens = len(mega_prompt) / 3.7 
-    print(f"Structured Single Prompt Estimated length: ~{len(mega_prompt)} chars, ~{estimated_tokens:.0f} tokens.")
+        estimated_tokens = len(mega_prompt) / 3.7 
+        print(f"Structured Single Prompt Estimated length: ~{len(mega_prompt)} chars, ~{estimated_tokens:.0f} tokens.")
 
-    full_report_markdown_content = await get_perplexity_response(
-        prompt_content=mega_prompt,
-        model_name=RESEARCH_MODEL_NAME,
-        max_tokens=8192, # Sufficient for ~5000+ words
-        temperature=0.3 
-    )
+        report_progress("waiting_for_model")
+        full_report_markdown_content = await get_perplexity_response(
+            prompt_content=mega_prompt,
+            model_name=research_depth.model,
+            max_tokens=research_depth.max_tokens, # 8192 for deep: sufficient for ~5000+ words
+            temperature=0.3,
+            deadline=deadline,
+            priority=PRIORITY_RESEARCH,
+            budget=research_depth.budget,
+        )
 
     report_data["full_report_markdown"] = full_report_markdown_content
-    report_data["full_text_for_follow_up"] = full_report_markdown_content # This will be the cleaned version
 
-    if full_report_markdown_content.startswith("Error:"):
-        print(f"Report generation failed for {area_name}. API Error: {full_report_markdown_content}")
-        return report_data
-    
-    # Chart parsing logic remains the same, operating on the cleaned full_report_markdown_content
-    chart_pattern_str = r'CHART_DATA:\s*TYPE=(?P<type>\w+)\s*TITLE="(?P<title>[^"]+)"\s*LABELS=(?P<labels>\[[^\]]*\])\s*DATA=(?P<data>\[[^\]]*\])(?:\s*SOURCE="(?P<source>[^"]+)")?'
-    chart_matches = re.finditer(chart_pattern_str, full_report_markdown_content)
-    temp_charts_list = []
-    for match_idx_chart, chart_match_item in enumerate(chart_matches):
-        try:
-            chart_dict = chart_match_item.groupdict()
-            chart_type = chart_dict['type'].lower()
-            chart_title = re.sub(r'[^\w\s\-\(\)%]', '', chart_dict['title']).strip()
-            labels_str = chart_dict['labels']
-            data_str = chart_dict['data']
-            chart_source = chart_dict.get('source')
-
-            try: labels = json.loads(labels_str)
-            except json.JSONDecodeError: labels = ast.literal_eval(labels_str)
-            
-            try: raw_data_points = json.loads(data_str)
-            except json.JSONDecodeError: raw_data_points = ast.literal_eval(data_str)
-
-            if not (isinstance(labels, list) and isinstance(raw_data_points, list) and len(labels) == len(raw_data_points) and len(labels) > 0):
-                print(f"Chart data format/length mismatch for '{chart_title}' (Match {match_idx_chart}). Labels: {len(labels)}, Data: {len(raw_data_points)}. Skipping.")
-                continue
-            
-            if len(labels) > 12: 
-                print(f"Warning: Chart '{chart_title}' has {len(labels)} data points, truncating to 12 for display.")
-                labels = labels[:12]
-                raw_data_points = raw_data_points[:12]
-
-            numeric_data_points = []
-            valid_points = True
-            for point_idx, point in enumerate(raw_data_points):
-                try:
-                    val_str = str(point).strip().replace('%', '')
-                    cleaned_val_str = re.sub(r'[^\d\.\-eE]', '', val_str) if isinstance(val_str, str) else str(point)
-                    if cleaned_val_str: numeric_data_points.append(float(cleaned_val_str))
-                    elif isinstance(point, (int, float)): numeric_data_points.append(float(point))
-                    else: raise ValueError(f"Non-convertible point: '{point}'")
-                except (ValueError, TypeError) as e_conv:
-                    print(f"Could not convert chart data point '{point}' for '{chart_title}'. Error: {e_conv}. Skipping chart.")
-                    valid_points = False; break
-            
-            if valid_points and numeric_data_points:
-                if len(labels) == len(numeric_data_points):
-                    chart_dataset_label = chart_title 
-                    if chart_source:
-                        chart_dataset_label += f" (Source: {chart_source})"
-
-                    temp_charts_list.append({
-                        "type": chart_type, "title": chart_title, "labels": [str(l) for l in labels],
-                        "datasets": [{"label": chart_dataset_label, "data": numeric_data_points}],
-                        "source": chart_source
-                    })
-                    print(f"Successfully parsed chart: '{chart_title}' for {area_name}")
-                else:
-                    print(f"Data point conversion/truncation led to mismatch for chart '{chart_title}'. Skipping.")
-            elif not numeric_data_points and valid_points:
-                 print(f"Chart '{chart_title}' for {area_name} had no numeric data after parsing. Skipping.")
-        except Exception as e_chart_parse:
-            print(f"Error parsing CHART_DATA (Match {match_idx_chart}): {e_chart_parse}. Raw: {chart_match_item.group(0)}")
-    
-    report_data["charts"] = temp_charts_list
+    # One scan over the cleaned markdown yields the charts, the H2/H3 outline and the References entries
+    report_progress("parsing_charts")
+    extracted = _extract_report_timed(full_report_markdown_content, area_name)
+    report_data["charts"] = extracted.charts
+    report_data["outline"] = extracted.outline
+    report_data["references"] = extracted.references
+    report_data["sections"] = _index_sections(area_name, full_report_markdown_content, extracted.outline, generated_at, references_by_key, research_depth)
+    report_data["unattributed_references"] = [] if mode == "sectional" else extracted.references
+    _with_structure(report_data)
     print(f"Total charts parsed and ready for rendering: {len(report_data['charts'])}")
     
     print(f"Finished COMPREHENSIVE HEALTH ANALYSIS for area: {area_name}.")
@@ -354,7 +1195,7 @@ async def answer_follow_up_question(question: str, report_context: str) -> str:
     )
     
     user_prompt_content = (
-        f"Here is the health report content:\n"
+        f"Here are the sections of the health report relevant to the question:\n"
         f"--- BEGIN REPORT CONTEXT ---\n{report_context}\n--- END REPORT CONTEXT ---\n\n"
         f"My question is: {question}\n\n"
         f"Based on the report, what is the answer? If it's not mentioned, please say so."
@@ -365,10 +1206,53 @@ async def answer_follow_up_question(question: str, report_context: str) -> str:
     # For follow-up, we don't need the <think> tag system, as it's for direct Q&A.
     # We can use the default system prompt for `get_perplexity_response` or a simpler one.
     # Reusing the more elaborate system prompt used for report generation is fine, but we can simplify it.
-    return await get_perplexity_response(
-        prompt_content=user_prompt_content,
-        model_name=FOLLOW_UP_MODEL_NAME,
-        system_prompt_content=system_prompt_content, # This is specific to the follow-up
-        max_tokens=1024,
-        temperature=0.3
-    )
\ No newline at end of file
+    deadline = Deadline(FOLLOW_UP_DEADLINE_SECONDS)
+    def ask():
+        return get_perplexity_response(
+            prompt_content=user_prompt_content,
+            model_name=FOLLOW_UP_MODEL_NAME,
+            system_prompt_content=system_prompt_content, # This is specific to the follow-up
+            max_tokens=1024,
+            temperature=0.3,
+            deadline=deadline,
+            report_start_marker=None, # an answer, not a report: nothing to cut before a report title
+        )
+
+    start = time.perf_counter()
+    hedge_after = _follow_up_latency.percentile(95) if FOLLOW_UP_HEDGING else None
+    if hedge_after is None:
+        answer = await ask()
+    else:
+        answer = await _hedged(ask, max(hedge_after, FOLLOW_UP_HEDGE_MIN_DELAY))
+    _follow_up_latency.add(time.perf_counter() - start)
+    return answer
+
+_follow_up_latency = LatencyWindow(min_samples=FOLLOW_UP_HEDGE_MIN_SAMPLES)
+
+async def _hedged(call, hedge_after: float):
+    # Runs call(); if it hasn't finished after hedge_after seconds, starts a second identical call and returns
+    # whichever succeeds first (the other is cancelled). Raises the last error if both fail.
+    primary = asyncio.create_task(call())
+    pending = {primary}
+    last_error = None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        print(f"Follow-up call still running after {hedge_after:.2f}s (rolling p95); sending a hedged duplicate.")
+        pending.add(asyncio.create_task(call()))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled(): # exception() would raise CancelledError; fall through to the other attempt
+                    continue
+                if task.exception() is None:
+                    UPSTREAM_HEDGES.inc(outcome="primary_won" if task is primary else "hedge_won")
+                    return task.result()
+                last_error = task.exception()
+        UPSTREAM_HEDGES.inc(outcome="both_failed")
+        raise last_error or asyncio.CancelledError()
+    finally:
+        for task in pending:
+            task.cancel()
\ No newline at end of file
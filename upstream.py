@@ -0,0 +1,200 @@
+# upstream.py
+# Failure handling for Perplexity calls, used by services.py: typed errors (instead of "Error: ..." strings),
+# a deadline budget shared by every attempt of one request, a retry policy with exponential backoff that honours
+# Retry-After, a per-model circuit breaker and the rolling latency window that decides when /ask calls are hedged.
+import email.utils
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from metrics import CIRCUIT_STATE
+
+class UpstreamError(Exception):
+    # status_code is what our own API answers with; retryable errors may be retried within the deadline,
+    # and trips_breaker errors count towards opening the circuit breaker.
+    status_code = 502
+    retryable = False
+    trips_breaker = False
+
+    def __init__(self, message: str, upstream_status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.upstream_status = upstream_status
+        self.retry_after = retry_after
+
+class UpstreamConfigurationError(UpstreamError):
+    status_code = 500
+
+class UpstreamRequestError(UpstreamError):
+    # 4xx other than 429, or a response we cannot use. Retrying would get the same answer.
+    pass
+
+class UpstreamRateLimitedError(UpstreamError):
+    status_code = 503
+    retryable = True
+
+class UpstreamServerError(UpstreamError):
+    retryable = True
+    trips_breaker = True
+
+class UpstreamConnectionError(UpstreamError):
+    retryable = True
+    trips_breaker = True
+
+class UpstreamTimeoutError(UpstreamError):
+    status_code = 504
+    retryable = True
+    trips_breaker = True
+
+class ConnectionPoolBusyError(UpstreamError):
+    # Our own connection pool is exhausted; says nothing about the upstream's health.
+    status_code = 503
+    retryable = True
+
+class DeadlineExceededError(UpstreamError):
+    status_code = 504
+
+class CircuitOpenError(UpstreamError):
+    status_code = 503
+
+class Deadline:
+    # Overall time budget for one logical request, shared by its retries (and by every section of a sectional run).
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # attempt is the number of the attempt that just failed (1-based). Full jitter unless the upstream said when to come back.
+        if retry_after is not None:
+            return max(0.0, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either delta-seconds or an HTTP date.
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+_CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive upstream failures and fails fast for reset_seconds; then lets a
+    # single trial call through (half-open), which closes the circuit on success or re-opens it on failure.
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self.rejected = 0
+        CIRCUIT_STATE.set(0, model=name)
+
+    def before_call(self):
+        if self.state == CIRCUIT_OPEN:
+            wait = self.opened_at + self.reset_seconds - time.monotonic()
+            if wait > 0:
+                self.rejected += 1
+                raise CircuitOpenError(f"The AI API ({self.name}) is currently unavailable. Please try again in {wait:.0f}s.", retry_after=wait)
+            self._set_state(CIRCUIT_HALF_OPEN)
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self._trial_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(f"The AI API ({self.name}) is recovering; a trial request is in progress. Please try again shortly.", retry_after=1.0)
+            self._trial_in_flight = True
+
+    def release(self):
+        # The call ended without a verdict (e.g. it was cancelled); let the next one be the trial instead.
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != CIRCUIT_CLOSED:
+            print(f"Circuit breaker for {self.name} closed; upstream calls are succeeding again.")
+            self._set_state(CIRCUIT_CLOSED)
+
+    def record_failure(self, error: UpstreamError):
+        if isinstance(error, CircuitOpenError):
+            return
+        trial = self._trial_in_flight
+        self._trial_in_flight = False
+        if not error.trips_breaker:
+            # The upstream answered (4xx, 429), which proves it is reachable, or the problem is on our side
+            # (pool, scheduler, deadline), which says nothing either way. Neither counts as a failure.
+            if trial and error.upstream_status is not None:
+                self.record_success()
+            return
+        self.consecutive_failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                print(f"Circuit breaker for {self.name} opened after {self.consecutive_failures} consecutive failures; failing fast for {self.reset_seconds:.0f}s.")
+            self.opened_at = time.monotonic()
+            self._set_state(CIRCUIT_OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        CIRCUIT_STATE.set(_CIRCUIT_STATE_VALUES[state], model=self.name)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, "rejected": self.rejected}
+
+class LatencyWindow:
+    # Rolling window of recent successful call latencies (seconds); percentile() is None until min_samples are in.
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 4)),
+    base_delay=float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", 1.0)),
+    max_delay=float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", 30.0)),
+)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv("UPSTREAM_CIRCUIT_RESET_SECONDS", 30.0))
+
+_circuit_breakers = {}
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    breaker = _circuit_breakers.get(model_name)
+    if breaker is None:
+        breaker = _circuit_breakers[model_name] = CircuitBreaker(model_name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+    return breaker
+
+def circuit_breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in _circuit_breakers.items()}